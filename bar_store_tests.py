@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Tests for the bar_store module."""
+import calendar
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+from ibapipy.benchmarks.mock_tws import MockTWS
+from ibapipy.core.bar_store import BarStore, store_key
+from ibapipy.core.client_socket import ClientSocket
+from ibapipy.core.historical_scheduler import HistoricalScheduler, Pacer, \
+    duration_seconds
+from ibapipy.data.contract import Contract
+import ibapipy.config as config
+
+
+# 2014-10-17 00:00:00 UTC
+START_MS = 1413504000000
+
+# Milliseconds in an hour
+HOUR_MS = 3600000
+
+
+def create_contract():
+    """Return a contract with a con_id."""
+    contract = Contract('STK', 'AAPL', 'USD', 'SMART')
+    contract.con_id = 265598
+    return contract
+
+
+def minute_bars(start_ms, end_ms):
+    """Return the columns of one-minute bars from start_ms to end_ms."""
+    milliseconds = np.arange(start_ms, end_ms, 60000, dtype=np.int64)
+    return {'milliseconds': milliseconds, 'open': milliseconds / 1e12,
+            'high': milliseconds / 1e12, 'low': milliseconds / 1e12,
+            'close': milliseconds / 1e12, 'volume': milliseconds % 7,
+            'count': milliseconds % 5}
+
+
+class BarStoreTests(unittest.TestCase):
+    """Test cases for the BarStore class."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_and_read(self):
+        store = BarStore(self.directory)
+        key = store_key(create_contract(), '1 min')
+        store.write(key, minute_bars(START_MS, START_MS + HOUR_MS), START_MS,
+                    START_MS + HOUR_MS)
+        store.write(key, minute_bars(START_MS + 2 * HOUR_MS,
+                                     START_MS + 3 * HOUR_MS),
+                    START_MS + 2 * HOUR_MS, START_MS + 3 * HOUR_MS)
+        self.assertEqual(store.missing(key, START_MS, START_MS + 4 * HOUR_MS),
+                         [(START_MS + HOUR_MS, START_MS + 2 * HOUR_MS),
+                          (START_MS + 3 * HOUR_MS, START_MS + 4 * HOUR_MS)])
+        # A new store sees the same bars through memory-mapped views
+        store = BarStore(self.directory)
+        everything = store.read(key)
+        bars = store.read(key, START_MS + 30 * 60000, START_MS + 2 * HOUR_MS)
+        self.assertEqual(len(everything['close']), 120)
+        self.assertEqual(len(bars['milliseconds']), 30)
+        self.assertTrue(isinstance(bars['close'], np.memmap))
+        self.assertTrue(np.shares_memory(bars['close'], everything['close']))
+        # Overlapping writes replace bars and merge the ranges
+        store.write(key, minute_bars(START_MS, START_MS + 3 * HOUR_MS),
+                    START_MS, START_MS + 3 * HOUR_MS)
+        self.assertEqual(len(store.read(key)['close']), 180)
+        self.assertEqual(store.coverage(key).tolist(),
+                         [[START_MS, START_MS + 3 * HOUR_MS]])
+
+    def test_fetch(self):
+        requests = []
+        def script(connection):
+            while True:
+                fields = [connection.read_field() for index in range(20)]
+                req_id, end, duration = int(fields[2]), fields[14], fields[16]
+                end_ms = calendar.timegm(time.strptime(
+                    end, '%Y%m%d %H:%M:%S GMT')) * 1000
+                start_ms = end_ms - duration_seconds(duration) * 1000
+                requests.append((start_ms, end_ms))
+                bars = minute_bars(start_ms, end_ms)['milliseconds']
+                message = [config.HISTORICAL_DATA, 3, req_id, '', '',
+                           len(bars)]
+                for milliseconds in bars.tolist():
+                    message.extend((milliseconds // 1000, 1.0, 2.0, 0.5, 1.5,
+                                    100, 1.2, 'false', 10))
+                connection.send(message)
+        server = MockTWS(script)
+        port = server.start()
+        scheduler = HistoricalScheduler(pacer=Pacer(identical_seconds=0.1))
+        client = ClientSocket(historical_scheduler=scheduler)
+        client.connect('127.0.0.1', port, 1)
+        store = BarStore(self.directory)
+        contract = create_contract()
+        try:
+            bars = store.fetch(client, contract, START_MS + HOUR_MS,
+                               START_MS + 2 * HOUR_MS, '1 min', timeout=10)
+            self.assertEqual(len(bars['close']), 60)
+            self.assertEqual(len(requests), 1)
+            # Only the missing hours on either side are requested
+            bars = store.fetch(client, contract, START_MS,
+                               START_MS + 3 * HOUR_MS, '1 min', timeout=10)
+            self.assertEqual(sorted(requests[1:]),
+                             [(START_MS, START_MS + HOUR_MS),
+                              (START_MS + 2 * HOUR_MS,
+                               START_MS + 3 * HOUR_MS)])
+            self.assertEqual(len(bars['close']), 180)
+            self.assertTrue(np.all(np.diff(bars['milliseconds']) == 60000))
+            store.fetch(client, contract, START_MS, START_MS + 3 * HOUR_MS,
+                        '1 min', timeout=10)
+            self.assertEqual(len(requests), 3)
+        finally:
+            client.disconnect()
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""End-to-end throughput and latency of the client against a mock TWS.
+
+Each scenario connects a client using one transport (the multi-process
+ClientSocket with queues or with shared memory rings between its processes,
+or the asyncio based AsyncClientSocket) and one dispatch mode to a MockTWS
+streaming synthetic traffic, and reports:
+
+* the number of messages sent and callbacks made;
+* messages per second, from connecting to the last callback;
+* p50 and p99 latency from the wire to the callback, in milliseconds; and
+* the peak resident set size of the client process and of its largest child
+  process, in megabytes (Unix only).
+
+Each scenario runs in its own process so memory figures are not shared.
+
+Run with:
+
+    python -m ibapipy.benchmarks.client_benchmark --duration 2
+
+"""
+from multiprocessing import Process, Queue
+from ibapipy.benchmarks.mock_tws import (DEFAULT_RATES, SYMBOL_COUNT,
+                                         MockTWS, Traffic)
+from ibapipy.core.async_client_socket import AsyncClientSocket
+from ibapipy.core.client_socket import ClientSocket
+from ibapipy.core.conflating_queue import ConflatingQueue
+from ibapipy.core.dispatcher import Dispatcher
+from ibapipy.core.network_handler import (QUEUE_TRANSPORT,
+                                          SHARED_MEMORY_TRANSPORT)
+from ibapipy.core.quote_book import QuoteBook
+import argparse
+import asyncio
+import multiprocessing
+import sys
+import threading
+import time
+import ibapipy.core.reader as reader
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Transport and dispatch mode of each scenario
+SCENARIOS = (('process', 'direct'),
+             ('process', 'dispatcher'),
+             ('process', 'conflating'),
+             ('process', 'quote_book'),
+             ('process', 'columns'),
+             ('shared_memory', 'direct'),
+             ('shared_memory', 'quote_book'),
+             ('asyncio', 'direct'),
+             ('asyncio', 'quote_book'),
+             ('asyncio', 'columns'))
+
+# Seconds to wait for the end of the traffic beyond its duration
+TIMEOUT = 60
+
+
+class Recorder:
+    """Callbacks that count calls and record wire-to-callback latencies.
+
+    Used as a mixin ahead of ClientSocket or AsyncClientSocket.
+
+    """
+
+    def reset(self):
+        """Clear the counters and latencies."""
+        self.callbacks = 0
+        self.latencies = []
+        self.sent = 0
+        self.finished = threading.Event()
+
+    def current_time(self, seconds):
+        self.sent = seconds
+        self.finished.set()
+
+    def exec_details(self, req_id, contract, execution):
+        self.latencies.append(time.time() - execution.price)
+        self.callbacks += 1
+
+    def historical_data(self, req_id, date, open, high, low, close, volume,
+                        bar_count, wap, has_gaps):
+        self.callbacks += 1
+
+    def historical_data_columns(self, req_id, start_date, end_date, bars):
+        self.callbacks += 1
+
+    def open_order(self, req_id, contract, order):
+        self.latencies.append(time.time() - order.lmt_price)
+        self.callbacks += 1
+
+    def tick_price(self, req_id, tick_type, price, can_auto_execute):
+        self.latencies.append(time.time() - price)
+        self.callbacks += 1
+
+    def tick_size(self, req_id, tick_type, size):
+        self.callbacks += 1
+
+    def update_quote(self, req_id, tick):
+        self.latencies.append(time.time() - max(tick.bid, tick.ask))
+        self.callbacks += 1
+
+
+class ProcessClient(Recorder, ClientSocket):
+    pass
+
+
+class AsyncClient(Recorder, AsyncClientSocket):
+    pass
+
+
+def percentile(values, fraction):
+    """Return the value at the specified fraction of the sorted values."""
+    if len(values) == 0:
+        return 0.0
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+def peak_rss():
+    """Return the peak resident set size in megabytes of this process and of
+    its largest terminated child process.
+
+    """
+    if resource is None:
+        return 0.0, 0.0
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+def create_client(transport, mode):
+    """Return a client for the specified transport and dispatch mode."""
+    columns = mode == 'columns'
+    quote_book = None
+    if mode == 'quote_book':
+        # The traffic does not come from req_mkt_data() requests
+        quote_book = QuoteBook()
+        for req_id in range(1, SYMBOL_COUNT + 1):
+            quote_book.add(req_id)
+    if transport == 'asyncio':
+        client = AsyncClient(historical_columns=columns,
+                             quote_book=quote_book)
+    else:
+        client = ProcessClient(
+            historical_columns=columns, quote_book=quote_book,
+            conflating_queue=ConflatingQueue() if mode == 'conflating'
+            else None,
+            dispatcher=Dispatcher() if mode == 'dispatcher' else None,
+            transport=SHARED_MEMORY_TRANSPORT
+            if transport == 'shared_memory' else QUEUE_TRANSPORT)
+    client.reset()
+    return client
+
+
+def run_process_client(client, port, timeout):
+    """Connect a multi-process client, wait for the traffic to end and
+    return the elapsed time in seconds.
+
+    """
+    start = time.time()
+    client.connect('127.0.0.1', port, 1)
+    client.finished.wait(timeout)
+    elapsed = time.time() - start
+    listener = client.__listener_thread__
+    client.disconnect()
+    listener.join()
+    # Let the network handler processes exit so their usage is counted
+    end = time.time() + 5
+    while len(multiprocessing.active_children()) > 0 and time.time() < end:
+        time.sleep(0.05)
+    return elapsed
+
+
+async def run_async_client(client, port, timeout):
+    """Connect an asyncio client, wait for the traffic to end and return the
+    elapsed time in seconds.
+
+    """
+    start = time.time()
+    await client.connect('127.0.0.1', port, 1)
+    end = start + timeout
+    while not client.finished.is_set() and time.time() < end:
+        await asyncio.sleep(0.001)
+    elapsed = time.time() - start
+    await client.disconnect()
+    return elapsed
+
+
+def run_scenario(transport, mode, port, timeout, results):
+    """Run a single scenario and put a dictionary of its results in the
+    results queue.
+
+    """
+    client = create_client(transport, mode)
+    if transport == 'asyncio':
+        elapsed = asyncio.run(run_async_client(client, port, timeout))
+    else:
+        elapsed = run_process_client(client, port, timeout)
+    latencies = sorted(client.latencies)
+    rss, child_rss = peak_rss()
+    results.put({'transport': transport, 'mode': mode,
+                 'complete': client.finished.is_set(),
+                 'sent': client.sent, 'callbacks': client.callbacks,
+                 'rate': client.sent / elapsed,
+                 'p50': percentile(latencies, 0.5) * 1000,
+                 'p99': percentile(latencies, 0.99) * 1000,
+                 'rss': rss, 'child_rss': child_rss})
+
+
+def run(scenarios=SCENARIOS, rates=None, duration=1.0, bar_count=100):
+    """Run the specified scenarios one at a time against a MockTWS and return
+    a list of result dictionaries.
+
+    Keyword arguments:
+    scenarios -- sequence of (transport, mode) tuples (default: SCENARIOS)
+    rates     -- messages per second for each message type
+                 (default: mock_tws.DEFAULT_RATES)
+    duration  -- number of seconds of traffic per scenario (default: 1.0)
+    bar_count -- number of bars in each historical data message
+                 (default: 100)
+
+    """
+    server = MockTWS(Traffic(rates, duration, bar_count))
+    port = server.start()
+    results = Queue()
+    output = []
+    try:
+        for transport, mode in scenarios:
+            if mode == 'columns' and reader.np is None:
+                continue
+            process = Process(target=run_scenario,
+                              args=(transport, mode, port,
+                                    duration + TIMEOUT, results))
+            process.start()
+            output.append(results.get())
+            process.join()
+    finally:
+        server.stop()
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the client against a mock TWS.')
+    parser.add_argument('--duration', type=float, default=1.0)
+    parser.add_argument('--bar-count', type=int, default=100)
+    parser.add_argument('--transport',
+                        choices=('process', 'shared_memory', 'asyncio'))
+    parser.add_argument('--mode', choices=sorted(set(
+        mode for transport, mode in SCENARIOS)))
+    for method in sorted(DEFAULT_RATES):
+        parser.add_argument('--{0}-rate'.format(method.replace('_', '-')),
+                            type=float, default=DEFAULT_RATES[method],
+                            dest=method)
+    args = parser.parse_args()
+    rates = dict((method, getattr(args, method)) for method in DEFAULT_RATES)
+    scenarios = [(transport, mode) for transport, mode in SCENARIOS
+                 if args.transport in (None, transport) and
+                 args.mode in (None, mode)]
+    line = '{0:>13} {1:>11} {2:>8} {3:>10} {4:>10} {5:>8} {6:>8} {7:>7} ' \
+           '{8:>9}'
+    print(line.format('transport', 'mode', 'sent', 'callbacks', 'msgs/s',
+                      'p50 ms', 'p99 ms', 'RSS MB', 'child MB'))
+    for result in run(scenarios, rates, args.duration, args.bar_count):
+        print('{0:>13} {1:>11} {2:>8d} {3:>10d} {4:>10.0f} {5:>8.2f} '
+              '{6:>8.2f} {7:>7.1f} {8:>9.1f}{9}'.format(
+                  result['transport'], result['mode'], result['sent'],
+                  result['callbacks'], result['rate'], result['p50'],
+                  result['p99'], result['rss'], result['child_rss'],
+                  '' if result['complete'] else ' (timed out)'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Compare the throughput of the incremental FieldDecoder against the
+original decode() based loop used by the incoming listener.
+
+Run with:
+
+    python -m ibapipy.benchmarks.decode_benchmark
+
+"""
+from ibapipy.core.network_handler import FieldDecoder, decode
+import time
+import ibapipy.config as config
+
+
+# Number of synthetic historical data bars in the stream
+BAR_COUNT = 20000
+
+# Read sizes to benchmark
+CHUNK_SIZES = (64, 512, config.BUFFER_SIZE, 65536)
+
+# Size of the single large field used for the worst case (e.g. fundamental
+# data reports or long trading hours strings)
+LARGE_FIELD_SIZE = 500000
+
+# Fields making up a single bar of a historical data message
+BAR_FIELDS = ('20141017  09:30:00', '1.2345', '1.2350', '1.2340', '1.2348',
+              '1200', '1.2346', 'false', '18')
+
+
+def build_stream(bar_count):
+    """Return a historical data message with the specified number of bars
+    as it would appear on the wire.
+
+    Keyword arguments:
+    bar_count -- number of bars in the message
+
+    """
+    fields = [str(config.HISTORICAL_DATA), '3', '1', '20141016  09:30:00',
+              '20141017  09:30:00', str(bar_count)]
+    fields.extend(BAR_FIELDS * bar_count)
+    return (config.EOL.join(fields) + config.EOL).encode('utf-8')
+
+
+def build_large_field(size):
+    """Return a single field of the specified size as it would appear on the
+    wire.
+
+    Keyword arguments:
+    size -- number of characters in the field
+
+    """
+    return ('x' * size + config.EOL).encode('utf-8')
+
+
+def split_stream(stream, chunk_size):
+    """Return the stream split into reads of the specified size."""
+    return [stream[index:index + chunk_size]
+            for index in range(0, len(stream), chunk_size)]
+
+
+def run_decode(chunks):
+    """Decode the chunks the way the incoming listener originally did and
+    return the number of fields.
+
+    """
+    count = 0
+    data_buffer = b''
+    for raw_data in chunks:
+        data_buffer += raw_data
+        data, data_buffer = decode(data_buffer)
+        count += len(data)
+    return count
+
+
+def run_field_decoder(chunks):
+    """Decode the chunks with a FieldDecoder and return the number of
+    fields.
+
+    """
+    count = 0
+    decoder = FieldDecoder()
+    for raw_data in chunks:
+        count += len(decoder.feed(raw_data))
+    return count
+
+
+def measure(function, chunks, total_bytes, repeat=5):
+    """Return the best throughput of function in bytes per second along with
+    the number of fields it decoded.
+
+    """
+    best = None
+    for index in range(repeat):
+        start = time.perf_counter()
+        count = function(chunks)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return total_bytes / best, count
+
+
+def main():
+    streams = (('bars', build_stream(BAR_COUNT)),
+               ('large field', build_large_field(LARGE_FIELD_SIZE)))
+    line = '{0:>12} {1:>8} {2:>16} {3:>18} {4:>8}'
+    print(line.format('stream', 'chunk', 'decode() MB/s', 'FieldDecoder MB/s',
+                      'speedup'))
+    for name, stream in streams:
+        for chunk_size in CHUNK_SIZES:
+            chunks = split_stream(stream, chunk_size)
+            old_rate, old_count = measure(run_decode, chunks, len(stream))
+            new_rate, new_count = measure(run_field_decoder, chunks,
+                                          len(stream))
+            if old_count != new_count:
+                raise AssertionError('Field counts differ: {0} != {1}'.format(
+                    old_count, new_count))
+            print('{0:>12} {1:>8d} {2:>16.1f} {3:>18.1f} {4:>7.2f}x'.format(
+                name, chunk_size, old_rate / 1e6, new_rate / 1e6,
+                new_rate / old_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""Local stand-in for TWS used to test and benchmark the client without a
+live connection.
+
+A MockTWS accepts connections on a local port, performs the same handshake as
+TWS (client version in, server version and connection time out, client ID in)
+and then runs a script against the connection. The default script is a
+Traffic object that streams synthetic TICK_PRICE, TICK_SIZE, HISTORICAL_DATA,
+OPEN_ORDER and EXECUTION_DATA messages at configurable rates and finishes
+with a CURRENT_TIME message whose value is the number of messages sent.
+
+Prices in tick_price, open_order and exec_details messages carry the time the
+message was written (seconds since the Epoch), so clients can measure the
+latency from the wire to their callbacks.
+
+Run a standalone server with:
+
+    python -m ibapipy.benchmarks.mock_tws --port 4001
+
+"""
+from ibapipy.core.network_handler import FieldDecoder, encode_message
+from ibapipy.ibapipy_error import IBAPIPyError
+import argparse
+import socket
+import threading
+import time
+import ibapipy.config as config
+
+
+# Default messages per second for each message type
+DEFAULT_RATES = {'tick_price': 20000,
+                 'tick_size': 20000,
+                 'historical_data': 5,
+                 'open_order': 50,
+                 'exec_details': 50}
+
+# Seconds between two batches of messages written by a Traffic script
+BATCH_INTERVAL = 0.001
+
+# Number of distinct market data request IDs used for ticks
+SYMBOL_COUNT = 10
+
+# Request ID of the first historical data response
+HISTORICAL_REQ_ID = 1000
+
+
+class MockTWS:
+    """Minimal TWS server that runs a script against each connection."""
+
+    def __init__(self, script=None, host='127.0.0.1', port=0,
+                 server_version=config.MIN_SERVER_VERSION):
+        """Initialize a new instance of a MockTWS.
+
+        Keyword arguments:
+        script         -- function called with a MockConnection once the
+                          handshake has completed (default: Traffic())
+        host           -- address to listen on (default: '127.0.0.1')
+        port           -- port to listen on; 0 picks a free port
+                          (default: 0)
+        server_version -- server version reported to clients
+                          (default: config.MIN_SERVER_VERSION)
+
+        """
+        self.script = Traffic() if script is None else script
+        self.host = host
+        self.port = port
+        self.server_version = server_version
+        self.socket = None
+        self.thread = None
+        self.connections = []
+
+    def start(self):
+        """Start accepting connections in a background thread and return the
+        port being listened on.
+
+        """
+        if self.socket is not None:
+            return self.port
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(5)
+        self.port = self.socket.getsockname()[1]
+        self.thread = threading.Thread(target=self.accept)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        """Stop accepting connections and close the open ones."""
+        if self.socket is None:
+            return
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+        self.socket = None
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+
+    def accept(self):
+        """Accept connections until the server is stopped."""
+        while True:
+            try:
+                client_socket, address = self.socket.accept()
+            except (AttributeError, OSError):
+                return
+            connection = MockConnection(client_socket)
+            self.connections.append(connection)
+            thread = threading.Thread(target=self.serve, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def serve(self, connection):
+        """Perform the handshake and run the script on a connection."""
+        try:
+            connection.client_version = int(connection.read_field())
+            connection.send([self.server_version,
+                             time.strftime('%Y%m%d %H:%M:%S')])
+            connection.client_id = int(connection.read_field())
+            self.script(connection)
+            # Keep the connection open until the client goes away
+            while connection.read() is not None:
+                pass
+        except (IBAPIPyError, OSError):
+            pass
+        finally:
+            connection.close()
+
+
+class MockConnection:
+    """Server side of a single client connection."""
+
+    def __init__(self, client_socket):
+        """Initialize a new instance of a MockConnection.
+
+        Keyword arguments:
+        client_socket -- connected socket
+
+        """
+        self.socket = client_socket
+        self.decoder = FieldDecoder()
+        self.fields = []
+        self.client_version = 0
+        self.client_id = 0
+
+    def close(self):
+        """Close the connection."""
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+
+    def read(self):
+        """Read whatever the client sent and return the list of fields
+        completed by it, or None once the client has closed the connection.
+
+        """
+        data = self.socket.recv(config.BUFFER_SIZE)
+        if len(data) == 0:
+            return None
+        fields = self.decoder.feed(data)
+        self.fields.extend(fields)
+        return fields
+
+    def read_field(self):
+        """Return the next field sent by the client."""
+        while len(self.fields) == 0:
+            if self.read() is None:
+                raise IBAPIPyError('Connection closed by the client.')
+        return self.fields.pop(0)
+
+    def send(self, *messages):
+        """Write the specified messages, each a list of fields, in a single
+        call.
+
+        """
+        self.socket.sendall(b''.join([encode_message(*fields)
+                                      for fields in messages]))
+
+
+class Traffic:
+    """Script that streams synthetic messages at fixed rates."""
+
+    def __init__(self, rates=None, duration=1.0, bar_count=100):
+        """Initialize a new instance of a Traffic script.
+
+        Keyword arguments:
+        rates     -- dictionary of message type (tick_price, tick_size,
+                     historical_data, open_order, exec_details or
+                     real_time_bar) to messages per second
+                     (default: DEFAULT_RATES)
+        duration  -- number of seconds to stream for (default: 1.0)
+        bar_count -- number of bars in each historical data message
+                     (default: 100)
+
+        """
+        self.rates = dict(DEFAULT_RATES if rates is None else rates)
+        self.duration = duration
+        self.bar_count = bar_count
+        for method in self.rates:
+            if method not in MESSAGE_BUILDERS:
+                raise IBAPIPyError('Unknown message type: {0}'.format(method))
+
+    def __call__(self, connection):
+        """Stream the messages over the specified connection and return a
+        dictionary with the number sent of each type.
+
+        """
+        totals = dict((method, int(rate * self.duration))
+                      for method, rate in self.rates.items())
+        sent = dict((method, 0) for method in totals)
+        start = time.time()
+        while True:
+            now = time.time()
+            elapsed = now - start
+            messages = []
+            for method, rate in self.rates.items():
+                due = min(int(elapsed * rate), totals[method])
+                builder = MESSAGE_BUILDERS[method]
+                for sequence in range(sent[method], due):
+                    messages.append(builder(sequence, now, self.bar_count))
+                sent[method] = max(due, sent[method])
+            if len(messages) > 0:
+                connection.send(*messages)
+            if sent == totals:
+                break
+            time.sleep(BATCH_INTERVAL)
+        connection.send(current_time_message(sum(sent.values())))
+        return sent
+
+
+def current_time_message(seconds):
+    """Return the fields of a CURRENT_TIME message."""
+    return [config.CURRENT_TIME, 1, seconds]
+
+
+def exec_details_message(sequence, stamp, bar_count=0):
+    """Return the fields of an EXECUTION_DATA message for a fill of order
+    'sequence + 1' at price 'stamp'.
+
+    """
+    order_id = sequence + 1
+    return [config.EXECUTION_DATA, 9, -1, order_id,
+            # Contract fields
+            100 + sequence % SYMBOL_COUNT, 'SYM', 'STK', '', 0.0, '', '',
+            'SMART', 'USD', 'SYM',
+            # Execution fields
+            '{0:08x}.01'.format(order_id), time.strftime('%Y%m%d  %H:%M:%S'),
+            'DU000000', 'ISLAND', 'BOT', 100, stamp, order_id, 0, 0, 100,
+            stamp, '', '', '']
+
+
+def historical_data_message(sequence, stamp, bar_count=100):
+    """Return the fields of a HISTORICAL_DATA message with 'bar_count'
+    one-minute bars.
+
+    """
+    fields = [config.HISTORICAL_DATA, 3, HISTORICAL_REQ_ID + sequence,
+              '20141016  09:30:00', '20141017  09:30:00', bar_count]
+    for index in range(bar_count):
+        hour, minute = divmod(9 * 60 + 30 + index, 60)
+        date = '20141017  {0:02d}:{1:02d}:00'.format(hour % 24, minute)
+        fields.extend((date, 1.2345, 1.2350, 1.2340, 1.2348, 1200, 1.2346,
+                       'false', 18))
+    return fields
+
+
+def open_order_message(sequence, stamp, bar_count=0):
+    """Return the fields of an OPEN_ORDER message for a limit order with ID
+    'sequence + 1' and limit price 'stamp'.
+
+    """
+    order_id = sequence + 1
+    return [config.OPEN_ORDER, 31, order_id,
+            # Contract fields
+            100 + sequence % SYMBOL_COUNT, 'SYM', 'STK', '', 0.0, '',
+            'SMART', 'USD', 'SYM',
+            # Main order fields
+            'BUY', 100, 'LMT', stamp, 0.0, 'DAY', '', 'DU000000', 'O', 0, '',
+            0, order_id, 0, 0, 0.0, '', '', '', '', '', '', '', '', 0.0, '',
+            0, '', 0, 0, 0.0, 0.0, 0.0, 0.0, 0.0, 0, 0, 0, 0, 0, 0, 0, 0,
+            0.0, 0, 0, 0.0, 0,
+            # Delta neutral order type and aux price
+            '', 0.0,
+            # Continuous update through combo legs
+            0, 0, '', '', 0.0, 0, '', 0, 0, 0,
+            # Scale order fields
+            '', '', '',
+            # Hedge type
+            '',
+            # Clearing fields and under comp flag
+            0, '', '', 0, 0,
+            # Algo strategy
+            '',
+            # Order state
+            0, 'Submitted', '', '', '', '', '', '', '', '']
+
+
+def real_time_bar_message(sequence, stamp, bar_count=0):
+    """Return the fields of a REAL_TIME_BARS message for the 5 second bar
+    starting 'sequence' bars after 'stamp', with closing price 'stamp'.
+
+    """
+    seconds = int(stamp) - int(stamp) % 5 + sequence * 5
+    return [config.REAL_TIME_BARS, 1, 1 + sequence % SYMBOL_COUNT, seconds,
+            1.2345, 1.2350, 1.2340, stamp, 1200, 1.2346, 18]
+
+
+def tick_price_message(sequence, stamp, bar_count=0):
+    """Return the fields of a TICK_PRICE message alternating between bid and
+    ask with price 'stamp'.
+
+    """
+    tick_type = config.BID if sequence % 2 == 0 else config.ASK
+    return [config.TICK_PRICE, 6, 1 + (sequence // 2) % SYMBOL_COUNT,
+            tick_type, stamp, sequence, 1]
+
+
+def tick_size_message(sequence, stamp, bar_count=0):
+    """Return the fields of a TICK_SIZE message alternating between bid and
+    ask size with size 'sequence'.
+
+    """
+    tick_type = config.BID_SIZE if sequence % 2 == 0 else config.ASK_SIZE
+    return [config.TICK_SIZE, 6, 1 + (sequence // 2) % SYMBOL_COUNT,
+            tick_type, sequence]
+
+
+# Message type to function returning the fields of a single message
+MESSAGE_BUILDERS = {'exec_details': exec_details_message,
+                    'historical_data': historical_data_message,
+                    'open_order': open_order_message,
+                    'real_time_bar': real_time_bar_message,
+                    'tick_price': tick_price_message,
+                    'tick_size': tick_size_message}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a mock TWS server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=config.PORT)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--bar-count', type=int, default=100)
+    for method in sorted(DEFAULT_RATES):
+        parser.add_argument('--{0}-rate'.format(method.replace('_', '-')),
+                            type=float, default=DEFAULT_RATES[method],
+                            dest=method)
+    args = parser.parse_args()
+    rates = dict((method, getattr(args, method)) for method in DEFAULT_RATES)
+    server = MockTWS(Traffic(rates, args.duration, args.bar_count), args.host,
+                     args.port)
+    server.start()
+    print('Mock TWS listening on {0}:{1}'.format(args.host, server.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
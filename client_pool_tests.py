@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Tests for the ClientPool class."""
+import unittest
+from queue import Queue
+from ibapipy.benchmarks.mock_tws import MockTWS
+from ibapipy.core.client_pool import ClientPool
+from ibapipy.data.contract import Contract
+import ibapipy.config as config
+
+
+# Number of fields in each request handled by the mock server
+REQUEST_FIELDS = {config.REQ_HISTORICAL_DATA: 20,
+                  config.REQ_MKT_DATA: 17,
+                  config.CANCEL_MKT_DATA: 3}
+
+
+def script(connection):
+    """Answer market data with a bid equal to the client ID, or with an
+    error for the symbol 'BAD', and historical data with a single bar dated
+    with the client ID.
+
+    """
+    connection.send([config.NEXT_VALID_ID, 1, 100 * connection.client_id],
+                    [config.ERR_MSG, 2, -1, 2104, 'Farm connection is OK'])
+    while True:
+        message_id = int(connection.read_field())
+        fields = [connection.read_field()
+                  for index in range(REQUEST_FIELDS[message_id] - 1)]
+        req_id = int(fields[1])
+        if message_id == config.REQ_MKT_DATA and fields[3] == 'BAD':
+            connection.send([config.ERR_MSG, 2, req_id, 200,
+                             'No security definition'])
+        elif message_id == config.REQ_MKT_DATA:
+            connection.send([config.TICK_PRICE, 6, req_id, config.BID,
+                             float(connection.client_id), 1, 1])
+        elif message_id == config.REQ_HISTORICAL_DATA:
+            connection.send([config.HISTORICAL_DATA, 3, req_id, '', '', 1,
+                             str(connection.client_id), 1.0, 1.0, 1.0, 1.0,
+                             10, 1.0, 'false', 1])
+
+
+class ClientPoolTests(unittest.TestCase):
+    """Test cases for the ClientPool class."""
+
+    def test_routing(self):
+        result_queue = Queue()
+        dates = {}
+        class MockClientPool(ClientPool):
+            def next_valid_id(self, req_id):
+                result_queue.put(('next_valid_id', req_id))
+            def error(self, req_id, code, message):
+                result_queue.put(('error', req_id, code))
+            def tick_price(self, req_id, tick_type, price, can_auto_execute):
+                result_queue.put(('tick_price', req_id, int(price)))
+            def historical_data(self, req_id, date, *args):
+                if date.startswith('finished'):
+                    result_queue.put(('historical_data', req_id,
+                                      dates.pop(req_id)))
+                else:
+                    dates[req_id] = int(date)
+        server = MockTWS(script)
+        port = server.start()
+        pool = MockClientPool(size=3)
+        pool.connect('127.0.0.1', port, 5)
+        contract = Contract('STK', 'AAPL', 'USD', 'SMART')
+        try:
+            # The farm notice of every connection is delivered once
+            self.assertEqual(sorted([result_queue.get(timeout=10)
+                                     for index in range(2)]),
+                             [('error', -1, 2104), ('next_valid_id', 500)])
+            mkt_data_ids = [pool.next_req_id() for index in range(6)]
+            for req_id in mkt_data_ids:
+                pool.req_mkt_data(req_id, contract)
+            # Historical requests balance separately from subscriptions
+            historical_ids = [pool.next_req_id() for index in range(3)]
+            for req_id in historical_ids:
+                pool.req_historical_data(req_id, contract, '', '1 D', '1 min',
+                                         'TRADES', 1, 1)
+            results = [result_queue.get(timeout=10) for index in range(9)]
+            with self.assertRaises(Exception):
+                pool.req_mkt_data(mkt_data_ids[0], contract)
+            pool.cancel_mkt_data(mkt_data_ids[0])
+            # The freed subscription slot is reused
+            req_id = pool.next_req_id()
+            pool.req_mkt_data(req_id, contract)
+            self.assertEqual(result_queue.get(timeout=10)[:2],
+                             ('tick_price', req_id))
+            # A failed subscription frees its slot
+            req_id = pool.next_req_id()
+            pool.req_mkt_data(req_id, Contract('STK', 'BAD', 'USD', 'SMART'))
+            self.assertEqual(result_queue.get(timeout=10),
+                             ('error', req_id, 200))
+        finally:
+            pool.disconnect()
+            server.stop()
+        ticks = dict((item[1], item[2]) for item in results
+                     if item[0] == 'tick_price')
+        bars = dict((item[1], item[2]) for item in results
+                    if item[0] == 'historical_data')
+        self.assertEqual(sorted(ticks), mkt_data_ids)
+        self.assertEqual(sorted(ticks.values()), [5, 5, 6, 6, 7, 7])
+        self.assertEqual(sorted(bars.values()), [5, 6, 7])
+        self.assertTrue(result_queue.empty())
+        self.assertEqual(pool.loads['historical_data'], [0, 0, 0])
+        self.assertEqual(pool.loads['mkt_data'], [2, 2, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
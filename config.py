@@ -14,6 +14,9 @@ JAVA_INT_MAX = 2 ** 31 - 1
 # Maximum value of a Java Double
 JAVA_DOUBLE_MAX = (2 - 2 ** -52) * 2 ** 1023
 
+# Time zone of the historical bar dates sent by TWS (that of the TWS login)
+TIMEZONE = 'UTC'
+
 
 # *****************************************************************************
 # NETWORKING OPTIONS
@@ -130,3 +133,33 @@ DELTA_NEUTRAL_VALIDATION = 56
 TICK_SNAPSHOT_END = 57
 MARKET_DATA_TYPE = 58
 COMMISSION_REPORT = 59
+
+
+# *****************************************************************************
+# CONSTANTS FROM THE TickType JAVA CLASS
+# *****************************************************************************
+
+# Tick types used by tick_price() and tick_size()
+BID_SIZE = 0
+BID = 1
+ASK = 2
+ASK_SIZE = 3
+LAST = 4
+LAST_SIZE = 5
+HIGH = 6
+LOW = 7
+VOLUME = 8
+CLOSE = 9
+
+# *****************************************************************************
+# MARKET DEPTH CONSTANTS
+# *****************************************************************************
+
+# Operations used by update_mkt_depth() and update_mkt_depth_l2()
+DEPTH_INSERT = 0
+DEPTH_UPDATE = 1
+DEPTH_DELETE = 2
+
+# Sides used by update_mkt_depth() and update_mkt_depth_l2()
+DEPTH_ASK = 0
+DEPTH_BID = 1
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""Tests for the ConflatingQueue class."""
+import unittest
+from multiprocessing.queues import Empty
+from ibapipy.core.conflating_queue import CONFLATE, ConflatingQueue
+
+
+class ConflatingQueueTests(unittest.TestCase):
+    """Test cases for the ConflatingQueue class."""
+
+    def test_conflation(self):
+        queue = ConflatingQueue()
+        queue.put(('tick_price', (1, 1, 1.0, 0)))
+        queue.put(('order_status', (5, 'filled')))
+        queue.put(('tick_price', (1, 1, 1.1, 0)))
+        queue.put(('tick_price', (1, 2, 1.2, 0)))
+        queue.put(('tick_price', (1, 1, 1.3, 0)))
+        self.assertEqual(queue.get(), ('tick_price', (1, 1, 1.3, 0)))
+        self.assertEqual(queue.get(), ('order_status', (5, 'filled')))
+        self.assertEqual(queue.get(), ('tick_price', (1, 2, 1.2, 0)))
+        queue.put(('tick_price', (1, 1, 1.4, 0)))
+        self.assertEqual(queue.get(), ('tick_price', (1, 1, 1.4, 0)))
+        with self.assertRaises(Empty):
+            queue.get(timeout=0.01)
+        stats = queue.stats()
+        self.assertEqual(stats['high_water'], 3)
+        self.assertEqual(stats['methods']['tick_price']['received'], 5)
+        self.assertEqual(stats['methods']['tick_price']['conflated'], 2)
+
+    def test_bounds(self):
+        queue = ConflatingQueue({'historical_data': 2, 'tick_size': CONFLATE},
+                                default_limit=1)
+        for index in range(4):
+            queue.put(('historical_data', (index,)))
+            queue.put(('error', (index, 0, '')))
+        queue.put(('stop', None))
+        self.assertEqual([queue.get() for index in range(4)],
+                         [('historical_data', (0,)), ('error', (0, 0, '')),
+                          ('historical_data', (1,)), ('stop', None)])
+        stats = queue.stats()['methods']
+        self.assertEqual(stats['historical_data']['dropped'], 2)
+        self.assertEqual(stats['error']['dropped'], 3)
+        self.assertEqual(stats['error']['high_water'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Tests for the contract_cache module."""
+import os
+import tempfile
+import unittest
+from ibapipy.benchmarks.mock_tws import MockTWS
+from ibapipy.core.client_socket import ClientSocket
+from ibapipy.core.contract_cache import ContractCache, ContractResolver
+from ibapipy.data.contract import Contract
+import ibapipy.config as config
+
+
+def create_contract(con_id, symbol):
+    """Return a contract as it would be received from TWS."""
+    contract = Contract('stk', symbol.lower(), 'usd', 'smart')
+    contract.con_id = con_id
+    contract.local_symbol = symbol.lower()
+    return contract
+
+
+class ContractCacheTests(unittest.TestCase):
+    """Test cases for the ContractCache and ContractResolver classes."""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        os.remove(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_indexes(self):
+        cache = ContractCache()
+        request = Contract('STK', 'AAPL', 'USD', 'SMART')
+        self.assertIsNone(cache.lookup(request))
+        cache.add_query(request, [create_contract(265598, 'AAPL')])
+        self.assertEqual(cache.get(265598).symbol, 'aapl')
+        self.assertEqual([contract.con_id for contract in cache.find(
+            'AAPL', 'STK', 'SMART', 'USD')], [265598])
+        self.assertEqual(len(cache.get_local_symbol('AAPL')), 1)
+        self.assertEqual(len(cache.lookup(request)), 1)
+
+    def test_save_and_expire(self):
+        cache = ContractCache(self.path, ttl=60)
+        cache.add(create_contract(1, 'OLD'), timestamp=0)
+        cache.add(create_contract(2, 'NEW'))
+        cache.save()
+        cache = ContractCache(self.path, ttl=60)
+        self.assertEqual(len(cache), 1)
+        self.assertIn(2, cache)
+        self.assertNotIn(1, cache)
+
+    def test_resolver(self):
+        requests = []
+        def script(connection):
+            while True:
+                fields = [connection.read_field() for index in range(16)]
+                req_id, symbol = int(fields[2]), fields[4]
+                requests.append(symbol)
+                if symbol == 'UNKNOWN':
+                    connection.send([config.ERR_MSG, 2, req_id, 200,
+                                     'No security definition'])
+                    continue
+                connection.send(
+                    [config.CONTRACT_DATA, 8, req_id, symbol, 'STK', '', 0.0,
+                     '', 'SMART', 'USD', symbol, 'NMS', symbol,
+                     len(requests), 0.01, '', 'LMT', 'SMART', 1, 0, '', '',
+                     '', '', '', '', '', '', '', '', 0.0, 0],
+                    [config.CONTRACT_DATA_END, 1, req_id])
+        server = MockTWS(script)
+        port = server.start()
+        resolver = ContractResolver(ContractCache(self.path), max_in_flight=2,
+                                    max_rate=1000)
+        client = ClientSocket(contract_resolver=resolver)
+        client.connect('127.0.0.1', port, 1)
+        symbols = ['AAA', 'BBB', 'AAA', 'UNKNOWN', 'CCC']
+        contracts = [Contract('STK', symbol, 'USD', 'SMART')
+                     for symbol in symbols]
+        results = resolver.resolve(client, contracts, timeout=10)
+        self.assertEqual([[item.symbol for item in result]
+                          for result in results],
+                         [['aaa'], ['bbb'], ['aaa'], [], ['ccc']])
+        self.assertEqual(sorted(requests), ['AAA', 'BBB', 'CCC', 'UNKNOWN'])
+        # Cached requests are not sent again, even from a new cache instance
+        resolver.cache = ContractCache(self.path)
+        resolver.resolve(client, contracts[:3], timeout=10)
+        self.assertEqual(len(requests), 4)
+        client.disconnect()
+        server.stop()
+
+    def test_resolver_send_failure(self):
+        resolver = ContractResolver(max_in_flight=1, max_rate=1000)
+        # The client is not connected, so sending fails
+        client = ClientSocket(contract_resolver=resolver)
+        contract = Contract('STK', 'AAA', 'USD', 'SMART')
+        with self.assertRaises(AttributeError):
+            resolver.resolve(client, [contract], timeout=1)
+        self.assertEqual((resolver.pending, resolver.req_ids,
+                          resolver.in_flight), ({}, {}, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
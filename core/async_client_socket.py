@@ -0,0 +1,354 @@
+"""Implements the EClientSocket interface on top of asyncio.
+
+AsyncClientSocket offers the same request methods and callbacks as
+ClientSocket, but the connection, decoding and dispatching all run inside a
+single event loop. In addition to the callbacks, it offers awaitable requests
+and asynchronous iterators of ticks.
+
+An exception raised by a callback is logged and the listener carries on with
+the next message, as the worker threads of a Dispatcher do.
+
+"""
+from ibapipy.core.async_network_handler import AsyncNetworkHandler
+from ibapipy.core.client_socket import (ClientSocket, QUOTE_METHODS,
+                                        WARNING_CODES,
+                                        append_bar, dispatch, fail_requests,
+                                        publish_books, publish_quotes,
+                                        route_response, switch_methods)
+from ibapipy.core.order_book import DEPTH_METHODS
+from ibapipy.ibapipy_error import IBAPIPyError
+import asyncio
+import logging
+import ibapipy.config as config
+
+
+# Methods that are routed to tick streams
+TICK_METHODS = ('tick_generic', 'tick_price', 'tick_size',
+                'tick_snapshot_end', 'tick_string')
+
+
+class AsyncClientSocket(ClientSocket):
+    """Provides awaitable methods for sending requests to TWS."""
+
+    def __init__(self, historical_columns=False, quote_book=None,
+                 capture_path=None, order_book=None, skip_unhandled=False,
+                 lazy_objects=False):
+        """Initialize a new instance of an AsyncClientSocket.
+
+        Keyword arguments:
+        historical_columns -- True to receive each historical data response as
+                              a single structured NumPy array (default: False)
+        quote_book         -- ibapipy.core.quote_book.QuoteBook that absorbs
+                              the bid, ask, size and volume ticks of
+                              req_mkt_data() requests (default: None)
+        capture_path       -- session file that the raw data received from
+                              TWS is appended to (default: None)
+        order_book         -- ibapipy.core.order_book.OrderBook that absorbs
+                              update_mkt_depth() and update_mkt_depth_l2()
+                              messages (default: None)
+        skip_unhandled     -- True to read past the messages for callbacks
+                              that are not handled (see ClientSocket)
+                              (default: False)
+        lazy_objects       -- True to receive lazy contracts, orders and
+                              executions (see ClientSocket) (default: False)
+
+        """
+        ClientSocket.__init__(self, historical_columns, quote_book,
+                              capture_path=capture_path,
+                              order_book=order_book,
+                              skip_unhandled=skip_unhandled,
+                              lazy_objects=lazy_objects)
+        self.__listener_task__ = None
+        self.__book_timer__ = None
+        self.__tick_queues__ = {}
+        self.logger = logging.getLogger(__name__)
+
+    def __new_network_handler__(self, historical_columns, capture_path,
+                                instrumented, transport, methods,
+                                lazy_objects):
+        """Return an AsyncNetworkHandler; instrumentation and the transport
+        do not apply to a single event loop.
+
+        """
+        return AsyncNetworkHandler(historical_columns, capture_path, methods,
+                                   lazy_objects)
+
+    def __send__(self, *args):
+        """Write each element in args to the socket.
+
+        *args -- items to send
+
+        """
+        self.__network_handler__.send(*args)
+
+    async def connect(self, host=config.HOST, port=config.PORT,
+                      client_id=config.CLIENT_ID):
+        """Connect to the remote TWS.
+
+        Keyword arguments:
+        host      -- host name or IP address of the TWS machine
+        port      -- port number on the TWS machine
+        client_id -- number used to identify this client connection
+
+        """
+        if self.is_connected:
+            return
+        # Connect
+        results = await self.__network_handler__.connect(host, port,
+                                                         client_id)
+        self.server_version, self.tws_connection_time = results
+        self.is_connected = True
+        # Listen for incoming messages
+        self.__listener_task__ = asyncio.ensure_future(listen(self))
+
+    async def disconnect(self):
+        """Disconnect from the remote TWS."""
+        await self.__network_handler__.disconnect()
+        if self.__listener_task__ is not None:
+            await self.__listener_task__
+            self.__listener_task__ = None
+        self.is_connected = False
+        self.server_version = 0
+        self.tws_connection_time = ''
+
+    async def drain(self):
+        """Wait until all requests sent so far have been handed off to the
+        socket.
+
+        """
+        await self.__network_handler__.drain()
+
+    async def get_contract_details(self, req_id, contract, timeout=None):
+        """Request contract details and return the list of matching
+        Contract objects.
+
+        Keyword arguments:
+        req_id   -- unique request ID
+        contract -- ibapipy.data.contract.Contract object
+        timeout  -- seconds to wait for the response (default: None)
+
+        """
+        future = start_request(self, req_id,
+                               ('contract_details', 'contract_details_end'))
+        self.req_contract_details(req_id, contract)
+        return await wait_for_request(self, req_id, future, timeout)
+
+    async def get_current_time(self, timeout=None):
+        """Return the current system time on the server side.
+
+        Keyword arguments:
+        timeout -- seconds to wait for the response (default: None)
+
+        """
+        future = start_request(self, 'current_time', ('current_time',))
+        self.req_current_time()
+        return await wait_for_request(self, 'current_time', future, timeout)
+
+    async def get_executions(self, req_id, exec_filter, timeout=None):
+        """Request executions and return a list of (contract, execution)
+        tuples.
+
+        Keyword arguments are those of req_executions() plus:
+        timeout -- seconds to wait for the response (default: None)
+
+        """
+        future = start_request(self, req_id,
+                               ('exec_details', 'exec_details_end'))
+        self.req_executions(req_id, exec_filter)
+        return await wait_for_request(self, req_id, future, timeout)
+
+    async def get_historical_data(self, req_id, contract, end_date_time,
+                                  duration_str, bar_size_setting,
+                                  what_to_show, use_rth, format_date,
+                                  timeout=None):
+        """Request historical data and return a list of bars, each of the
+        form (date, open, high, low, close, volume, bar_count, wap,
+        has_gaps). If the client was created with historical_columns=True, a
+        structured NumPy array is returned instead.
+
+        Keyword arguments are those of req_historical_data() plus:
+        timeout -- seconds to wait for the response (default: None)
+
+        """
+        future = start_request(self, req_id,
+                               ('historical_data', 'historical_data_columns'))
+        self.req_historical_data(req_id, contract, end_date_time,
+                                 duration_str, bar_size_setting, what_to_show,
+                                 use_rth, format_date)
+        return await wait_for_request(self, req_id, future, timeout)
+
+    async def get_open_orders(self, timeout=None, all_clients=False):
+        """Request open orders and return a list of (contract, order)
+        tuples.
+
+        Keyword arguments:
+        timeout     -- seconds to wait for the response (default: None)
+        all_clients -- True to request the open orders of all clients rather
+                       than only those of this one (default: False)
+
+        """
+        future = start_request(self, 'open_orders',
+                               ('open_order', 'open_order_end'))
+        if all_clients:
+            self.req_all_open_orders()
+        else:
+            self.req_open_orders()
+        return await wait_for_request(self, 'open_orders', future, timeout)
+
+    async def ticks(self, req_id, contract, generic_ticklist='',
+                    snapshot=False):
+        """Request market data and asynchronously iterate over the resulting
+        ticks of the form ('method name', (req_id, ...)), where the method
+        name is one of tick_generic, tick_price, tick_size or tick_string.
+
+        The market data subscription is cancelled once iteration stops. A
+        snapshot ends by itself once tick_snapshot_end() is received.
+
+        Keyword arguments:
+        req_id           -- unique request ID
+        contract         -- ibapi.contract.Contract object
+        generic_ticklist -- comma delimited list of generic tick types
+                            (default: '')
+        snapshot         -- True to return a single snapshot of market data;
+                            False, otherwise (default: False)
+
+        """
+        queue = asyncio.Queue()
+        self.__tick_queues__[req_id] = queue
+        switch_methods(self, TICK_METHODS, True)
+        self.req_mkt_data(req_id, contract, generic_ticklist, snapshot)
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                method, parms = item
+                if method == 'error':
+                    raise IBAPIPyError(parms[2])
+                if method == 'tick_snapshot_end':
+                    return
+                yield item
+        finally:
+            del self.__tick_queues__[req_id]
+            switch_methods(self, TICK_METHODS, False)
+            if not snapshot and self.is_connected:
+                self.cancel_mkt_data(req_id)
+
+
+async def listen(client):
+    """Dispatch incoming messages to the client callbacks and route them to
+    any pending awaitable requests or tick streams.
+
+    Keyword arguments:
+    client -- client
+
+    """
+    quote_book = client.quote_book
+    order_book = client.order_book
+    async for method, parms in client.__network_handler__.messages():
+        try:
+            if quote_book is not None and method in QUOTE_METHODS and \
+                    quote_book.consumes(method, parms):
+                quote_book.apply(method, parms)
+                flush_books(client)
+            elif order_book is not None and method in DEPTH_METHODS:
+                order_book.apply(method, parms)
+                flush_books(client)
+            else:
+                if method == 'real_time_bar':
+                    append_bar(client, parms)
+                dispatch(client, method, parms)
+        except Exception:
+            client.logger.exception('Error in callback {0}'.format(method))
+        route(client, method, parms)
+    if client.__book_timer__ is not None:
+        client.__book_timer__.cancel()
+        client.__book_timer__ = None
+    client.is_connected = False
+    for queue in client.__tick_queues__.values():
+        queue.put_nowait(None)
+    fail_requests(client, 'Connection closed.')
+
+
+def flush_books(client):
+    """Publish the quotes and order books that are due and schedule another
+    flush if changes are still being held back by the interval of a book.
+
+    Keyword arguments:
+    client -- client
+
+    """
+    intervals = []
+    for book, publish in ((client.quote_book, publish_quotes),
+                          (client.order_book, publish_books)):
+        if book is not None:
+            publish(client)
+            if len(book.changed) > 0:
+                intervals.append(book.interval_ms)
+    if len(intervals) > 0 and client.__book_timer__ is None:
+        client.__book_timer__ = asyncio.get_running_loop().call_later(
+            min(intervals) / 1000.0, book_timer_expired, client)
+
+
+def book_timer_expired(client):
+    """Flush the books once the scheduled interval has elapsed."""
+    client.__book_timer__ = None
+    try:
+        flush_books(client)
+    except Exception:
+        client.logger.exception('Error publishing books')
+
+
+def route(client, method, parms):
+    """Route the specified message to the pending request or tick stream that
+    it belongs to, if any.
+
+    Keyword arguments:
+    client -- client
+    method -- name of the callback method
+    parms  -- tuple of parameters for the method
+
+    """
+    if method in TICK_METHODS or (method == 'error' and
+                                  parms[1] not in WARNING_CODES):
+        queue = client.__tick_queues__.get(parms[0])
+        if queue is not None:
+            queue.put_nowait((method, parms))
+            return
+    if len(client.__requests__) > 0:
+        route_response(client, method, parms)
+
+
+def start_request(client, key, methods=()):
+    """Register a pending request identified by key and return the future
+    that will hold its result.
+
+    Keyword arguments:
+    client  -- client
+    key     -- request ID or name of the request
+    methods -- names of the callback methods of the responses, which are
+               decoded while the request is pending (default: ())
+
+    """
+    future = asyncio.get_running_loop().create_future()
+    with client.__request_lock__:
+        if key in client.__requests__:
+            raise IBAPIPyError('Request {0} is already pending.'.format(key))
+        client.__requests__[key] = ([], future, methods)
+        switch_methods(client, methods, True)
+    return future
+
+
+async def wait_for_request(client, key, future, timeout):
+    """Wait for the specified request to complete, forgetting about it if the
+    wait times out.
+
+    """
+    try:
+        return await asyncio.wait_for(future, timeout)
+    finally:
+        with client.__request_lock__:
+            entry = client.__requests__.get(key)
+            if entry is not None and entry[1] is future:
+                del client.__requests__[key]
+                switch_methods(client, entry[2], False)
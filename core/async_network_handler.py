@@ -0,0 +1,146 @@
+"""Handle socket communications with the broker from a single asyncio event
+loop.
+
+This is an alternative to NetworkHandler: rather than passing data between
+separate processes through queues, the socket is read with asyncio streams and
+the framing and decoding happen in the same event loop that dispatches the
+resulting messages.
+
+"""
+from ibapipy.core.network_handler import FieldDecoder, encode_message
+from ibapipy.ibapipy_error import IBAPIPyError
+import asyncio
+import ibapipy.core.reader as reader
+import ibapipy.core.session as session
+import ibapipy.config as config
+
+
+class AsyncNetworkHandler:
+
+    def __init__(self, historical_columns=False, capture_path=None,
+                 methods=None, lazy_objects=False):
+        """Initialize a new instance of an AsyncNetworkHandler.
+
+        Keyword arguments:
+        historical_columns -- True to receive each historical data message as
+                              a single structured NumPy array via
+                              historical_data_columns() (default: False)
+        capture_path       -- session file that received data is appended to
+                              (default: None)
+        methods            -- names of the callback methods that messages are
+                              decoded for; the others can be turned on through
+                              message_switch (see NetworkHandler)
+                              (default: None)
+        lazy_objects       -- True to decode contracts, orders and executions
+                              into lazy objects (default: False)
+
+        """
+        self.message_switch = None
+        switch_flags = None
+        if methods is not None:
+            self.message_switch = reader.MessageSwitch()
+            switch_flags = self.message_switch.flags
+        self.message_handlers = reader.get_message_handlers(
+            historical_columns, methods, lazy_objects, switch_flags)
+        self.capture_path = capture_path
+        self.session_writer = None
+        self.stream_reader = None
+        self.stream_writer = None
+        self.fields = reader.FieldList()
+        self.decoder = FieldDecoder()
+
+    async def connect(self, host, port, client_id):
+        """Connect to the remote TWS and return the server version and TWS
+        connection time.
+
+        Keyword arguments:
+        host      -- host name or IP address of the TWS machine
+        port      -- port number on the TWS machine
+        client_id -- number used to identify this client connection
+
+        """
+        if self.stream_writer is not None:
+            return 0, 0
+        # Connect
+        self.stream_reader, self.stream_writer = await asyncio.open_connection(
+            host, port)
+        # Initial handshake
+        self.send(config.CLIENT_VERSION)
+        while len(self.fields.fields) < 2:
+            if not await self.read():
+                raise IBAPIPyError('Connection closed during handshake.')
+        server_version = int(self.fields.get())
+        if server_version < config.MIN_SERVER_VERSION:
+            msg = 'Server version is {0} (min {1} needed).'
+            raise IBAPIPyError(msg.format(server_version,
+                                          config.MIN_SERVER_VERSION))
+        tws_connection_time = self.fields.get()
+        self.send(client_id)
+        if self.capture_path is not None:
+            self.session_writer = session.SessionWriter(self.capture_path)
+        return server_version, tws_connection_time
+
+    async def disconnect(self):
+        """Disconnect from the remote TWS."""
+        if self.stream_writer is None:
+            return
+        writer = self.stream_writer
+        self.stream_writer = None
+        self.stream_reader = None
+        if self.session_writer is not None:
+            self.session_writer.close()
+            self.session_writer = None
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    async def drain(self):
+        """Wait until the outgoing data has been handed off to the socket."""
+        if self.stream_writer is not None:
+            await self.stream_writer.drain()
+
+    async def messages(self):
+        """Asynchronously iterate over incoming messages of the form
+        ('method name', (parm1, ...)) until the connection is closed.
+
+        """
+        messages = []
+        while True:
+            reader.read_messages(self.fields, messages,
+                                 self.message_handlers)
+            for message in messages:
+                yield message
+            messages.clear()
+            if not await self.read():
+                return
+
+    async def read(self):
+        """Read the next block of data from the socket and add its fields to
+        the field list. Return False if the connection has been closed.
+
+        """
+        if self.stream_reader is None:
+            return False
+        try:
+            raw_data = await self.stream_reader.read(config.BUFFER_SIZE)
+        except (ConnectionError, OSError):
+            return False
+        if len(raw_data) == 0:
+            return False
+        if self.session_writer is not None:
+            self.session_writer.write(raw_data)
+        self.fields.extend(self.decoder.feed(raw_data))
+        return True
+
+    def send(self, *args):
+        """Encode the specified parameter(s) and write them to the socket.
+
+        Keyword arguments:
+        *args -- items to send over the network
+
+        """
+        if self.stream_writer is None:
+            raise IBAPIPyError('Not connected.')
+        self.stream_writer.write(encode_message(*args))
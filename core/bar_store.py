@@ -0,0 +1,300 @@
+"""On-disk store of historical bars with tracking of the ranges fetched.
+
+Bars are stored per (con_id, bar_size, what_to_show, use_rth) key as one .npy
+file per field of BAR_DTYPE, so a single column can be memory-mapped and read
+without touching the others. Alongside the columns, each key records the
+time ranges that have been fetched from TWS (whether or not they held any
+bars), which is what missing() uses to work out the gaps that still have to
+be requested.
+
+Every write produces a new generation of the files for a key, and a small
+'current' file naming the generation is replaced atomically once it is
+complete. Readers therefore never see a half-written generation, and views
+returned earlier stay valid after later writes.
+
+"""
+from ibapipy.core.historical_scheduler import HistoricalJob, \
+    duration_string
+from ibapipy.data.bar_buffer import BAR_DTYPE
+from ibapipy.ibapipy_error import IBAPIPyError
+import math
+import os
+import shutil
+import threading
+import time
+import ibapipy.config as config
+import ibapipy.core.timestamps as timestamps
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Names of the column files
+COLUMNS = tuple(name for name, dtype in BAR_DTYPE)
+
+# Number of seconds in each bar size
+BAR_SECONDS = {'1 secs': 1,
+               '5 secs': 5,
+               '10 secs': 10,
+               '15 secs': 15,
+               '30 secs': 30,
+               '1 min': 60,
+               '2 mins': 120,
+               '3 mins': 180,
+               '5 mins': 300,
+               '15 mins': 900,
+               '30 mins': 1800,
+               '1 hour': 3600,
+               '1 day': 86400}
+
+
+class BarStore:
+    """Columnar bar files for many contracts under a single directory."""
+
+    def __init__(self, directory):
+        """Initialize a new instance of a BarStore.
+
+        Keyword arguments:
+        directory -- directory holding the files; created if it does not
+                     exist
+
+        """
+        if np is None:
+            raise IBAPIPyError('NumPy is required for the BarStore.')
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.loaded = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def coverage(self, key):
+        """Return an (n, 2) int64 array of the [start, end) ranges in
+        milliseconds since the Epoch that have been fetched for a key, sorted
+        and without overlaps.
+
+        """
+        return self.load(key)[2]
+
+    def fetch(self, client, contract, start_ms, end_ms, bar_size,
+              what_to_show='TRADES', use_rth=1, timeout=None):
+        """Request the bars missing from the store for a period, add them to
+        it and return the bars of the whole period (see read()).
+
+        Only the missing ranges are requested, through the
+        HistoricalScheduler attached to the client. Ranges that have not
+        finished yet are not recorded as fetched, so they are requested again
+        next time.
+
+        Keyword arguments:
+        client       -- connected ClientSocket created with a
+                        HistoricalScheduler
+        contract     -- ibapipy.data.contract.Contract object with a con_id
+        start_ms     -- start of the period in milliseconds since the Epoch
+        end_ms       -- end of the period in milliseconds since the Epoch
+        bar_size     -- bar size setting (a key of BAR_SECONDS)
+        what_to_show -- type of data (default: 'TRADES')
+        use_rth      -- 1 for regular trading hours only; 0, otherwise
+                        (default: 1)
+        timeout      -- maximum number of seconds to wait for the requests;
+                        None to wait forever (default: None)
+
+        """
+        scheduler = client.historical_scheduler
+        if scheduler is None:
+            raise IBAPIPyError('The client has no historical scheduler.')
+        key = store_key(contract, bar_size, what_to_show, use_rth)
+        gaps = self.missing(key, start_ms, end_ms)
+        if len(gaps) > 0:
+            jobs = []
+            for gap_start, gap_end in gaps:
+                seconds = max(int(math.ceil((gap_end - gap_start) / 1000.0)),
+                              BAR_SECONDS[bar_size])
+                jobs.append(HistoricalJob(contract, gap_end,
+                                          duration_string(seconds), bar_size,
+                                          what_to_show, use_rth, 2))
+            requested_ms = int(time.time() * 1000)
+            scheduler.run(client, jobs, timeout=timeout)
+            # Bars that had not closed when requested may still change
+            bar_ms = BAR_SECONDS[bar_size] * 1000
+            complete_ms = requested_ms - requested_ms % bar_ms
+            for (gap_start, gap_end), job in zip(gaps, jobs):
+                if job.error is not None:
+                    raise IBAPIPyError(job.error)
+                columns = job_columns(job)
+                milliseconds = columns['milliseconds']
+                keep = (milliseconds >= gap_start) & (milliseconds < gap_end)
+                columns = dict((name, values[keep])
+                               for name, values in columns.items())
+                self.write(key, columns, gap_start,
+                           min(gap_end, complete_ms))
+        return self.read(key, start_ms, end_ms)
+
+    def load(self, key):
+        """Return the (generation, columns, coverage) of a key, with the
+        columns memory-mapped, reloading them if another writer has replaced
+        them.
+
+        """
+        path = self.path(key)
+        with self.lock:
+            try:
+                with open(os.path.join(path, 'current')) as current_file:
+                    generation = int(current_file.read())
+            except FileNotFoundError:
+                generation = 0
+            loaded = self.loaded.get(key)
+            if loaded is not None and loaded[0] == generation:
+                return loaded
+            if generation == 0:
+                columns = dict((name, np.empty(0, dtype=dtype))
+                               for name, dtype in BAR_DTYPE)
+                coverage = np.empty((0, 2), dtype=np.int64)
+            else:
+                generation_path = os.path.join(path, str(generation))
+                columns = dict((name, np.load(
+                    os.path.join(generation_path, name + '.npy'),
+                    mmap_mode='r')) for name in COLUMNS)
+                coverage = np.load(os.path.join(generation_path,
+                                                'coverage.npy'))
+            loaded = (generation, columns, coverage)
+            self.loaded[key] = loaded
+            return loaded
+
+    def missing(self, key, start_ms, end_ms):
+        """Return a list of the [start, end) ranges in milliseconds since the
+        Epoch within a period that have not been fetched for a key.
+
+        """
+        gaps = []
+        position = start_ms
+        for range_start, range_end in self.coverage(key).tolist():
+            if range_end <= position:
+                continue
+            if range_start >= end_ms:
+                break
+            if range_start > position:
+                gaps.append((position, range_start))
+            position = max(position, range_end)
+        if position < end_ms:
+            gaps.append((position, end_ms))
+        return gaps
+
+    def path(self, key):
+        """Return the directory holding the files of a key."""
+        con_id, bar_size, what_to_show, use_rth = key
+        name = '{0}_{1}_{2}'.format(bar_size.replace(' ', ''), what_to_show,
+                                    use_rth)
+        return os.path.join(self.directory, str(con_id), name)
+
+    def read(self, key, start_ms=None, end_ms=None):
+        """Return a dictionary of column name to a read-only view of the
+        memory-mapped column for all bars of a key or, if both times are
+        given, the bars with start_ms <= milliseconds < end_ms. No data is
+        copied.
+
+        """
+        columns = self.load(key)[1]
+        if start_ms is None or end_ms is None:
+            return dict(columns)
+        milliseconds = columns['milliseconds']
+        start = int(np.searchsorted(milliseconds, start_ms, 'left'))
+        end = int(np.searchsorted(milliseconds, end_ms, 'left'))
+        return dict((name, values[start:end])
+                    for name, values in columns.items())
+
+    def write(self, key, columns, start_ms, end_ms):
+        """Add bars to a key and record [start_ms, end_ms) as fetched. Bars
+        with the same time as stored bars replace them.
+
+        Keyword arguments:
+        key      -- key returned by store_key()
+        columns  -- dictionary of column name to array, or a structured
+                    array with the fields of BAR_DTYPE
+        start_ms -- start of the range fetched in milliseconds since the
+                    Epoch
+        end_ms   -- end of the range fetched in milliseconds since the Epoch
+
+        """
+        path = self.path(key)
+        with self.lock:
+            generation, stored, coverage = self.load(key)
+            new_ms = np.asarray(columns['milliseconds'], dtype=np.int64)
+            all_ms = np.concatenate([new_ms, stored['milliseconds']])
+            # np.unique() keeps the first occurrence, i.e. the new bar
+            merged_ms, index = np.unique(all_ms, return_index=True)
+            generation_path = os.path.join(path, str(generation + 1))
+            shutil.rmtree(generation_path, ignore_errors=True)
+            os.makedirs(generation_path)
+            for name, dtype in BAR_DTYPE:
+                values = np.concatenate([
+                    np.asarray(columns[name], dtype=dtype), stored[name]])
+                np.save(os.path.join(generation_path, name + '.npy'),
+                        values[index])
+            if end_ms > start_ms:
+                coverage = merge_ranges(np.concatenate(
+                    [coverage, np.array([[start_ms, end_ms]],
+                                        dtype=np.int64)]))
+            np.save(os.path.join(generation_path, 'coverage.npy'), coverage)
+            temp_path = os.path.join(path, 'current.{0}.tmp'.format(
+                os.getpid()))
+            with open(temp_path, 'w') as current_file:
+                current_file.write(str(generation + 1))
+            os.replace(temp_path, os.path.join(path, 'current'))
+            if generation > 0:
+                # Open memory maps of the old files stay valid
+                shutil.rmtree(os.path.join(path, str(generation)),
+                              ignore_errors=True)
+            self.loaded.pop(key, None)
+
+
+def job_columns(job):
+    """Return a dictionary of column name to array for the bars of a
+    completed HistoricalJob.
+
+    """
+    bars = job.bars
+    if isinstance(bars, np.ndarray):
+        names = dict((name, name) for name in COLUMNS)
+        names['count'] = 'bar_count'
+        return dict((name, bars[names[name]]) for name in COLUMNS)
+    columns = dict((name, np.empty(len(bars), dtype=dtype))
+                   for name, dtype in BAR_DTYPE)
+    for index, (date, open, high, low, close, volume, bar_count, wap,
+                has_gaps) in enumerate(bars):
+        columns['milliseconds'][index] = timestamps.ib_time_to_ms(
+            date, config.TIMEZONE)
+        columns['open'][index] = open
+        columns['high'][index] = high
+        columns['low'][index] = low
+        columns['close'][index] = close
+        columns['volume'][index] = volume
+        columns['count'][index] = bar_count
+    return columns
+
+
+def merge_ranges(ranges):
+    """Return the union of an (n, 2) array of [start, end) ranges, sorted and
+    without overlapping or touching ranges.
+
+    """
+    ranges = ranges[np.argsort(ranges[:, 0], kind='stable')]
+    merged = []
+    for start, end in ranges.tolist():
+        if len(merged) > 0 and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return np.array(merged, dtype=np.int64).reshape(-1, 2)
+
+
+def store_key(contract, bar_size, what_to_show='TRADES', use_rth=1):
+    """Return the (con_id, bar_size, what_to_show, use_rth) key of a
+    contract's bars.
+
+    """
+    if contract.con_id == 0:
+        raise IBAPIPyError('The contract has no con_id.')
+    if bar_size not in BAR_SECONDS:
+        raise IBAPIPyError('Unsupported bar size: {0}'.format(bar_size))
+    return (contract.con_id, bar_size, what_to_show.upper(), int(use_rth))
@@ -0,0 +1,317 @@
+"""Spreads requests over several TWS connections and merges their callbacks.
+
+A ClientPool opens one ClientSocket per client ID, optionally against several
+TWS or gateway instances. Each connection has its own network handler
+processes, so decoding is spread over as many cores as there are
+connections, and pacing limits that apply per connection are multiplied.
+
+Subscriptions and requests are routed to the connection with the fewest
+active requests of the same kind. Request IDs are shared by the whole pool
+(next_req_id() hands out unused ones), so the callbacks of all connections
+can be merged into a single stream: they are queued in order of arrival and
+called on the pool by one listener thread, exactly as they would be on a
+single ClientSocket.
+
+Requests that are not routed (orders, account updates, current time, ...)
+are sent over the first connection, the primary. The connection-level
+next_valid_id() and managed_accounts() callbacks of the other connections
+are dropped so that order IDs only come from the primary. Connection-level
+errors (request ID -1), such as the market data farm notices that every
+connection receives, are delivered once for all connections.
+
+A routed request frees its slot when it is cancelled, when its last
+response arrives or when it fails with an error that is not a warning
+(see client_socket.WARNING_CODES).
+
+"""
+from ibapipy.core.client_socket import (ClientSocket, WARNING_CODES,
+                                        dispatch, fail_requests,
+                                        route_response)
+from ibapipy.ibapipy_error import IBAPIPyError
+import queue
+import threading
+import ibapipy.config as config
+
+
+# Kinds of routed requests; each is balanced separately
+ROUTED_KINDS = ('contract_details', 'historical_data', 'mkt_data',
+                'mkt_depth', 'real_time_bars')
+
+# Callbacks only delivered from the primary connection
+PRIMARY_METHODS = ('managed_accounts', 'next_valid_id')
+
+
+class ClientPool(ClientSocket):
+    """Provides the ClientSocket interface over several connections.
+
+    Override the callback methods as with a ClientSocket.
+
+    """
+
+    def __init__(self, size=4, addresses=None, historical_columns=False,
+                 first_req_id=1, lazy_objects=False):
+        """Initialize a new instance of a ClientPool.
+
+        Keyword arguments:
+        size               -- number of connections (default: 4)
+        addresses          -- list of (host, port) tuples the connections are
+                              spread over in turn; None to use the address
+                              passed to connect() (default: None)
+        historical_columns -- True to receive historical data via
+                              historical_data_columns() (default: False)
+        first_req_id       -- first request ID returned by next_req_id()
+                              (default: 1)
+        lazy_objects       -- True to receive lazy contracts, orders and
+                              executions (see ClientSocket) (default: False)
+
+        """
+        if size < 1:
+            raise IBAPIPyError('A pool needs at least one connection.')
+        ClientSocket.__init__(self)
+        self.clients = [ClientSocket(historical_columns,
+                                     dispatcher=PoolRouter(self, index),
+                                     lazy_objects=lazy_objects)
+                        for index in range(size)]
+        self.addresses = addresses
+        # Shared by every connection, as request IDs are unique in the pool
+        for client in self.clients:
+            client.bar_buffers = self.bar_buffers
+        self.lock = threading.Lock()
+        self.owners = {}
+        self.loads = dict((kind, [0] * size) for kind in ROUTED_KINDS)
+        self.next_id = first_req_id
+        self.message_queue = queue.Queue()
+        # (code, message) of each connection-level error to the indices of
+        # the connections that have reported it since it was last delivered
+        self.notices = {}
+
+    def __new_network_handler__(self, historical_columns, capture_path,
+                                instrumented, transport, methods,
+                                lazy_objects):
+        """Return None: only the connections have network handlers."""
+        return None
+
+    def __send__(self, *args):
+        """Send a request that is not routed over the primary connection."""
+        self.clients[0].__send__(*args)
+
+    def assign(self, req_id, kind):
+        """Pick the connection with the fewest active requests of a kind,
+        record it as the owner of the request ID and return it.
+
+        """
+        with self.lock:
+            if req_id in self.owners:
+                msg = 'Request ID {0} is already in use.'
+                raise IBAPIPyError(msg.format(req_id))
+            loads = self.loads[kind]
+            totals = [sum(self.loads[name][index] for name in ROUTED_KINDS)
+                      for index in range(len(self.clients))]
+            index = min(range(len(self.clients)),
+                        key=lambda item: (loads[item], totals[item]))
+            loads[index] += 1
+            self.owners[req_id] = (index, kind)
+            return self.clients[index]
+
+    def connect(self, host=config.HOST, port=config.PORT,
+                client_id=config.CLIENT_ID, socket_options=None):
+        """Connect every client in the pool, using consecutive client IDs
+        starting with client_id.
+
+        Keyword arguments:
+        host           -- host name or IP address of the TWS machine, unless
+                          the pool was created with addresses
+        port           -- port number on the TWS machine, unless the pool
+                          was created with addresses
+        client_id      -- client ID of the primary connection
+        socket_options -- network_handler.SocketOptions used by every
+                          connection (default:
+                          network_handler.DEFAULT_SOCKET_OPTIONS)
+
+        """
+        if self.is_connected:
+            return
+        addresses = [(host, port)] if self.addresses is None \
+            else self.addresses
+        for index, client in enumerate(self.clients):
+            client_host, client_port = addresses[index % len(addresses)]
+            client.connect(client_host, client_port, client_id + index,
+                           socket_options)
+        self.server_version = self.clients[0].server_version
+        self.tws_connection_time = self.clients[0].tws_connection_time
+        self.is_connected = True
+        self.__listener_thread__ = threading.Thread(
+            target=listen, args=(self, self.message_queue))
+        self.__listener_thread__.start()
+
+    def disconnect(self):
+        """Disconnect every client in the pool."""
+        for client in self.clients:
+            client.disconnect()
+        self.message_queue.put(('stop', None))
+        self.is_connected = False
+        self.server_version = 0
+        self.tws_connection_time = ''
+
+    def first_notice(self, index, parms):
+        """Return True if the connection-level error received by the
+        connection at 'index' should be delivered: no other connection has
+        reported it since the last time this one did.
+
+        """
+        key = (parms[1], parms[2])
+        with self.lock:
+            reporters = self.notices.get(key)
+            if reporters is None or index in reporters:
+                self.notices[key] = set([index])
+                return True
+            reporters.add(index)
+            return False
+
+    def member(self, req_id):
+        """Return the ClientSocket that a request ID was routed to."""
+        with self.lock:
+            owner = self.owners.get(req_id)
+        if owner is None:
+            raise IBAPIPyError('Unknown request ID: {0}'.format(req_id))
+        return self.clients[owner[0]]
+
+    def next_req_id(self):
+        """Return a request ID that has not been handed out before."""
+        with self.lock:
+            req_id = self.next_id
+            self.next_id += 1
+            return req_id
+
+    def release(self, req_id):
+        """Forget the owner of a request ID and return the ClientSocket it
+        was routed to, or None if it was not routed.
+
+        """
+        with self.lock:
+            owner = self.owners.pop(req_id, None)
+            if owner is None:
+                return None
+            index, kind = owner
+            self.loads[kind][index] -= 1
+            return self.clients[index]
+
+    def route(self, index, method, parms):
+        """Queue a message received by the connection at 'index' for the
+        pool's listener, releasing the request it completes, if any.
+
+        """
+        if index > 0 and method in PRIMARY_METHODS:
+            return
+        if method == 'historical_data':
+            if parms[1].startswith('finished'):
+                self.release(parms[0])
+        elif method in ('contract_details_end', 'historical_data_columns'):
+            self.release(parms[0])
+        elif method == 'error':
+            if parms[0] == -1:
+                if not self.first_notice(index, parms):
+                    return
+            elif parms[1] not in WARNING_CODES:
+                self.release(parms[0])
+        self.message_queue.put((method, parms))
+
+    def cancel_historical_data(self, req_id):
+        client = self.release(req_id)
+        if client is not None:
+            client.cancel_historical_data(req_id)
+
+    def cancel_mkt_data(self, req_id):
+        client = self.release(req_id)
+        if client is not None:
+            client.cancel_mkt_data(req_id)
+
+    def cancel_mkt_depth(self, req_id):
+        client = self.release(req_id)
+        if client is not None:
+            client.cancel_mkt_depth(req_id)
+
+    def cancel_real_time_bars(self, req_id):
+        client = self.release(req_id)
+        if client is not None:
+            return client.cancel_real_time_bars(req_id)
+        return None
+
+    def req_contract_details(self, req_id, contract):
+        self.assign(req_id, 'contract_details').req_contract_details(
+            req_id, contract)
+
+    def req_historical_data(self, req_id, contract, end_date_time,
+                            duration_str, bar_size_setting, what_to_show,
+                            use_rth, format_date):
+        self.assign(req_id, 'historical_data').req_historical_data(
+            req_id, contract, end_date_time, duration_str, bar_size_setting,
+            what_to_show, use_rth, format_date)
+
+    def req_mkt_data(self, req_id, contract, generic_ticklist='',
+                     snapshot=False):
+        self.assign(req_id, 'mkt_data').req_mkt_data(
+            req_id, contract, generic_ticklist, snapshot)
+
+    def req_mkt_depth(self, req_id, contract, num_rows):
+        self.assign(req_id, 'mkt_depth').req_mkt_depth(req_id, contract,
+                                                       num_rows)
+
+    def req_real_time_bars(self, req_id, contract, bar_size, what_to_show,
+                           use_rth, capacity=None):
+        client = self.assign(req_id, 'real_time_bars')
+        if capacity is None:
+            client.req_real_time_bars(req_id, contract, bar_size,
+                                      what_to_show, use_rth)
+        else:
+            client.req_real_time_bars(req_id, contract, bar_size,
+                                      what_to_show, use_rth, capacity)
+
+
+class PoolRouter:
+    """Stands in for the dispatcher of a pool connection, handing every
+    message it receives to the pool.
+
+    """
+
+    def __init__(self, pool, index):
+        """Initialize a new instance of a PoolRouter.
+
+        Keyword arguments:
+        pool  -- ClientPool the connection belongs to
+        index -- index of the connection in the pool
+
+        """
+        self.pool = pool
+        self.index = index
+
+    def start(self, client):
+        """Called when the connection is established."""
+        pass
+
+    def stop(self):
+        """Called when the connection's listener stops."""
+        pass
+
+    def submit(self, method, parms):
+        """Hand a message received by the connection to the pool."""
+        self.pool.route(self.index, method, parms)
+
+
+def listen(pool, in_queue):
+    """Call the pool's callbacks for the merged messages of its connections
+    until a stop message is received.
+
+    Keyword arguments:
+    pool     -- ClientPool
+    in_queue -- queue of merged messages
+
+    """
+    while True:
+        method, parms = in_queue.get()
+        if method == 'stop':
+            fail_requests(pool, 'Connection closed.')
+            return
+        dispatch(pool, method, parms)
+        if len(pool.__requests__) > 0:
+            route_response(pool, method, parms)
@@ -1,29 +1,158 @@
 """Implements the EClientSocket interface for the Interactive Brokers API."""
+from concurrent.futures import Future
+from multiprocessing.queues import Empty
+from ibapipy.ibapipy_error import IBAPIPyError
+import functools
+import heapq
 import threading
+import time
 import ibapipy.config as config
-from ibapipy.core.network_handler import NetworkHandler
+from ibapipy.core.contract_cache import RESOLVER_METHODS
+from ibapipy.core.historical_scheduler import SCHEDULER_METHODS
+from ibapipy.core.network_handler import (QUEUE_TRANSPORT, NetworkHandler,
+                                          encode_message)
+from ibapipy.core.order_book import DEPTH_METHODS
+from ibapipy.data.bar_buffer import BarBuffer
+import ibapipy.core.reader as reader
+
+
+# Methods that are folded into the quote book when one is attached
+QUOTE_METHODS = ('tick_price', 'tick_size')
+
+# Methods that route_market_data() may fold into the quote book, the order
+# book or the bar buffers
+MARKET_DATA_METHODS = frozenset(QUOTE_METHODS + DEPTH_METHODS +
+                                ('real_time_bar',))
+
+# Codes of the error() messages that are warnings or notices rather than
+# failures of the request they refer to: market data farm and other status
+# notices (2100-2199), market depth resets (317) and partly subscribed or
+# delayed market data (10090, 10167)
+WARNING_CODES = frozenset([317, 10090, 10167] + list(range(2100, 2200)))
+
+# Default number of bars held per real-time bar request (a day of 5 second
+# bars)
+REAL_TIME_BAR_CAPACITY = 17280
 
 
 class ClientSocket:
-    """Provides methods for sending requests to TWS."""
+    """Provides methods for sending requests to TWS.
+
+    The *_future() request methods send the same request as the method
+    without the suffix and return a concurrent.futures.Future. The callbacks
+    are still made; in addition, the responses are collected and the future
+    resolves with them once the end of the response has been received. It
+    fails with an IBAPIPyError if error() is received for the request ID
+    with a code that is not a warning (see WARNING_CODES), if the connection
+    is closed or if the timeout expires first. Use
+    asyncio.wrap_future() to await one from a coroutine.
 
-    def __init__(self):
-        """Initialize a new instance of a ClientSocket."""
+    """
+
+    def __init__(self, historical_columns=False, quote_book=None,
+                 conflating_queue=None, dispatcher=None, capture_path=None,
+                 contract_resolver=None, historical_scheduler=None,
+                 order_book=None, instrumentation=None,
+                 transport=QUEUE_TRANSPORT, skip_unhandled=False,
+                 lazy_objects=False):
+        """Initialize a new instance of a ClientSocket.
+
+        Keyword arguments:
+        historical_columns -- True to receive each historical data response as
+                              a single structured NumPy array via
+                              historical_data_columns() rather than one
+                              historical_data() call per bar (default: False)
+        quote_book         -- ibapipy.core.quote_book.QuoteBook that absorbs
+                              the bid, ask, size and volume ticks of
+                              req_mkt_data() requests; coalesced quote
+                              changes are delivered via update_quote()
+                              instead (default: None)
+        conflating_queue   -- ibapipy.core.conflating_queue.ConflatingQueue
+                              that incoming messages are drained into before
+                              being dispatched, applying its conflation and
+                              bounds when callbacks fall behind (default: None)
+        dispatcher         -- ibapipy.core.dispatcher.Dispatcher whose worker
+                              threads run the callbacks instead of the
+                              listener thread (default: None)
+        capture_path       -- session file that the raw data received from
+                              TWS is appended to for later replay with
+                              ibapipy.core.replay.replay() (default: None)
+        contract_resolver  -- ibapipy.core.contract_cache.ContractResolver
+                              that consumes the responses to its contract
+                              details requests (default: None)
+        historical_scheduler -- ibapipy.core.historical_scheduler.
+                                HistoricalScheduler that consumes the
+                                responses to its historical data requests
+                                (default: None)
+        order_book         -- ibapipy.core.order_book.OrderBook that absorbs
+                              update_mkt_depth() and update_mkt_depth_l2()
+                              messages; coalesced book changes are delivered
+                              via update_order_book() instead (default: None)
+        instrumentation    -- ibapipy.core.instrumentation.Instrumentation
+                              that records per-stage latencies of every
+                              message and samples the queue depths
+                              (default: None)
+        transport          -- network_handler.QUEUE_TRANSPORT or
+                              network_handler.SHARED_MEMORY_TRANSPORT to
+                              pass data between the network handler
+                              processes through shared memory rings
+                              (default: QUEUE_TRANSPORT)
+        skip_unhandled     -- True to have the network handler read past the
+                              messages for callbacks that neither this
+                              client's class overrides nor any of the
+                              attached components consume, without decoding
+                              them (see handled_methods()) (default: False)
+        lazy_objects       -- True to receive the contracts, orders and
+                              executions of contract_details(),
+                              exec_details(), open_order() and
+                              update_portfolio() as lazy variants that keep
+                              the raw fields of the message and convert each
+                              attribute on first access (see
+                              ibapipy.data.lazy_object) (default: False)
+
+        """
         self.__listener_thread__ = None
-        self.__network_handler__ = NetworkHandler()
+        self.__pump_thread__ = None
+        self.instrumentation = instrumentation
+        self.quote_book = quote_book
+        self.conflating_queue = conflating_queue
+        self.dispatcher = dispatcher
+        self.contract_resolver = contract_resolver
+        self.historical_scheduler = historical_scheduler
+        self.order_book = order_book
+        methods = handled_methods(self) if skip_unhandled else None
+        self.__network_handler__ = self.__new_network_handler__(
+            historical_columns, capture_path, instrumentation is not None,
+            transport, methods, lazy_objects)
+        self.bar_buffers = {}
+        # Pending *_future() and awaitable requests, keyed by request ID
+        # (or by name for requests without one)
+        self.__requests__ = {}
+        self.__request_lock__ = threading.Lock()
+        self.__request_timer__ = None
         self.server_version = 0
         self.tws_connection_time = ''
         self.is_connected = False
 
+    def __new_network_handler__(self, historical_columns, capture_path,
+                                instrumented, transport, methods,
+                                lazy_objects):
+        """Return the network handler of this client, created from the
+        constructor arguments of the same names (see NetworkHandler).
+
+        """
+        return NetworkHandler(historical_columns, capture_path, instrumented,
+                              transport, methods, lazy_objects)
+
     def __send__(self, *args):
-        """Hand off each element in args to the NetworkHandler for sending over
-        the network.
+        """Encode the elements in args into a single message and hand it off
+        to the NetworkHandler for sending over the network.
 
         *args -- items to send
 
         """
-        for item in args:
-            self.__network_handler__.socket_out_queue.put(item, block=False)
+        self.__network_handler__.socket_out_queue.put(encode_message(*args),
+                                                      block=False)
 
     def account_download_end(self, account_name):
         pass
@@ -61,9 +190,14 @@ class ClientSocket:
     def cancel_mkt_data(self, req_id):
         version = 1
         self.__send__(config.CANCEL_MKT_DATA, version, req_id)
+        if self.quote_book is not None:
+            self.quote_book.remove(req_id)
 
     def cancel_mkt_depth(self, req_id):
-        raise NotImplementedError()
+        version = 1
+        self.__send__(config.CANCEL_MKT_DEPTH, version, req_id)
+        if self.order_book is not None:
+            self.order_book.remove(req_id)
 
     def cancel_news_bulletins(self):
         raise NotImplementedError()
@@ -73,35 +207,69 @@ class ClientSocket:
         self.__send__(config.CANCEL_ORDER, version, req_id)
 
     def cancel_real_time_bars(self, req_id):
-        raise NotImplementedError()
+        """Cancel a real-time bar subscription and return its BarBuffer, or
+        None if there was none.
+
+        Keyword arguments:
+        req_id -- request ID passed to req_real_time_bars()
+
+        """
+        version = 1
+        self.__send__(config.CANCEL_REAL_TIME_BARS, version, req_id)
+        buffer = self.bar_buffers.pop(req_id, None)
+        if buffer is not None:
+            switch_methods(self, ('real_time_bar',), False)
+        return buffer
 
     def cancel_scanner_subscription(self, req_id):
         raise NotImplementedError()
 
     def connect(self, host=config.HOST, port=config.PORT,
-                client_id=config.CLIENT_ID):
+                client_id=config.CLIENT_ID, socket_options=None):
         """Connect to the remote TWS.
 
         Keyword arguments:
-        host      -- host name or IP address of the TWS machine
-        port      -- port number on the TWS machine
-        client_id -- number used to identify this client connection
+        host           -- host name or IP address of the TWS machine
+        port           -- port number on the TWS machine
+        client_id      -- number used to identify this client connection
+        socket_options -- network_handler.SocketOptions, such as
+                          network_handler.LOW_LATENCY_SOCKET_OPTIONS
+                          (default: network_handler.DEFAULT_SOCKET_OPTIONS)
 
         """
         if self.is_connected:
             return
         # Connect
-        results = self.__network_handler__.connect(host, port, client_id)
+        results = self.__network_handler__.connect(host, port, client_id,
+                                                   socket_options)
         self.server_version, self.tws_connection_time = results
         self.is_connected = True
         # Listen for incoming messages
+        if self.dispatcher is not None:
+            self.dispatcher.start(self)
+        message_queue = self.__network_handler__.message_queue
+        if self.conflating_queue is not None:
+            self.__pump_thread__ = threading.Thread(
+                target=pump, args=(message_queue, self.conflating_queue))
+            self.__pump_thread__.start()
+            message_queue = self.conflating_queue
+        if self.instrumentation is not None:
+            handler = self.__network_handler__
+            queues = {'message_queue': handler.message_queue,
+                      'socket_in_queue': handler.socket_in_queue,
+                      'socket_out_queue': handler.socket_out_queue}
+            if self.conflating_queue is not None:
+                queues['conflating_queue'] = self.conflating_queue
+            self.instrumentation.start(queues)
         self.__listener_thread__ = threading.Thread(
-            target=listen, args=(self, self.__network_handler__.message_queue))
+            target=listen, args=(self, message_queue))
         self.__listener_thread__.start()
 
     def disconnect(self):
         """Disconnect from the remote TWS."""
         self.__network_handler__.disconnect()
+        if self.instrumentation is not None:
+            self.instrumentation.stop()
         self.is_connected = False
         self.server_version = 0
         self.tws_connection_time = ''
@@ -123,6 +291,20 @@ class ClientSocket:
                         bar_count, wap, has_gaps):
         pass
 
+    def historical_data_columns(self, req_id, start_date, end_date, bars):
+        """Callback for a complete historical data response when the client
+        was created with historical_columns=True.
+
+        Keyword arguments:
+        req_id     -- request ID
+        start_date -- start date of the response
+        end_date   -- end date of the response
+        bars       -- structured NumPy array with one row per bar and the
+                      fields listed in reader.HISTORICAL_DATA_DTYPE
+
+        """
+        pass
+
     def managed_accounts(self, accounts):
         pass
 
@@ -142,69 +324,89 @@ class ClientSocket:
     def place_order(self, req_id, contract, order):
         version = 35
         # Intro and request ID
-        self.__send__(config.PLACE_ORDER, version, req_id)
+        fields = [config.PLACE_ORDER, version, req_id]
         # Contract fields
-        self.__send__(contract.con_id, contract.symbol, contract.sec_type,
-                      contract.expiry, contract.strike, contract.right,
-                      contract.multiplier, contract.exchange,
-                      contract.primary_exch, contract.currency,
-                      contract.local_symbol, contract.sec_id_type,
-                      contract.sec_id)
+        fields.extend((contract.con_id, contract.symbol, contract.sec_type,
+                       contract.expiry, contract.strike, contract.right,
+                       contract.multiplier, contract.exchange,
+                       contract.primary_exch, contract.currency,
+                       contract.local_symbol, contract.sec_id_type,
+                       contract.sec_id))
         # Main order fields
-        self.__send__(order.action, order.total_quantity, order.order_type,
-                      order.lmt_price, order.aux_price)
+        fields.extend((order.action, order.total_quantity, order.order_type,
+                       order.lmt_price, order.aux_price))
         # Extended order fields
-        self.__send__(order.tif, order.oca_group, order.account,
-                      order.open_close, order.origin, order.order_ref,
-                      order.transmit, order.parent_id, order.block_order,
-                      order.sweep_to_fill, order.display_size,
-                      order.trigger_method, order.outside_rth, order.hidden)
+        fields.extend((order.tif, order.oca_group, order.account,
+                       order.open_close, order.origin, order.order_ref,
+                       order.transmit, order.parent_id, order.block_order,
+                       order.sweep_to_fill, order.display_size,
+                       order.trigger_method, order.outside_rth, order.hidden))
         # Send combo legs for bag requests
         if config.BAG_SEC_TYPE == contract.sec_type.upper():
             raise NotImplementedError('Bag type not supported yet.')
-        self.__send__('')      # deprecated shares_allocation field
+        fields.append('')      # deprecated shares_allocation field
         # Everything else (broken into quasi-readble chunks)
-        self.__send__(order.discretionary_amt, order.good_after_time,
-                      order.good_till_date, order.fa_group, order.fa_method,
-                      order.fa_percentage, order.fa_profile,
-                      order.short_sale_slot, order.designated_location)
-        self.__send__(order.exempt_code, order.oca_type, order.rule_80a,
-                      order.settling_firm, order.all_or_none,
-                      check(order.min_qty), check(order.percent_offset),
-                      order.etrade_only, order.firm_quote_only,
-                      check(order.nbbo_price_cap))
-        self.__send__(check(order.auction_strategy),
-                      check(order.starting_price),
-                      check(order.stock_ref_price), check(order.delta),
-                      check(order.stock_range_lower),
-                      check(order.stock_range_upper),
-                      order.override_percentage_constraints,
-                      check(order.volatility), check(order.volatility_type),
-                      order.delta_neutral_order_type,
-                      check(order.delta_neutral_aux_price))
+        fields.extend((order.discretionary_amt, order.good_after_time,
+                       order.good_till_date, order.fa_group, order.fa_method,
+                       order.fa_percentage, order.fa_profile,
+                       order.short_sale_slot, order.designated_location))
+        fields.extend((order.exempt_code, order.oca_type, order.rule_80a,
+                       order.settling_firm, order.all_or_none,
+                       check(order.min_qty), check(order.percent_offset),
+                       order.etrade_only, order.firm_quote_only,
+                       check(order.nbbo_price_cap)))
+        fields.extend((check(order.auction_strategy),
+                       check(order.starting_price),
+                       check(order.stock_ref_price), check(order.delta),
+                       check(order.stock_range_lower),
+                       check(order.stock_range_upper),
+                       order.override_percentage_constraints,
+                       check(order.volatility), check(order.volatility_type),
+                       order.delta_neutral_order_type,
+                       check(order.delta_neutral_aux_price)))
         if len(order.delta_neutral_order_type) > 0:
-            self.__send__(order.delta_neutral_con_id,
-                          order.delta_neutral_settling_firm,
-                          order.delta_neutral_clearing_account,
-                          order.delta_neutral_clearing_intent)
-        self.__send__(order.continuous_update,
-                      check(order.reference_price_type),
-                      check(order.trail_stop_price),
-                      check(order.scale_init_level_size),
-                      check(order.scale_subs_level_size),
-                      check(order.scale_price_increment), order.hedge_type)
+            fields.extend((order.delta_neutral_con_id,
+                           order.delta_neutral_settling_firm,
+                           order.delta_neutral_clearing_account,
+                           order.delta_neutral_clearing_intent))
+        fields.extend((order.continuous_update,
+                       check(order.reference_price_type),
+                       check(order.trail_stop_price),
+                       check(order.scale_init_level_size),
+                       check(order.scale_subs_level_size),
+                       check(order.scale_price_increment), order.hedge_type))
         if len(order.hedge_type) > 0:
-            self.__send__(order.hedge_param)
-        self.__send__(order.opt_out_smart_routing, order.clearing_account,
-                      order.clearing_intent, order.not_held)
+            fields.append(order.hedge_param)
+        fields.extend((order.opt_out_smart_routing, order.clearing_account,
+                       order.clearing_intent, order.not_held))
         if contract.under_comp is not None:
             raise NotImplementedError('Under comp not supported yet.')
         else:
-            self.__send__(False)
-        self.__send__(order.algo_strategy)
+            fields.append(False)
+        fields.append(order.algo_strategy)
         if len(order.algo_strategy) > 0:
             raise NotImplementedError('Algo strategy not supported yet.')
-        self.__send__(order.what_if)
+        fields.append(order.what_if)
+        self.__send__(*fields)
+
+    def real_time_bar(self, req_id, time, open, high, low, close, volume,
+                      wap, count):
+        """Callback for a real-time bar. The bar has already been appended to
+        self.bar_buffers[req_id].
+
+        Keyword arguments:
+        req_id -- request ID passed to req_real_time_bars()
+        time   -- start of the bar in seconds since the Epoch
+        open   -- opening price
+        high   -- high price
+        low    -- low price
+        close  -- closing price
+        volume -- volume
+        wap    -- weighted average price
+        count  -- number of trades
+
+        """
+        pass
 
     def replace_fa(self, fa_data_type, xml):
         raise NotImplementedError()
@@ -217,21 +419,49 @@ class ClientSocket:
         version = 1
         self.__send__(config.REQ_ALL_OPEN_ORDERS, version)
 
+    def req_all_open_orders_future(self, timeout=None):
+        """Request all open orders and return a concurrent.futures.Future
+        that resolves with a list of (contract, order) tuples once
+        open_order_end() is received. Raises IBAPIPyError if an open orders
+        request is already pending, as the responses cannot be told apart.
+
+        Keyword arguments:
+        timeout -- seconds after which the request fails (default: None)
+
+        """
+        future = start_future(self, 'open_orders', timeout,
+                              ('open_order', 'open_order_end'))
+        self.req_all_open_orders()
+        return future
+
     def req_auto_open_orders(self, auto_bind):
         version = 1
         self.__send__(config.REQ_AUTO_OPEN_ORDERS, version, auto_bind)
 
     def req_contract_details(self, req_id, contract):
         version = 6
-        # Contract data message
-        self.__send__(config.REQ_CONTRACT_DATA, version, req_id)
-        # Contract fields
-        self.__send__(contract.con_id, contract.symbol, contract.sec_type,
-                      contract.expiry, contract.strike, contract.right,
-                      contract.multiplier, contract.exchange,
-                      contract.currency, contract.local_symbol,
-                      contract.include_expired, contract.sec_id_type,
-                      contract.sec_id)
+        self.__send__(
+            # Contract data message
+            config.REQ_CONTRACT_DATA, version, req_id,
+            # Contract fields
+            contract.con_id, contract.symbol, contract.sec_type,
+            contract.expiry, contract.strike, contract.right,
+            contract.multiplier, contract.exchange, contract.currency,
+            contract.local_symbol, contract.include_expired,
+            contract.sec_id_type, contract.sec_id)
+
+    def req_contract_details_future(self, req_id, contract, timeout=None):
+        """Request contract details and return a concurrent.futures.Future
+        that resolves with the list of matching Contract objects.
+
+        Keyword arguments are those of req_contract_details() plus:
+        timeout -- seconds after which the request fails (default: None)
+
+        """
+        future = start_future(self, req_id, timeout,
+                              ('contract_details', 'contract_details_end'))
+        self.req_contract_details(req_id, contract)
+        return future
 
     def req_current_time(self):
         """Returns the current system time on the server side via the
@@ -241,15 +471,42 @@ class ClientSocket:
         version = 1
         self.__send__(config.REQ_CURRENT_TIME, version)
 
+    def req_current_time_future(self, timeout=None):
+        """Request the current time and return a concurrent.futures.Future
+        that resolves with it in seconds since the Epoch.
+
+        Keyword arguments:
+        timeout -- seconds after which the request fails (default: None)
+
+        """
+        future = start_future(self, 'current_time', timeout,
+                              ('current_time',))
+        self.req_current_time()
+        return future
+
     def req_executions(self, req_id, exec_filter):
         version = 3
-        # Execution message
-        self.__send__(config.REQ_EXECUTIONS, version, req_id)
-        # Execution report filter
-        self.__send__(exec_filter.client_id, exec_filter.acct_code,
-                      exec_filter.time, exec_filter.symbol,
-                      exec_filter.sec_type, exec_filter.exchange,
-                      exec_filter.side)
+        self.__send__(
+            # Execution message
+            config.REQ_EXECUTIONS, version, req_id,
+            # Execution report filter
+            exec_filter.client_id, exec_filter.acct_code, exec_filter.time,
+            exec_filter.symbol, exec_filter.sec_type, exec_filter.exchange,
+            exec_filter.side)
+
+    def req_executions_future(self, req_id, exec_filter, timeout=None):
+        """Request executions and return a concurrent.futures.Future that
+        resolves with a list of (contract, execution) tuples once
+        exec_details_end() is received.
+
+        Keyword arguments are those of req_executions() plus:
+        timeout -- seconds after which the request fails (default: None)
+
+        """
+        future = start_future(self, req_id, timeout,
+                              ('exec_details', 'exec_details_end'))
+        self.req_executions(req_id, exec_filter)
+        return future
 
     def req_fundamental_data(self, req_id, contract, report_type):
         raise NotImplementedError()
@@ -258,19 +515,40 @@ class ClientSocket:
                             duration_str, bar_size_setting, what_to_show,
                             use_rth, format_date):
         version = 4
-        self.__send__(config.REQ_HISTORICAL_DATA, version, req_id)
-        # Contract fields
-        self.__send__(contract.symbol, contract.sec_type, contract.expiry,
-                      contract.strike, contract.right, contract.multiplier,
-                      contract.exchange, contract.primary_exch,
-                      contract.currency, contract.local_symbol,
-                      contract.include_expired)
-        # Other stuff
-        self.__send__(end_date_time, bar_size_setting, duration_str, use_rth,
-                      what_to_show, format_date)
         # Combo legs for bag requests
         if config.BAG_SEC_TYPE == contract.sec_type.upper():
             raise NotImplementedError('Bag type not supported yet.')
+        self.__send__(
+            config.REQ_HISTORICAL_DATA, version, req_id,
+            # Contract fields
+            contract.symbol, contract.sec_type, contract.expiry,
+            contract.strike, contract.right, contract.multiplier,
+            contract.exchange, contract.primary_exch, contract.currency,
+            contract.local_symbol, contract.include_expired,
+            # Other stuff
+            end_date_time, bar_size_setting, duration_str, use_rth,
+            what_to_show, format_date)
+
+    def req_historical_data_future(self, req_id, contract, end_date_time,
+                                   duration_str, bar_size_setting,
+                                   what_to_show, use_rth, format_date,
+                                   timeout=None):
+        """Request historical data and return a concurrent.futures.Future
+        that resolves with a list of bars, each of the form (date, open,
+        high, low, close, volume, bar_count, wap, has_gaps), or with a
+        structured NumPy array if the client was created with
+        historical_columns=True.
+
+        Keyword arguments are those of req_historical_data() plus:
+        timeout -- seconds after which the request fails (default: None)
+
+        """
+        future = start_future(self, req_id, timeout,
+                              ('historical_data', 'historical_data_columns'))
+        self.req_historical_data(req_id, contract, end_date_time,
+                                 duration_str, bar_size_setting, what_to_show,
+                                 use_rth, format_date)
+        return future
 
     def req_ids(self, num_ids):
         version = 1
@@ -300,25 +578,48 @@ class ClientSocket:
 
         """
         version = 9
-        # Intro and request ID
-        self.__send__(config.REQ_MKT_DATA, version, req_id)
-        # Contract fields
-        self.__send__(contract.con_id, contract.symbol, contract.sec_type,
-                      contract.expiry, contract.strike, contract.right,
-                      contract.multiplier, contract.exchange,
-                      contract.primary_exch, contract.currency,
-                      contract.local_symbol)
         if config.BAG_SEC_TYPE == contract.sec_type:
             raise NotImplementedError('Bag type not supported yet.')
         if contract.under_type is not None:
             raise NotImplementedError('Under comp not supported yet.')
-        else:
-            self.__send__(False)
-        # Remaining parameters
-        self.__send__(generic_ticklist, snapshot)
+        # Added before sending so that the first ticks find their row
+        if self.quote_book is not None:
+            self.quote_book.add(req_id, contract)
+        self.__send__(
+            # Intro and request ID
+            config.REQ_MKT_DATA, version, req_id,
+            # Contract fields
+            contract.con_id, contract.symbol, contract.sec_type,
+            contract.expiry, contract.strike, contract.right,
+            contract.multiplier, contract.exchange, contract.primary_exch,
+            contract.currency, contract.local_symbol,
+            # No under comp
+            False,
+            # Remaining parameters
+            generic_ticklist, snapshot)
 
     def req_mkt_depth(self, req_id, contract, num_rows):
-        raise NotImplementedError()
+        """Return market depth via the update_mkt_depth() and
+        update_mkt_depth_l2() wrapper methods, or via update_order_book() if
+        the client has an order book.
+
+        Keyword arguments:
+        req_id   -- unique request ID
+        contract -- ibapi.contract.Contract object
+        num_rows -- number of rows on each side of the book
+
+        """
+        version = 3
+        self.__send__(
+            config.REQ_MKT_DEPTH, version, req_id,
+            # Contract fields
+            contract.symbol, contract.sec_type, contract.expiry,
+            contract.strike, contract.right, contract.multiplier,
+            contract.exchange, contract.currency, contract.local_symbol,
+            # Remaining parameters
+            num_rows)
+        if self.order_book is not None:
+            self.order_book.add(req_id, contract)
 
     def req_news_bulletins(self, all_msgs):
         raise NotImplementedError()
@@ -327,9 +628,56 @@ class ClientSocket:
         version = 1
         self.__send__(config.REQ_OPEN_ORDERS, version)
 
+    def req_open_orders_future(self, timeout=None):
+        """Request the open orders of this client and return a
+        concurrent.futures.Future that resolves with a list of (contract,
+        order) tuples once open_order_end() is received. Raises IBAPIPyError
+        if an open orders request is already pending, as the responses
+        cannot be told apart.
+
+        Keyword arguments:
+        timeout -- seconds after which the request fails (default: None)
+
+        """
+        future = start_future(self, 'open_orders', timeout,
+                              ('open_order', 'open_order_end'))
+        self.req_open_orders()
+        return future
+
     def req_real_time_bars(self, req_id, contract, bar_size, what_to_show,
-                           use_rth):
-        raise NotImplementedError()
+                           use_rth, capacity=REAL_TIME_BAR_CAPACITY):
+        """Return real-time bars via the real_time_bar() wrapper method.
+
+        Each bar is also appended to a BarBuffer kept in
+        self.bar_buffers[req_id] before the callback is made, so windows of
+        recent bars can be read as views with last() or between().
+
+        Keyword arguments:
+        req_id       -- unique request ID
+        contract     -- ibapi.contract.Contract object
+        bar_size     -- size of the bars in seconds; only 5 is supported by
+                        TWS
+        what_to_show -- TRADES, BID, ASK or MIDPOINT
+        use_rth      -- 1 for regular trading hours only; 0, otherwise
+        capacity     -- number of bars held in the buffer
+                        (default: REAL_TIME_BAR_CAPACITY)
+
+        """
+        version = 1
+        if config.BAG_SEC_TYPE == contract.sec_type.upper():
+            raise NotImplementedError('Bag type not supported yet.')
+        if req_id not in self.bar_buffers:
+            switch_methods(self, ('real_time_bar',), True)
+        self.bar_buffers[req_id] = BarBuffer(contract.local_symbol, capacity)
+        self.__send__(
+            config.REQ_REAL_TIME_BARS, version, req_id,
+            # Contract fields
+            contract.symbol, contract.sec_type, contract.expiry,
+            contract.strike, contract.right, contract.multiplier,
+            contract.exchange, contract.primary_exch, contract.currency,
+            contract.local_symbol,
+            # Other stuff
+            bar_size, what_to_show, use_rth)
 
     def req_scanner_parameters(self):
         raise NotImplementedError()
@@ -359,17 +707,52 @@ class ClientSocket:
     def tick_size(self, req_id, tick_type, size):
         pass
 
+    def tick_snapshot_end(self, req_id):
+        pass
+
     def update_account_time(self, timestamp):
         pass
 
     def update_account_value(self, key, value, currency, account_name):
         pass
 
+    def update_mkt_depth(self, req_id, position, operation, side, price,
+                         size):
+        pass
+
+    def update_mkt_depth_l2(self, req_id, position, market_maker, operation,
+                            side, price, size):
+        pass
+
+    def update_order_book(self, req_id, order_book):
+        """Callback for a coalesced book change when the client was created
+        with an order book.
+
+        Keyword arguments:
+        req_id     -- market depth request ID
+        order_book -- ibapipy.core.order_book.OrderBook holding the book; it
+                      keeps changing, so read it before returning (e.g. with
+                      best_bid(), best_ask() or snapshot())
+
+        """
+        pass
+
     def update_portfolio(self, contract, position, market_price, market_value,
                          average_cost, unrealized_pnl, realized_pnl,
                          account_name):
         pass
 
+    def update_quote(self, req_id, tick):
+        """Callback for a coalesced quote change when the client was created
+        with a quote book.
+
+        Keyword arguments:
+        req_id -- market data request ID
+        tick   -- ibapipy.data.tick.Tick object holding the current quote
+
+        """
+        pass
+
     def update_unknown(self, *args):
         """Callback for updated known data that does not match any existing
         callbacks.
@@ -378,6 +761,76 @@ class ClientSocket:
         pass
 
 
+class RequestTimer:
+    """Fails pending requests whose timeout has expired, using a single
+    daemon thread per client.
+
+    """
+
+    def __init__(self, client):
+        """Initialize a new instance of a RequestTimer.
+
+        Keyword arguments:
+        client -- client whose pending requests are timed
+
+        """
+        self.client = client
+        self.deadlines = []
+        self.condition = threading.Condition()
+        self.sequence = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def add(self, key, future, timeout):
+        """Fail the request identified by key with an IBAPIPyError unless
+        its future is done within 'timeout' seconds.
+
+        """
+        with self.condition:
+            self.sequence += 1
+            heapq.heappush(self.deadlines, (time.monotonic() + timeout,
+                                            self.sequence, key, future))
+            self.condition.notify()
+
+    def run(self):
+        """Wait for the earliest deadline and expire it, forever."""
+        while True:
+            with self.condition:
+                while len(self.deadlines) == 0:
+                    self.condition.wait()
+                deadline, sequence, key, future = self.deadlines[0]
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+                heapq.heappop(self.deadlines)
+            if not future.done():
+                msg = 'Request {0} timed out.'.format(key)
+                fail_request(self.client, key, msg, future)
+
+
+def add_result(client, key, result):
+    """Add a result to the pending request identified by key."""
+    entry = client.__requests__.get(key)
+    if entry is not None:
+        entry[0].append(result)
+
+
+def append_bar(client, parms):
+    """Append a real_time_bar message to the buffer of its request, if any.
+
+    Keyword arguments:
+    client -- client
+    parms  -- tuple of parameters of the real_time_bar() callback
+
+    """
+    buffer = client.bar_buffers.get(parms[0])
+    if buffer is not None:
+        req_id, seconds, open, high, low, close, volume, wap, count = parms
+        buffer.append_values(seconds * 1000, open, high, low, close, volume,
+                             count)
+
+
 def check(value):
     """Check to see if the specified value is equal to JAVA_INT_MAX or
     JAVA_DOUBLE_MAX and return None if such is the case; otherwise return
@@ -400,6 +853,81 @@ def check(value):
         return value
 
 
+def fail_request(client, key, message, future=None):
+    """Fail the pending request identified by key with an IBAPIPyError.
+
+    Keyword arguments:
+    client  -- client
+    key     -- request ID or name of the request
+    message -- error message
+    future  -- only fail the request if this is its future (default: None)
+
+    """
+    with client.__request_lock__:
+        entry = client.__requests__.get(key)
+        if entry is None or (future is not None and entry[1] is not future):
+            return
+        del client.__requests__[key]
+    switch_methods(client, entry[2], False)
+    if not entry[1].done():
+        entry[1].set_exception(IBAPIPyError(message))
+
+
+def fail_requests(client, message):
+    """Fail every pending request of the client with an IBAPIPyError."""
+    with client.__request_lock__:
+        entries = list(client.__requests__.values())
+        client.__requests__.clear()
+    for results, future, methods in entries:
+        switch_methods(client, methods, False)
+        if not future.done():
+            future.set_exception(IBAPIPyError(message))
+
+
+def finish_request(client, key, result=None):
+    """Complete the pending request identified by key. If result is None,
+    the request resolves with the list of results collected so far.
+
+    """
+    with client.__request_lock__:
+        entry = client.__requests__.pop(key, None)
+    if entry is None:
+        return
+    results, future, methods = entry
+    switch_methods(client, methods, False)
+    if not future.done():
+        future.set_result(results if result is None else result)
+
+
+def handled_methods(client):
+    """Return the set of names of the callback methods that the specified
+    client needs the messages for: the ones its class overrides and the ones
+    consumed by its quote book, order book, contract resolver and historical
+    scheduler. The messages of pending *_future() requests and real-time bar
+    buffers are turned on through the network handler's message switch while
+    they are needed.
+
+    Keyword arguments:
+    client -- ClientSocket
+
+    """
+    methods = set()
+    for names in reader.MESSAGE_METHODS.values():
+        for name in names:
+            if getattr(type(client), name, None) is not \
+                    getattr(ClientSocket, name, None) or \
+                    name in vars(client):
+                methods.add(name)
+    for component, names in ((client.quote_book, QUOTE_METHODS),
+                             (client.order_book, DEPTH_METHODS),
+                             (client.contract_resolver, RESOLVER_METHODS),
+                             (client.historical_scheduler,
+                              SCHEDULER_METHODS)):
+        if component is not None:
+            methods.update(names)
+    return methods
+
+
 def is_java_double_max(number):
     """Returns True if the specified number is equal to the maximum value of
     a Double in Java; False, otherwise.
@@ -422,6 +950,24 @@ def is_java_int_max(number):
     return type(number) == int and number == config.JAVA_INT_MAX
 
 
+def dispatch(client, method, parms):
+    """Call the client method named 'method' with the specified parameters,
+    falling back to update_unknown() if the client has no such method.
+
+    Keyword arguments:
+    client -- client
+    method -- name of the method to call
+    parms  -- tuple of parameters for the method
+
+    """
+    if hasattr(client, method):
+        getattr(client, method)(*parms)
+    else:
+        parms = list(parms)
+        parms.insert(0, method)
+        getattr(client, 'update_unknown')(*parms)
+
+
 def listen(client, in_queue):
     """Listen to messages in the specified incoming queue and call the
     appropriate methods in the client.
@@ -431,16 +977,244 @@ def listen(client, in_queue):
     in_queue -- incoming message queue
 
     """
+    quote_book = client.quote_book
+    order_book = client.order_book
+    resolver = client.contract_resolver
+    scheduler = client.historical_scheduler
+    instrumentation = client.instrumentation
+    intervals = [book.interval_ms for book in (quote_book, order_book)
+                 if book is not None and book.interval_ms > 0]
+    timeout = min(intervals) / 1000.0 if len(intervals) > 0 else None
+    if client.dispatcher is None:
+        deliver = functools.partial(dispatch, client)
+    else:
+        deliver = client.dispatcher.submit
+    # Time at which held-back quote and book changes are next published if
+    # other messages keep the queue from timing out
+    flush_at = 0
     # Loop until we receive a stop message in the incoming queue
     while True:
-        method, parms = in_queue.get()
+        if instrumentation is not None:
+            # Every path through the loop comes back here once the previous
+            # message has been handled
+            instrumentation.end()
+        try:
+            item = in_queue.get(timeout=timeout)
+        except Empty:
+            publish_due(client, deliver)
+            continue
+        if timeout is not None:
+            now = time.time()
+            if now >= flush_at:
+                publish_due(client, deliver)
+                flush_at = now + timeout
+        method, parms = item
+        if instrumentation is not None:
+            instrumentation.begin(item)
         if method == 'stop':
+            if client.dispatcher is not None:
+                client.dispatcher.stop()
+            fail_requests(client, 'Connection closed.')
             return
         elif method is None:
             continue
-        elif hasattr(client, method):
-            getattr(client, method)(*parms)
+        elif method in MARKET_DATA_METHODS and \
+                route_market_data(client, method, parms, deliver):
+            continue
+        elif resolver is not None and method in RESOLVER_METHODS and \
+                resolver.apply(method, parms):
+            continue
+        elif scheduler is not None and method in SCHEDULER_METHODS and \
+                scheduler.apply(method, parms):
+            continue
+        else:
+            deliver(method, parms)
+            if len(client.__requests__) > 0:
+                route_response(client, method, parms)
+
+
+def pump(in_queue, out_queue):
+    """Move messages from in_queue to out_queue as fast as they arrive until
+    a stop message has been moved.
+
+    Keyword arguments:
+    in_queue  -- incoming message queue
+    out_queue -- queue that messages are moved to
+
+    """
+    while True:
+        item = in_queue.get()
+        out_queue.put(item)
+        if item[0] == 'stop':
+            return
+
+
+def publish_books(client, deliver=None, milliseconds=None):
+    """Call update_order_book() for each book in the client's order book
+    that has changed and is due to be published.
+
+    Keyword arguments:
+    client       -- client
+    deliver      -- function taking a method name and parameters that is used
+                    to make the calls (default: call the client directly)
+    milliseconds -- current time in milliseconds since the Epoch (default:
+                    current time)
+
+    """
+    order_book = client.order_book
+    for req_id in order_book.poll(milliseconds):
+        if deliver is None:
+            client.update_order_book(req_id, order_book)
+        else:
+            deliver('update_order_book', (req_id, order_book))
+
+
+def publish_due(client, deliver=None, milliseconds=None):
+    """Publish the changes of the client's quote book and order book that
+    are due (see publish_quotes() and publish_books()).
+
+    """
+    if client.quote_book is not None:
+        publish_quotes(client, deliver, milliseconds)
+    if client.order_book is not None:
+        publish_books(client, deliver, milliseconds)
+
+
+def publish_quotes(client, deliver=None, milliseconds=None):
+    """Call update_quote() for each quote in the client's quote book that has
+    changed and is due to be published.
+
+    Keyword arguments:
+    client       -- client
+    deliver      -- function taking a method name and parameters that is used
+                    to make the calls (default: call the client directly)
+    milliseconds -- current time in milliseconds since the Epoch (default:
+                    current time)
+
+    """
+    quote_book = client.quote_book
+    for req_id in quote_book.poll(milliseconds):
+        if deliver is None:
+            client.update_quote(req_id, quote_book.tick(req_id))
         else:
-            parms = list(parms)
-            parms.insert(0, method)
-            getattr(client, 'update_unknown')(*parms)
+            deliver('update_quote', (req_id, quote_book.tick(req_id)))
+
+
+def route_market_data(client, method, parms, deliver=None,
+                      milliseconds=None):
+    """Fold a market data message into the client's quote book, order book
+    or bar buffers and make the resulting calls. Return True if the message
+    was handled; False if it should be delivered as it is.
+
+    Keyword arguments:
+    client       -- client
+    method       -- name of the callback method
+    parms        -- tuple of parameters for the method
+    deliver      -- function taking a method name and parameters that is used
+                    to make the calls (default: call the client directly)
+    milliseconds -- time of the message in milliseconds since the Epoch
+                    (default: current time)
+
+    """
+    quote_book = getattr(client, 'quote_book', None)
+    if quote_book is not None and method in QUOTE_METHODS and \
+            quote_book.consumes(method, parms):
+        quote_book.apply(method, parms, milliseconds)
+        publish_quotes(client, deliver, milliseconds)
+        return True
+    order_book = getattr(client, 'order_book', None)
+    if order_book is not None and method in DEPTH_METHODS:
+        order_book.apply(method, parms, milliseconds)
+        publish_books(client, deliver, milliseconds)
+        return True
+    if method == 'real_time_bar' and \
+            getattr(client, 'bar_buffers', None) is not None:
+        append_bar(client, parms)
+        if deliver is None:
+            dispatch(client, method, parms)
+        else:
+            deliver(method, parms)
+        return True
+    return False
+
+
+def route_response(client, method, parms):
+    """Collect the specified message for the pending request that it
+    belongs to, if any, and complete or fail the request if the message ends
+    it.
+
+    Keyword arguments:
+    client -- client
+    method -- name of the callback method
+    parms  -- tuple of parameters for the method
+
+    """
+    if method == 'current_time':
+        finish_request(client, 'current_time', parms[0])
+    elif method == 'contract_details':
+        add_result(client, parms[0], parms[1])
+    elif method == 'contract_details_end':
+        finish_request(client, parms[0])
+    elif method == 'historical_data':
+        if str(parms[1]).startswith('finished'):
+            finish_request(client, parms[0])
+        else:
+            add_result(client, parms[0], parms[1:])
+    elif method == 'historical_data_columns':
+        finish_request(client, parms[0], parms[3])
+    elif method == 'exec_details':
+        add_result(client, parms[0], parms[1:])
+    elif method == 'exec_details_end':
+        finish_request(client, parms[0])
+    elif method == 'open_order':
+        add_result(client, 'open_orders', parms[1:])
+    elif method == 'open_order_end':
+        finish_request(client, 'open_orders')
+    elif method == 'error' and parms[1] not in WARNING_CODES:
+        fail_request(client, parms[0], parms[2])
+
+
+def start_future(client, key, timeout=None, methods=()):
+    """Register a pending request identified by key and return the
+    concurrent.futures.Future that will hold its result.
+
+    Keyword arguments:
+    client  -- client
+    key     -- request ID or name of the request
+    timeout -- seconds after which the request fails (default: None)
+    methods -- names of the callback methods of the responses, which are
+               decoded while the request is pending (default: ())
+
+    """
+    future = Future()
+    with client.__request_lock__:
+        if key in client.__requests__:
+            raise IBAPIPyError('Request {0} is already pending.'.format(key))
+        client.__requests__[key] = ([], future, methods)
+        switch_methods(client, methods, True)
+        if timeout is not None and client.__request_timer__ is None:
+            client.__request_timer__ = RequestTimer(client)
+    if timeout is not None:
+        client.__request_timer__.add(key, future, timeout)
+    return future
+
+
+def switch_methods(client, methods, enabled):
+    """Turn the decoding of the messages of the specified callback methods on
+    or off if the client skips the messages it does not handle.
+
+    Keyword arguments:
+    client  -- client
+    methods -- names of the callback methods
+    enabled -- True to turn decoding on; False to undo an earlier call that
+               turned it on
+
+    """
+    handler = getattr(client, '__network_handler__', None)
+    switch = getattr(handler, 'message_switch', None)
+    if switch is None or len(methods) == 0:
+        return
+    if enabled:
+        switch.enable(methods)
+    else:
+        switch.disable(methods)
@@ -0,0 +1,153 @@
+"""Thread-safe message queue with per-message-type conflation and bounds.
+
+When attached to a ClientSocket, a ConflatingQueue sits between the
+NetworkHandler message queue and the callbacks. A separate thread drains the
+message queue into it as fast as messages arrive, so a slow callback no longer
+lets the backlog grow without limit:
+
+* Conflated message types (by default tick_price, tick_size and tick_generic)
+  keep only the latest message for each (method, req_id, tick_type). A newer
+  value replaces the pending one in place, keeping its position in the queue.
+* Bounded message types hold at most the configured number of pending
+  messages; anything beyond that is dropped.
+* All other message types are queued without limit unless a default limit is
+  given.
+
+Counters for received, conflated and dropped messages along with high-water
+marks are available through stats().
+
+"""
+from collections import deque
+from multiprocessing.queues import Empty
+import threading
+import time
+
+
+# Policy for message types that keep only the latest value per key
+CONFLATE = 'conflate'
+
+# Default policies: latest-value-wins for market data ticks
+DEFAULT_POLICIES = {'tick_generic': CONFLATE,
+                    'tick_price': CONFLATE,
+                    'tick_size': CONFLATE}
+
+
+class ConflatingQueue:
+    """Queue of ('method name', (parm1, ...)) messages with per-method
+    policies.
+
+    """
+
+    def __init__(self, policies=None, default_limit=None):
+        """Initialize a new instance of a ConflatingQueue.
+
+        Keyword arguments:
+        policies      -- dictionary of method name to either CONFLATE or the
+                         maximum number of pending messages of that type
+                         (default: DEFAULT_POLICIES)
+        default_limit -- maximum number of pending messages for each method
+                         not listed in policies; None for no limit
+                         (default: None)
+
+        """
+        self.policies = dict(DEFAULT_POLICIES if policies is None
+                             else policies)
+        self.default_limit = default_limit
+        self.condition = threading.Condition()
+        self.entries = deque()
+        self.pending = {}
+        self.depths = {}
+        self.counters = {}
+        self.high_water = 0
+
+    def __len__(self):
+        """Return the number of pending messages."""
+        return len(self.entries)
+
+    def get(self, block=True, timeout=None):
+        """Remove and return the oldest pending message.
+
+        Keyword arguments:
+        block   -- True to wait for a message to become available
+                   (default: True)
+        timeout -- maximum number of seconds to wait; None to wait forever
+                   (default: None)
+
+        """
+        with self.condition:
+            if block and timeout is None:
+                while len(self.entries) == 0:
+                    self.condition.wait()
+            elif block:
+                end = time.monotonic() + timeout
+                while len(self.entries) == 0:
+                    remaining = end - time.monotonic()
+                    if remaining <= 0:
+                        raise Empty
+                    self.condition.wait(remaining)
+            elif len(self.entries) == 0:
+                raise Empty
+            entry = self.entries.popleft()
+            method = entry[0]
+            if len(entry) == 3:
+                del self.pending[entry[2]]
+            self.depths[method] -= 1
+            return method, entry[1]
+
+    def put(self, item, block=True, timeout=None):
+        """Add a message, applying the policy for its method.
+
+        Keyword arguments:
+        item    -- ('method name', (parm1, ...)) tuple
+        block   -- ignored; puts never block
+        timeout -- ignored; puts never block
+
+        """
+        method, parms = item
+        with self.condition:
+            counters = self.counters.get(method)
+            if counters is None:
+                counters = {'received': 0, 'conflated': 0, 'dropped': 0,
+                            'high_water': 0}
+                self.counters[method] = counters
+                self.depths[method] = 0
+            counters['received'] += 1
+            policy = self.policies.get(method, self.default_limit)
+            if method == 'stop':
+                policy = None
+            if policy == CONFLATE:
+                key = (method, parms[0], parms[1])
+                entry = self.pending.get(key)
+                if entry is not None:
+                    entry[1] = parms
+                    counters['conflated'] += 1
+                    return
+                entry = [method, parms, key]
+                self.pending[key] = entry
+            elif policy is not None and self.depths[method] >= policy:
+                counters['dropped'] += 1
+                return
+            else:
+                entry = (method, parms)
+            self.entries.append(entry)
+            depth = self.depths[method] + 1
+            self.depths[method] = depth
+            if depth > counters['high_water']:
+                counters['high_water'] = depth
+            if len(self.entries) > self.high_water:
+                self.high_water = len(self.entries)
+            self.condition.notify()
+
+    def stats(self):
+        """Return a dictionary with the current depth and high-water mark of
+        the queue along with per-method counters of received, conflated and
+        dropped messages, pending depth and high-water mark.
+
+        """
+        with self.condition:
+            methods = {}
+            for method, counters in self.counters.items():
+                methods[method] = dict(counters, depth=self.depths[method])
+            return {'depth': len(self.entries),
+                    'high_water': self.high_water,
+                    'methods': methods}
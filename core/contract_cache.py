@@ -0,0 +1,430 @@
+"""Persistent cache of contract details and a batch resolver that fills it.
+
+A ContractCache holds the Contract objects received via contract_details(),
+indexed by contract ID, by (symbol, sec_type, exchange, currency) and by
+local symbol, along with the results of each contract details request. It can
+be saved to and loaded from disk; entries older than the time-to-live are
+dropped.
+
+A ContractResolver resolves many request contracts at once. Requests for
+contracts already in the cache are answered from it, identical requests are
+sent only once (even across threads), and the remaining requests are
+pipelined: up to 'max_in_flight' requests are outstanding at a time, sent no
+faster than 'max_rate' per second to stay within the TWS message rate limit.
+
+"""
+from ibapipy.ibapipy_error import IBAPIPyError
+import os
+import pickle
+import threading
+import time
+
+
+# Methods whose messages may belong to a resolver request
+RESOLVER_METHODS = ('contract_details', 'contract_details_end', 'error')
+
+# Version of the cache file layout
+CACHE_FILE_VERSION = 1
+
+
+class ContractCache:
+    """Contract details indexed by contract ID, symbol and local symbol."""
+
+    def __init__(self, path=None, ttl=86400):
+        """Initialize a new instance of a ContractCache, loading it from path
+        if the file exists.
+
+        Keyword arguments:
+        path -- file the cache is saved to and loaded from; None to keep it
+                in memory only (default: None)
+        ttl  -- number of seconds an entry stays valid (default: 86400)
+
+        """
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.contracts = {}
+        self.symbols = {}
+        self.local_symbols = {}
+        self.queries = {}
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __contains__(self, con_id):
+        """Return True if the specified contract ID is in the cache."""
+        return self.get(con_id) is not None
+
+    def __len__(self):
+        """Return the number of contracts in the cache."""
+        return len(self.contracts)
+
+    def add(self, contract, timestamp=None):
+        """Add or replace a contract.
+
+        Keyword arguments:
+        contract  -- ibapipy.data.contract.Contract object
+        timestamp -- time the contract was received in seconds since the
+                     Epoch (default: current time)
+
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            self.remove(contract.con_id)
+            self.contracts[contract.con_id] = (timestamp, contract)
+            self.symbols.setdefault(symbol_key(contract), set()).add(
+                contract.con_id)
+            self.local_symbols.setdefault(contract.local_symbol.lower(),
+                                          set()).add(contract.con_id)
+
+    def add_query(self, contract, results, timestamp=None):
+        """Add the results of a contract details request.
+
+        Keyword arguments:
+        contract  -- Contract object the request was made for
+        results   -- list of Contract objects received
+        timestamp -- time the results were received in seconds since the
+                     Epoch (default: current time)
+
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            for result in results:
+                self.add(result, timestamp)
+            self.queries[query_key(contract)] = (
+                timestamp, [result.con_id for result in results])
+
+    def clear(self):
+        """Remove all entries."""
+        with self.lock:
+            self.contracts.clear()
+            self.symbols.clear()
+            self.local_symbols.clear()
+            self.queries.clear()
+
+    def expire(self, timestamp=None):
+        """Remove the entries that are older than the time-to-live.
+
+        Keyword arguments:
+        timestamp -- current time in seconds since the Epoch (default:
+                     current time)
+
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        oldest = timestamp - self.ttl
+        with self.lock:
+            for con_id, (saved, contract) in list(self.contracts.items()):
+                if saved < oldest:
+                    self.remove(con_id)
+            for key, (saved, con_ids) in list(self.queries.items()):
+                if saved < oldest:
+                    del self.queries[key]
+
+    def find(self, symbol, sec_type, exchange, currency):
+        """Return a list of the valid contracts with the specified symbol,
+        security type, exchange and currency.
+
+        """
+        key = (symbol.lower(), sec_type.lower(), exchange.lower(),
+               currency.lower())
+        with self.lock:
+            return self.get_all(self.symbols.get(key, ()))
+
+    def get(self, con_id):
+        """Return the valid contract with the specified contract ID or None
+        if there is none.
+
+        """
+        with self.lock:
+            entry = self.contracts.get(con_id)
+            if entry is None or entry[0] < time.time() - self.ttl:
+                return None
+            return entry[1]
+
+    def get_all(self, con_ids):
+        """Return a list of the valid contracts with the specified IDs."""
+        contracts = [self.get(con_id) for con_id in con_ids]
+        return [contract for contract in contracts if contract is not None]
+
+    def get_local_symbol(self, local_symbol):
+        """Return a list of the valid contracts with the specified local
+        symbol.
+
+        """
+        with self.lock:
+            return self.get_all(self.local_symbols.get(local_symbol.lower(),
+                                                       ()))
+
+    def load(self, path=None):
+        """Load the cache from disk, replacing its contents and dropping the
+        entries that have expired.
+
+        Keyword arguments:
+        path -- file to load from (default: the cache path)
+
+        """
+        path = self.path if path is None else path
+        with open(path, 'rb') as cache_file:
+            data = pickle.load(cache_file)
+        if data.get('version') != CACHE_FILE_VERSION:
+            raise IBAPIPyError('Unsupported contract cache file: {0}'.format(
+                path))
+        with self.lock:
+            self.clear()
+            for timestamp, contract in data['contracts']:
+                self.add(contract, timestamp)
+            self.queries.update(data['queries'])
+            self.expire()
+
+    def lookup(self, contract):
+        """Return the cached results of a contract details request for the
+        specified contract, or None if the request has not been cached or has
+        expired.
+
+        Keyword arguments:
+        contract -- Contract object the request would be made for
+
+        """
+        with self.lock:
+            entry = self.queries.get(query_key(contract))
+            if entry is None or entry[0] < time.time() - self.ttl:
+                return None
+            results = self.get_all(entry[1])
+            if len(results) < len(entry[1]):
+                return None
+            return results
+
+    def remove(self, con_id):
+        """Remove the contract with the specified ID, if any."""
+        with self.lock:
+            entry = self.contracts.pop(con_id, None)
+            if entry is None:
+                return
+            contract = entry[1]
+            self.symbols.get(symbol_key(contract), set()).discard(con_id)
+            self.local_symbols.get(contract.local_symbol.lower(),
+                                   set()).discard(con_id)
+
+    def save(self, path=None):
+        """Save the cache to disk. The file is replaced atomically.
+
+        Keyword arguments:
+        path -- file to save to (default: the cache path)
+
+        """
+        path = self.path if path is None else path
+        if path is None:
+            raise IBAPIPyError('No path to save the contract cache to.')
+        with self.lock:
+            data = {'version': CACHE_FILE_VERSION,
+                    'contracts': list(self.contracts.values()),
+                    'queries': dict(self.queries)}
+        temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as cache_file:
+            pickle.dump(data, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+
+class ContractResolver:
+    """Resolves batches of contracts through a cache and pipelined contract
+    details requests.
+
+    When passed to a ClientSocket, the contract_details(),
+    contract_details_end() and error() messages for the resolver's requests
+    are consumed by it rather than passed on to the client callbacks.
+
+    """
+
+    def __init__(self, cache=None, max_in_flight=20, max_rate=40,
+                 first_req_id=900000000):
+        """Initialize a new instance of a ContractResolver.
+
+        Keyword arguments:
+        cache         -- ContractCache to answer from and fill (default: a new
+                         in-memory cache)
+        max_in_flight -- maximum number of outstanding requests (default: 20)
+        max_rate      -- maximum number of requests sent per second
+                         (default: 40)
+        first_req_id  -- first request ID used; the resolver's IDs must not
+                         clash with those used by the application
+                         (default: 900000000)
+
+        """
+        self.cache = ContractCache() if cache is None else cache
+        self.max_in_flight = max_in_flight
+        self.max_rate = max_rate
+        self.next_req_id = first_req_id
+        self.next_send = 0.0
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.req_ids = {}
+        self.in_flight = 0
+
+    def apply(self, method, parms):
+        """Handle a message if it belongs to one of the resolver's requests
+        and return True if it did.
+
+        Keyword arguments:
+        method -- name of the callback method
+        parms  -- tuple of parameters for the method
+
+        """
+        with self.condition:
+            request = self.req_ids.get(parms[0])
+            if request is None:
+                return False
+            if method == 'contract_details':
+                request.results.append(parms[1])
+                return True
+            if method == 'error':
+                request.error = parms[2]
+            del self.req_ids[parms[0]]
+            del self.pending[request.key]
+            self.in_flight -= 1
+            request.done = True
+            if request.error is None:
+                self.cache.add_query(request.contract, request.results)
+            self.condition.notify_all()
+            return True
+
+    def resolve(self, client, contracts, timeout=None):
+        """Return a list with the list of matching Contract objects for each
+        of the specified request contracts. Contracts that TWS does not know
+        resolve to an empty list.
+
+        Keyword arguments:
+        client    -- connected ClientSocket that was created with this
+                     resolver
+        contracts -- sequence of Contract objects to resolve
+        timeout   -- maximum number of seconds to wait for all of the
+                     results; None to wait forever (default: None)
+
+        """
+        end = None if timeout is None else time.time() + timeout
+        results = {}
+        requests = []
+        new_requests = []
+        with self.condition:
+            for contract in contracts:
+                key = query_key(contract)
+                if key in results:
+                    continue
+                cached = self.cache.lookup(contract)
+                if cached is not None:
+                    results[key] = cached
+                    continue
+                request = self.pending.get(key)
+                if request is None:
+                    request = ContractRequest(key, contract)
+                    self.pending[key] = request
+                    new_requests.append(request)
+                results[key] = request
+                requests.append(request)
+        try:
+            for request in new_requests:
+                self.send(client, request, end)
+        except Exception:
+            # Release the requests that were never sent (timed out, or the
+            # client could not send them) so that other callers waiting on
+            # them do not wait forever
+            with self.condition:
+                for request in new_requests:
+                    if request.req_id is None:
+                        del self.pending[request.key]
+                        request.error = 'Not sent.'
+                        request.done = True
+                self.condition.notify_all()
+            raise
+        with self.condition:
+            for request in requests:
+                while not request.done:
+                    self.wait(end)
+                results[request.key] = request.results
+        if len(new_requests) > 0 and self.cache.path is not None:
+            self.cache.save()
+        return [results[query_key(contract)] for contract in contracts]
+
+    def send(self, client, request, end):
+        """Send a request once fewer than max_in_flight requests are
+        outstanding, respecting max_rate.
+
+        """
+        with self.condition:
+            while self.in_flight >= self.max_in_flight:
+                self.wait(end)
+            req_id = self.next_req_id
+            self.next_req_id += 1
+            request.req_id = req_id
+            self.req_ids[req_id] = request
+            self.in_flight += 1
+            delay = self.next_send - time.time()
+            self.next_send = max(self.next_send, time.time()) + \
+                1.0 / self.max_rate
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            client.req_contract_details(req_id, request.contract)
+        except Exception:
+            # Undo the bookkeeping so that the request is released by the
+            # caller and its slot is free for other requests
+            with self.condition:
+                del self.req_ids[req_id]
+                request.req_id = None
+                self.in_flight -= 1
+                self.condition.notify_all()
+            raise
+
+    def wait(self, end):
+        """Wait on the condition until notified or until the end time."""
+        if end is None:
+            self.condition.wait()
+            return
+        remaining = end - time.time()
+        if remaining <= 0:
+            raise IBAPIPyError('Timed out resolving contracts.')
+        self.condition.wait(remaining)
+
+
+class ContractRequest:
+    """State of a single contract details request made by a resolver."""
+
+    def __init__(self, key, contract):
+        """Initialize a new instance of a ContractRequest.
+
+        Keyword arguments:
+        key      -- query key of the request contract
+        contract -- Contract object the request is made for
+
+        """
+        self.key = key
+        self.contract = contract
+        self.req_id = None
+        self.results = []
+        self.error = None
+        self.done = False
+
+
+def query_key(contract):
+    """Return the key identifying a contract details request for the
+    specified contract: the contract fields sent with the request, with
+    strings in lower case.
+
+    """
+    return (contract.con_id, contract.symbol.lower(),
+            contract.sec_type.lower(), contract.expiry.lower(),
+            contract.strike, contract.right.lower(),
+            contract.multiplier.lower(), contract.exchange.lower(),
+            contract.currency.lower(), contract.local_symbol.lower(),
+            contract.include_expired, contract.sec_id_type.lower(),
+            contract.sec_id.lower())
+
+
+def symbol_key(contract):
+    """Return the (symbol, sec_type, exchange, currency) key of a contract
+    with strings in lower case.
+
+    """
+    return (contract.symbol.lower(), contract.sec_type.lower(),
+            contract.exchange.lower(), contract.currency.lower())
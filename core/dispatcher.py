@@ -0,0 +1,152 @@
+"""Dispatch client callbacks on a pool of worker threads.
+
+Messages are sharded across workers by key so that all messages for the same
+request, order or account are handled in arrival order by the same worker,
+while unrelated streams run in parallel. Order-related callbacks go to a
+separate set of priority workers so that, for example, a slow
+historical_data() handler never delays order_status(). So do the errors for
+the order IDs that the order callbacks have reported.
+
+Workers are threads rather than processes since callbacks run against the
+client object and its state.
+
+"""
+from queue import SimpleQueue
+from ibapipy.core.client_socket import dispatch
+import logging
+import threading
+
+
+# Callbacks handled by the priority workers
+ORDER_METHODS = frozenset(('commission_report', 'exec_details',
+                           'exec_details_end', 'next_valid_id', 'open_order',
+                           'open_order_end', 'order_status'))
+
+# Callbacks that share a single key so that account updates stay in order
+ACCOUNT_METHODS = frozenset(('account_download_end', 'update_account_time',
+                             'update_account_value', 'update_portfolio'))
+
+# Callbacks whose first parameter is a request ID
+REQUEST_METHODS = frozenset(('contract_details', 'contract_details_end',
+                             'error', 'historical_data',
+                             'historical_data_columns', 'real_time_bar',
+                             'tick_generic', 'tick_price', 'tick_size',
+                             'tick_snapshot_end', 'tick_string',
+                             'update_mkt_depth',
+                             'update_mkt_depth_l2', 'update_order_book',
+                             'update_quote'))
+
+# Order statuses after which TWS sends no further updates for an order
+DONE_STATUSES = frozenset(('ApiCancelled', 'Cancelled', 'Filled',
+                           'Inactive'))
+
+
+class Dispatcher:
+    """Pool of worker threads that call client methods."""
+
+    def __init__(self, workers=4, priority_workers=1):
+        """Initialize a new instance of a Dispatcher.
+
+        Keyword arguments:
+        workers          -- number of workers for general callbacks
+                            (default: 4)
+        priority_workers -- number of workers for order callbacks; with more
+                            than one, ordering is only preserved per order
+                            (default: 1)
+
+        """
+        self.client = None
+        self.queues = [SimpleQueue() for index in range(workers)]
+        self.priority_queues = [SimpleQueue()
+                                for index in range(priority_workers)]
+        self.threads = []
+        # IDs of the open orders reported by the order callbacks
+        self.order_ids = set()
+        # Order ID of each execution whose commission report is still to
+        # come, keyed by execution ID
+        self.exec_order_ids = {}
+        self.logger = logging.getLogger(__name__)
+
+    def start(self, client):
+        """Start the worker threads for the specified client.
+
+        Keyword arguments:
+        client -- client whose methods are called
+
+        """
+        if len(self.threads) > 0:
+            return
+        self.client = client
+        for queue in self.queues + self.priority_queues:
+            thread = threading.Thread(target=self.work, args=(queue,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """Let the workers finish the messages already submitted and wait for
+        them to exit.
+
+        """
+        for queue in self.queues + self.priority_queues:
+            queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def submit(self, method, parms):
+        """Hand off a message to the worker responsible for its key.
+
+        Keyword arguments:
+        method -- name of the client method to call
+        parms  -- tuple of parameters for the method
+
+        """
+        if method == 'order_status' and parms[1] in DONE_STATUSES:
+            self.order_ids.discard(parms[0])
+        elif method in ('open_order', 'order_status'):
+            self.order_ids.add(parms[0])
+        elif method == 'exec_details':
+            self.order_ids.add(parms[2].order_id)
+            if len(self.priority_queues) > 1:
+                self.exec_order_ids[parms[2].exec_id] = parms[2].order_id
+        if method in ORDER_METHODS or (method == 'error' and
+                                       parms[0] in self.order_ids):
+            queues = self.priority_queues
+            if len(queues) == 1:
+                queues[0].put((method, parms))
+                return
+            if method == 'exec_details':
+                key = parms[2].order_id
+            elif method == 'commission_report':
+                # Keep the report in order with the executions of its order
+                key = self.exec_order_ids.pop(parms[0].exec_id,
+                                              parms[0].exec_id)
+            elif len(parms) > 0:
+                key = parms[0]
+            else:
+                key = method
+        else:
+            queues = self.queues
+            if method in REQUEST_METHODS:
+                key = parms[0]
+            elif method in ACCOUNT_METHODS:
+                key = 'account'
+            else:
+                key = method
+        queues[hash(key) % len(queues)].put((method, parms))
+
+    def work(self, queue):
+        """Call client methods for the messages placed in the specified queue
+        until a None sentinel is received.
+
+        """
+        client = self.client
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            try:
+                dispatch(client, item[0], item[1])
+            except Exception:
+                self.logger.exception('Error in callback {0}'.format(item[0]))
@@ -0,0 +1,443 @@
+"""Scheduling of historical data requests within the TWS pacing rules.
+
+A HistoricalScheduler takes jobs made up of a contract, an end time, a
+duration and a bar size. Each job is split into chunks no longer than TWS
+allows for its bar size, and the chunks of all jobs are requested
+concurrently, interleaved across jobs, while respecting the pacing rules:
+
+* no identical request within 15 seconds;
+* no more than 5 requests for the same contract and data type within
+  2 seconds;
+* no more than 60 requests within 10 minutes; and
+* no more than 50 requests outstanding at a time.
+
+Chunks that fail with a pacing violation are retried after a pause. The bars
+of each job are reassembled in time order, with the overlaps between chunks
+removed, once the historical_data() sentinel (or the historical_data_columns()
+message) of every chunk has been received.
+
+"""
+from collections import deque
+from ibapipy.core.contract_cache import query_key
+from ibapipy.ibapipy_error import IBAPIPyError
+import math
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Methods whose messages may belong to a scheduler request
+SCHEDULER_METHODS = ('error', 'historical_data', 'historical_data_columns')
+
+# Longest duration in seconds that can be requested for each bar size
+CHUNK_SECONDS = {'1 secs': 1800,
+                 '5 secs': 3600,
+                 '10 secs': 14400,
+                 '15 secs': 14400,
+                 '30 secs': 28800,
+                 '1 min': 86400,
+                 '2 mins': 172800,
+                 '3 mins': 604800,
+                 '5 mins': 604800,
+                 '15 mins': 604800,
+                 '30 mins': 2592000,
+                 '1 hour': 2592000,
+                 '1 day': 31536000}
+
+# Number of seconds in each unit of a duration string
+DURATION_UNITS = (('Y', 31536000), ('M', 2592000), ('W', 604800),
+                  ('D', 86400), ('S', 1))
+
+# Error code for pacing violations and historical data service errors
+HISTORICAL_DATA_ERROR = 162
+
+
+class HistoricalJob:
+    """A historical data request that may span several chunks.
+
+    Attributes set by the scheduler:
+    bars  -- list of (date, open, high, low, close, volume, bar_count, wap,
+             has_gaps) tuples, or a structured NumPy array if the client was
+             created with historical_columns=True
+    error -- error message if the job failed; None, otherwise
+    done  -- True once the job has completed or failed
+
+    """
+
+    def __init__(self, contract, end, duration, bar_size,
+                 what_to_show='TRADES', use_rth=1, format_date=1):
+        """Initialize a new instance of a HistoricalJob.
+
+        Keyword arguments:
+        contract     -- ibapipy.data.contract.Contract object
+        end          -- end of the period in milliseconds since the Epoch
+        duration     -- length of the period as a TWS duration string
+                        ('3600 S', '5 D', '2 W', '1 M', '1 Y')
+        bar_size     -- bar size setting (a key of CHUNK_SECONDS)
+        what_to_show -- type of data (default: 'TRADES')
+        use_rth      -- 1 for regular trading hours only; 0, otherwise
+                        (default: 1)
+        format_date  -- format of the bar dates (default: 1)
+
+        """
+        if bar_size not in CHUNK_SECONDS:
+            raise IBAPIPyError('Unsupported bar size: {0}'.format(bar_size))
+        self.contract = contract
+        self.end = end
+        self.duration = duration
+        self.bar_size = bar_size
+        self.what_to_show = what_to_show
+        self.use_rth = use_rth
+        self.format_date = format_date
+        self.chunks = split(self)
+        self.bars = None
+        self.error = None
+        self.done = False
+
+    def assemble(self):
+        """Combine the bars of the chunks in time order, dropping the bars
+        that appear in more than one chunk.
+
+        """
+        parts = [chunk.bars for chunk in reversed(self.chunks)
+                 if chunk.bars is not None]
+        if np is not None and any(isinstance(part, np.ndarray)
+                                  for part in parts):
+            bars = np.concatenate([part for part in parts
+                                   if isinstance(part, np.ndarray)])
+            dates, index = np.unique(bars['date'], return_index=True)
+            self.bars = bars[np.sort(index)]
+            return
+        seen = set()
+        self.bars = []
+        for part in parts:
+            for bar in part:
+                if bar[0] not in seen:
+                    seen.add(bar[0])
+                    self.bars.append(bar)
+
+
+class HistoricalChunk:
+    """A single historical data request making up part of a job."""
+
+    def __init__(self, job, end, duration):
+        """Initialize a new instance of a HistoricalChunk.
+
+        Keyword arguments:
+        job      -- HistoricalJob the chunk belongs to
+        end      -- end of the chunk in milliseconds since the Epoch
+        duration -- TWS duration string of the chunk
+
+        """
+        self.job = job
+        self.end_date_time = time.strftime(
+            '%Y%m%d %H:%M:%S GMT', time.gmtime(end / 1000.0))
+        self.duration = duration
+        self.key = (query_key(job.contract), self.end_date_time, duration,
+                    job.bar_size, job.what_to_show, job.use_rth)
+        self.burst_key = (query_key(job.contract), job.what_to_show)
+        self.req_id = None
+        self.retries = 0
+        self.bars = None
+
+
+class Pacer:
+    """Tracks the requests sent to enforce the pacing rules."""
+
+    def __init__(self, window_requests=60, window_seconds=600,
+                 identical_seconds=15, burst_requests=5, burst_seconds=2):
+        """Initialize a new instance of a Pacer.
+
+        Keyword arguments:
+        window_requests   -- maximum number of requests per window
+                             (default: 60)
+        window_seconds    -- length of the window in seconds (default: 600)
+        identical_seconds -- minimum number of seconds between identical
+                             requests (default: 15)
+        burst_requests    -- maximum number of requests for the same
+                             contract and data type per burst (default: 5)
+        burst_seconds     -- length of a burst in seconds (default: 2)
+
+        """
+        self.window_requests = window_requests
+        self.window_seconds = window_seconds
+        self.identical_seconds = identical_seconds
+        self.burst_requests = burst_requests
+        self.burst_seconds = burst_seconds
+        self.sent = deque()
+        self.identical = {}
+        self.bursts = {}
+
+    def delay(self, chunk, now):
+        """Return the number of seconds to wait before the specified chunk
+        may be requested.
+
+        """
+        wait = 0.0
+        if len(self.sent) >= self.window_requests:
+            wait = self.sent[-self.window_requests] + self.window_seconds - \
+                now
+        last = self.identical.get(chunk.key)
+        if last is not None:
+            wait = max(wait, last + self.identical_seconds - now)
+        times = self.bursts.get(chunk.burst_key)
+        if times is not None and len(times) >= self.burst_requests:
+            wait = max(wait, times[-self.burst_requests] +
+                       self.burst_seconds - now)
+        return wait
+
+    def record(self, chunk, now):
+        """Record that the specified chunk was requested."""
+        self.sent.append(now)
+        while self.sent[0] <= now - self.window_seconds:
+            self.sent.popleft()
+        self.identical[chunk.key] = now
+        times = self.bursts.setdefault(chunk.burst_key, deque())
+        times.append(now)
+        while times[0] <= now - self.burst_seconds:
+            times.popleft()
+        oldest = now - self.identical_seconds
+        if len(self.identical) > 4 * self.window_requests:
+            for key, sent in list(self.identical.items()):
+                if sent <= oldest:
+                    del self.identical[key]
+
+
+class HistoricalScheduler:
+    """Runs historical data jobs within the pacing rules.
+
+    When passed to a ClientSocket, the historical_data(),
+    historical_data_columns() and error() messages for the scheduler's
+    requests are consumed by it rather than passed on to the client
+    callbacks.
+
+    """
+
+    def __init__(self, max_in_flight=50, pacer=None, retry_delay=60,
+                 max_retries=5, first_req_id=800000000):
+        """Initialize a new instance of a HistoricalScheduler.
+
+        Keyword arguments:
+        max_in_flight -- maximum number of outstanding requests (default: 50)
+        pacer         -- Pacer enforcing the pacing rules (default: Pacer())
+        retry_delay   -- seconds to pause all requests after a pacing
+                         violation (default: 60)
+        max_retries   -- number of times a chunk is retried before its job
+                         fails (default: 5)
+        first_req_id  -- first request ID used; the scheduler's IDs must not
+                         clash with those used by the application
+                         (default: 800000000)
+
+        """
+        self.max_in_flight = max_in_flight
+        self.pacer = Pacer() if pacer is None else pacer
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self.next_req_id = first_req_id
+        self.condition = threading.Condition()
+        self.queue = []
+        self.req_ids = {}
+        self.paused_until = 0.0
+        self.callback = None
+
+    def apply(self, method, parms):
+        """Handle a message if it belongs to one of the scheduler's requests
+        and return True if it did.
+
+        Keyword arguments:
+        method -- name of the callback method
+        parms  -- tuple of parameters for the method
+
+        """
+        with self.condition:
+            chunk = self.req_ids.get(parms[0])
+            if chunk is None:
+                return False
+            if method == 'historical_data':
+                if not parms[1].startswith('finished'):
+                    chunk.bars.append(parms[1:])
+                    return True
+            elif method == 'historical_data_columns':
+                chunk.bars = parms[3]
+            elif method == 'error':
+                self.fail(chunk, parms[1], parms[2])
+                return True
+            del self.req_ids[chunk.req_id]
+            self.finish(chunk)
+            return True
+
+    def fail(self, chunk, code, message):
+        """Handle an error for the specified chunk: retry it after a pacing
+        violation, treat it as empty if there is no data for its period and
+        fail its job otherwise.
+
+        """
+        del self.req_ids[chunk.req_id]
+        job = chunk.job
+        message = message.lower()
+        if job.done:
+            return
+        if code == HISTORICAL_DATA_ERROR and 'pacing' in message and \
+                chunk.retries < self.max_retries:
+            chunk.retries += 1
+            chunk.req_id = None
+            chunk.bars = None
+            self.paused_until = time.time() + self.retry_delay
+            self.queue.insert(0, chunk)
+        elif code == HISTORICAL_DATA_ERROR and 'no data' in message:
+            chunk.bars = []
+            self.finish(chunk)
+        else:
+            job.error = message
+            self.queue = [item for item in self.queue if item.job is not job]
+            self.complete(job)
+        self.condition.notify_all()
+
+    def finish(self, chunk):
+        """Complete the job of the specified chunk once every chunk of it has
+        been received.
+
+        """
+        job = chunk.job
+        if not job.done and all(item.bars is not None and
+                                item.req_id not in self.req_ids
+                                for item in job.chunks):
+            job.assemble()
+            self.complete(job)
+        self.condition.notify_all()
+
+    def complete(self, job):
+        """Mark a job as done and report it to the callback."""
+        job.done = True
+        if self.callback is not None:
+            self.callback(job)
+
+    def run(self, client, jobs, callback=None, timeout=None):
+        """Request the data for the specified jobs and return them once all
+        of them have completed or failed.
+
+        Keyword arguments:
+        client   -- connected ClientSocket that was created with this
+                    scheduler
+        jobs     -- sequence of HistoricalJob objects
+        callback -- function called with each job as it completes, from the
+                    client's listener thread (default: None)
+        timeout  -- maximum number of seconds to wait for all of the jobs;
+                    None to wait forever (default: None)
+
+        """
+        end = None if timeout is None else time.time() + timeout
+        with self.condition:
+            self.callback = callback
+            for job in jobs:
+                job.done = False
+            self.queue.extend(interleave(jobs))
+        try:
+            while True:
+                with self.condition:
+                    if all(job.done for job in jobs):
+                        return jobs
+                    chunk, wait = self.next_chunk()
+                    if chunk is None:
+                        if end is not None:
+                            remaining = end - time.time()
+                            if remaining <= 0:
+                                raise IBAPIPyError(
+                                    'Timed out requesting historical data.')
+                            wait = remaining if wait is None else \
+                                min(wait, remaining)
+                        self.condition.wait(wait)
+                        continue
+                    chunk.req_id = self.next_req_id
+                    chunk.bars = []
+                    self.next_req_id += 1
+                    self.req_ids[chunk.req_id] = chunk
+                    self.pacer.record(chunk, time.time())
+                job = chunk.job
+                client.req_historical_data(
+                    chunk.req_id, job.contract, chunk.end_date_time,
+                    chunk.duration, job.bar_size, job.what_to_show,
+                    job.use_rth, job.format_date)
+        finally:
+            with self.condition:
+                self.callback = None
+
+    def next_chunk(self):
+        """Remove and return the first queued chunk that may be requested
+        now, along with None; or None along with the number of seconds until
+        one may be requested (None if it depends on outstanding requests).
+
+        """
+        if len(self.queue) == 0 or len(self.req_ids) >= self.max_in_flight:
+            return None, None
+        now = time.time()
+        if self.paused_until > now:
+            return None, self.paused_until - now
+        shortest = None
+        for index, chunk in enumerate(self.queue):
+            wait = self.pacer.delay(chunk, now)
+            if wait <= 0:
+                del self.queue[index]
+                return chunk, None
+            shortest = wait if shortest is None else min(shortest, wait)
+        return None, shortest
+
+
+def duration_seconds(duration):
+    """Return the number of seconds in a TWS duration string, which must be
+    positive: a job without chunks would never complete.
+
+    """
+    try:
+        count, unit = duration.split()
+        seconds = int(count) * dict(DURATION_UNITS)[unit.upper()]
+    except (KeyError, ValueError):
+        seconds = 0
+    if seconds <= 0:
+        raise IBAPIPyError('Unsupported duration: {0}'.format(duration))
+    return seconds
+
+
+def duration_string(seconds):
+    """Return the TWS duration string for a number of seconds, using the
+    largest unit that divides it. Periods of more than a day that are not a
+    whole number of days are rounded up to days.
+
+    """
+    for unit, unit_seconds in DURATION_UNITS:
+        if seconds % unit_seconds == 0 and (unit_seconds > 1 or
+                                            seconds <= 86400):
+            return '{0} {1}'.format(seconds // unit_seconds, unit)
+    return '{0} D'.format(int(math.ceil(seconds / 86400.0)))
+
+
+def interleave(jobs):
+    """Return the chunks of the jobs, newest first, taking one chunk from
+    each job in turn.
+
+    """
+    chunks = []
+    longest = max([len(job.chunks) for job in jobs] + [0])
+    for index in range(longest):
+        for job in jobs:
+            if index < len(job.chunks):
+                chunks.append(job.chunks[index])
+    return chunks
+
+
+def split(job):
+    """Return the chunks making up a job, newest first."""
+    total = duration_seconds(job.duration)
+    size = CHUNK_SECONDS[job.bar_size]
+    chunks = []
+    offset = 0
+    while offset < total:
+        length = min(size, total - offset)
+        chunks.append(HistoricalChunk(job, job.end - offset * 1000,
+                                      duration_string(length)))
+        offset += length
+    return chunks
@@ -0,0 +1,430 @@
+"""Measures where time goes on the way from the socket to the callbacks.
+
+When a ClientSocket is created with an Instrumentation object, every message
+is stamped at each stage of the hot path:
+
+* received: the incoming listener process read the data from the socket.
+* taken: the reader process took the chunk of fields off socket_in_queue.
+* decoded: the reader process finished decoding the message and put it on
+  message_queue.
+* dequeued: the listener thread took the message off message_queue.
+* dispatched: the callback (or the hand-off to the dispatcher) returned.
+
+The stamps are CLOCK_MONOTONIC nanoseconds, which are comparable between the
+processes. The differences are recorded per message type in the following
+stages, each a LatencyHistogram:
+
+* socket_in_queue: received to taken.
+* decode: taken, or the end of the previous message, to decoded.
+* message_queue: decoded to dequeued.
+* dispatch: dequeued to dispatched.
+* total: received to dispatched.
+
+Messages that pass through a ConflatingQueue lose their stamps, so only the
+dispatch stage is recorded for them.
+
+A sampler thread also records the depths of socket_in_queue,
+socket_out_queue and message_queue (and of the conflating queue, if any)
+every 'sample_interval' seconds, and can log a summary of everything every
+'dump_interval' seconds. All of it is available through stats().
+
+Histograms are only written by a single thread (the listener thread), so
+recording takes no locks; readers may see a count that is one message ahead
+of the sum.
+
+"""
+from array import array
+import logging
+import threading
+import time
+
+
+# Stages recorded for each message type
+STAGES = ('socket_in_queue', 'decode', 'message_queue', 'dispatch', 'total')
+
+# Percentiles included in stats()
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+class LatencyHistogram:
+    """Log-linear histogram of non-negative integers.
+
+    Values below 2 ** precision are counted exactly; above that every power
+    of two is split into 2 ** (precision - 1) buckets, so recorded values are
+    within 1 / 2 ** (precision - 1) of their true value. Values above
+    2 ** max_bits - 1 are counted in the last bucket.
+
+    """
+
+    def __init__(self, precision=6, max_bits=40):
+        """Initialize a new instance of a LatencyHistogram.
+
+        Keyword arguments:
+        precision -- number of significant bits kept per value (default: 6)
+        max_bits  -- number of bits of the largest value tracked exactly;
+                     40 bits of nanoseconds is about 18 minutes (default: 40)
+
+        """
+        self.precision = precision
+        self.max_bits = max_bits
+        self.counts = array('q', [0]) * bucket_index(
+            (1 << max_bits) - 1, precision) + array('q', [0])
+        self.count = 0
+        self.sum = 0
+        self.min = 0
+        self.max = 0
+
+    def merge(self, other):
+        """Add the counts of another histogram with the same layout."""
+        if other.count == 0:
+            return
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count > 0:
+                counts[index] += count
+        if self.count == 0 or other.min < self.min:
+            self.min = other.min
+        if other.max > self.max:
+            self.max = other.max
+        self.count += other.count
+        self.sum += other.sum
+
+    def percentile(self, percent):
+        """Return the highest value equivalent to the specified percentile of
+        the recorded values, or 0 if none have been recorded.
+
+        Keyword arguments:
+        percent -- percentile between 0 and 100
+
+        """
+        if self.count == 0:
+            return 0
+        target = max(1, int(round(self.count * percent / 100.0)))
+        last = len(self.counts) - 1
+        total = 0
+        for index, count in enumerate(self.counts):
+            total += count
+            if total >= target and index < last:
+                return min(bucket_limit(index, self.precision), self.max)
+        # The last bucket also holds every value out of range
+        return self.max
+
+    def record(self, value):
+        """Count a single value.
+
+        Keyword arguments:
+        value -- non-negative integer, typically nanoseconds
+
+        """
+        if value < 0:
+            value = 0
+        index = bucket_index(value, self.precision)
+        counts = self.counts
+        if index >= len(counts):
+            index = len(counts) - 1
+        counts[index] += 1
+        if self.count == 0 or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.sum += value
+
+    def reset(self):
+        """Forget every recorded value."""
+        counts = self.counts
+        for index in range(len(counts)):
+            counts[index] = 0
+        self.count = 0
+        self.sum = 0
+        self.min = 0
+        self.max = 0
+
+    def summary(self):
+        """Return a dictionary with the count, min, mean, max and percentiles
+        of the recorded values.
+
+        """
+        result = {'count': self.count, 'min': self.min, 'max': self.max,
+                  'mean': self.sum / self.count if self.count > 0 else 0.0}
+        for percent in PERCENTILES:
+            result['p{0:g}'.format(percent)] = self.percentile(percent)
+        return result
+
+
+class Instrumentation:
+    """Per-stage latency histograms and queue-depth gauges of a client."""
+
+    def __init__(self, sample_interval=1.0, dump_interval=None,
+                 precision=6):
+        """Initialize a new instance of an Instrumentation.
+
+        Keyword arguments:
+        sample_interval -- seconds between two samples of the queue depths
+                           (default: 1.0)
+        dump_interval   -- seconds between two summaries logged at INFO
+                           level; None to never log them (default: None)
+        precision       -- significant bits kept per latency (default: 6)
+
+        """
+        self.sample_interval = sample_interval
+        self.dump_interval = dump_interval
+        self.precision = precision
+        # (stage, method) to LatencyHistogram
+        self.histograms = {}
+        # Queue name to [last, max, total, samples]
+        self.gauges = {}
+        self.queues = {}
+        self.current = None
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.logger = logging.getLogger(__name__)
+
+    def begin(self, item):
+        """Note that a message was taken off the message queue.
+
+        Keyword arguments:
+        item -- ('method name', (parm1, ...)) tuple, optionally carrying
+                the stamps of the earlier stages
+
+        """
+        self.current = (item[0], getattr(item, 'stamps', None),
+                        time.monotonic_ns())
+
+    def dump(self):
+        """Log a summary of the current statistics."""
+        self.logger.info(format_stats(self.stats()))
+
+    def end(self):
+        """Record the stages of the message passed to begin(), if any, now
+        that it has been handled.
+
+        """
+        if self.current is None:
+            return
+        method, stamps, dequeued = self.current
+        self.current = None
+        dispatched = time.monotonic_ns()
+        self.record('dispatch', method, dispatched - dequeued)
+        if stamps is not None:
+            received, taken, decoded = stamps
+            self.record('socket_in_queue', method, taken - received)
+            self.record('decode', method, decoded - taken)
+            self.record('message_queue', method, dequeued - decoded)
+            self.record('total', method, dispatched - received)
+
+    def histogram(self, stage, method):
+        """Return the histogram of a stage and message type, creating it if
+        needed.
+
+        """
+        key = (stage, method)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = LatencyHistogram(self.precision)
+            self.histograms[key] = histogram
+        return histogram
+
+    def record(self, stage, method, nanoseconds):
+        """Record the latency of a message in a stage.
+
+        Keyword arguments:
+        stage       -- one of STAGES
+        method      -- name of the callback method of the message
+        nanoseconds -- time spent in the stage
+
+        """
+        self.histogram(stage, method).record(nanoseconds)
+
+    def reset(self):
+        """Forget every recorded latency and queue depth."""
+        for histogram in list(self.histograms.values()):
+            histogram.reset()
+        self.gauges.clear()
+
+    def run(self):
+        """Sample the queue depths and dump summaries until stopped."""
+        next_dump = None
+        if self.dump_interval is not None:
+            next_dump = time.monotonic() + self.dump_interval
+        with self.condition:
+            while self.running:
+                self.sample()
+                if next_dump is not None and time.monotonic() >= next_dump:
+                    self.dump()
+                    next_dump += self.dump_interval
+                self.condition.wait(self.sample_interval)
+
+    def sample(self):
+        """Record the current depth of every attached queue."""
+        for name, queue in list(self.queues.items()):
+            try:
+                depth = queue.qsize() if hasattr(queue, 'qsize') \
+                    else len(queue)
+            except (NotImplementedError, OSError):
+                # qsize() is not available on every platform, and fails
+                # once the queue has been closed
+                continue
+            gauge = self.gauges.get(name)
+            if gauge is None:
+                self.gauges[name] = [depth, depth, depth, 1]
+            else:
+                gauge[0] = depth
+                gauge[1] = max(gauge[1], depth)
+                gauge[2] += depth
+                gauge[3] += 1
+
+    def start(self, queues):
+        """Start sampling the specified queues.
+
+        Keyword arguments:
+        queues -- dictionary of name to queue
+
+        """
+        self.queues = dict(queues)
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stats(self):
+        """Return a dictionary with a summary (see LatencyHistogram.summary())
+        per stage and message type under 'stages', and the last, max and
+        mean sampled depth per queue under 'queues'.
+
+        """
+        stages = {}
+        for (stage, method), histogram in list(self.histograms.items()):
+            stages.setdefault(stage, {})[method] = histogram.summary()
+        queues = {}
+        for name, gauge in list(self.gauges.items()):
+            last, high, total, samples = gauge
+            queues[name] = {'depth': last, 'max': high,
+                            'mean': total / samples}
+        return {'stages': stages, 'queues': queues}
+
+    def stop(self):
+        """Stop sampling and wait for the sampler thread to exit."""
+        if self.thread is None:
+            return
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+        self.thread = None
+
+
+class StampedMessage(tuple):
+    """('method name', (parm1, ...)) tuple carrying the (received, taken,
+    decoded) stamps of a message in its stamps attribute.
+
+    """
+    pass
+
+
+class StampingQueue:
+    """Wraps the message queue of the reader process, stamping each message
+    put on it with the stamps of the chunk it was decoded from.
+
+    """
+
+    def __init__(self, message_queue, field_buffer):
+        """Initialize a new instance of a StampingQueue.
+
+        Keyword arguments:
+        message_queue -- queue that stamped messages are put on
+        field_buffer  -- ibapipy.core.reader.TimedFieldBuffer the messages
+                         are decoded from
+
+        """
+        self.message_queue = message_queue
+        self.field_buffer = field_buffer
+        self.decoded = 0
+
+    def put(self, item, block=True, timeout=None):
+        """Stamp and put the specified message.
+
+        Keyword arguments:
+        item    -- ('method name', (parm1, ...)) tuple
+        block   -- passed on to the message queue
+        timeout -- passed on to the message queue
+
+        """
+        field_buffer = self.field_buffer
+        decoded = time.monotonic_ns()
+        # Decoding started when the chunk was taken or when the previous
+        # message was done, whichever came last
+        taken = max(field_buffer.taken, self.decoded)
+        message = StampedMessage(item)
+        message.stamps = (field_buffer.received, taken, decoded)
+        self.decoded = decoded
+        self.message_queue.put(message, block, timeout)
+
+
+class TimedFields(list):
+    """List of fields carrying the time they were read from the socket in
+    its received attribute.
+
+    """
+    pass
+
+
+def bucket_index(value, precision):
+    """Return the index of the histogram bucket holding the specified value.
+
+    Keyword arguments:
+    value     -- non-negative integer
+    precision -- number of significant bits kept per value
+
+    """
+    sub_buckets = 1 << precision
+    if value < sub_buckets:
+        return value
+    shift = value.bit_length() - precision
+    half = sub_buckets >> 1
+    return sub_buckets + (shift - 1) * half + (value >> shift) - half
+
+
+def bucket_limit(index, precision):
+    """Return the highest value counted in the specified bucket.
+
+    Keyword arguments:
+    index     -- bucket index
+    precision -- number of significant bits kept per value
+
+    """
+    sub_buckets = 1 << precision
+    if index < sub_buckets:
+        return index
+    half = sub_buckets >> 1
+    shift, offset = divmod(index - sub_buckets, half)
+    shift += 1
+    return ((half + offset + 1) << shift) - 1
+
+
+def format_stats(stats):
+    """Return the result of Instrumentation.stats() as a table with one line
+    per queue and per stage and message type, latencies in microseconds.
+
+    Keyword arguments:
+    stats -- dictionary returned by Instrumentation.stats()
+
+    """
+    lines = []
+    for name, gauge in sorted(stats['queues'].items()):
+        lines.append('{0:<24} depth {1:>8} max {2:>8} mean {3:>10.1f}'.format(
+            name, gauge['depth'], gauge['max'], gauge['mean']))
+    header = '{0:<16}{1:<28}{2:>10}{3:>10}{4:>10}{5:>10}{6:>10}'
+    lines.append(header.format('stage', 'method', 'count', 'p50 us',
+                               'p99 us', 'p99.9 us', 'max us'))
+    row = '{0:<16}{1:<28}{2:>10}{3:>10.1f}{4:>10.1f}{5:>10.1f}{6:>10.1f}'
+    for stage in STAGES:
+        for method, summary in sorted(stats['stages'].get(stage, {}).items()):
+            lines.append(row.format(stage, method, summary['count'],
+                                    summary['p50'] / 1000.0,
+                                    summary['p99'] / 1000.0,
+                                    summary['p99.9'] / 1000.0,
+                                    summary['max'] / 1000.0))
+    return '\n'.join(lines)
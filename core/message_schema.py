@@ -0,0 +1,281 @@
+"""Declarative layouts of incoming messages and the decoders compiled from
+them.
+
+A MessageSchema lists the fields of a message in wire order along with their
+types. compile() turns it into a plain Python function with the same
+signature as the hand-written handlers in the reader module. The generated
+function pulls all of the message's fields in one take() from the field
+buffer, converts them with inline expressions and emits the result, so no
+per-field function calls are made.
+
+Field targets are either:
+
+* None, for fields that are read and discarded;
+* a plain name such as 'req_id', which becomes a local variable that can be
+  listed in the message arguments; or
+* a dotted name such as 'contract.symbol', which is assigned to an attribute
+  of one of the schema's objects.
+
+compile_group() compiles a run of fields on its own, for hand-written
+handlers of messages whose layout depends on the values read (open_order,
+historical_data, ...).
+
+compile(lazy=True) creates the lazy variants of the objects instead (see
+ibapipy.data.lazy_object), which keep the list of raw fields and only
+convert the fields of the attributes that are accessed.
+
+compile_skip() and MessageSchema.compile_skip() produce the counterparts of
+the decoders for messages nobody is listening to: they move the field buffer
+past the message without converting any field or emitting anything.
+
+"""
+from ibapipy.data.lazy_object import register_layout
+from ibapipy.ibapipy_error import IBAPIPyError
+import ibapipy.config as config
+
+
+# Error message for versions.
+VERSION_ERROR = 'Version is {0:d} (min {1:d} needed)'
+
+# Field types. The *_MAX variants default to the Java maximum value rather
+# than zero when the field is empty.
+BOOL = 'bool'
+FLOAT = 'float'
+FLOAT_MAX = 'float_max'
+INT = 'int'
+INT_MAX = 'int_max'
+STR = 'str'
+
+# Conversion expression for each field type; {0} is the raw field
+EXPRESSIONS = {BOOL: '(int({0}) != 0 if {0} else False)',
+               FLOAT: '(float({0}) if {0} else 0)',
+               FLOAT_MAX: '(float({0}) if {0} else JAVA_DOUBLE_MAX)',
+               INT: '(int({0}) if {0} else 0)',
+               INT_MAX: '(int({0}) if {0} else JAVA_INT_MAX)',
+               STR: '{0}.lower()'}
+
+
+class MessageSchema:
+    """Describes the layout of an incoming message and the callback it is
+    translated into.
+
+    """
+
+    def __init__(self, method, fields, args=(), min_version=0, objects=(),
+                 finish=None, skip_finish=None):
+        """Initialize a new instance of a MessageSchema.
+
+        Keyword arguments:
+        method      -- name of the callback method the message is translated
+                       into
+        fields      -- sequence of (target, type) tuples in wire order
+        args        -- names of the locals and objects passed to the
+                       callback, in order (default: ())
+        min_version -- minimum supported message version; if non-zero, a
+                       field named 'version' must be present (default: 0)
+        objects     -- sequence of (name, class) or (name, class, lazy class)
+                       tuples for the objects that dotted targets are
+                       assigned to (default: ())
+        finish      -- function called as finish(in_queue, *args) after the
+                       fields have been decoded; used to read any variable
+                       length tail of the message (default: None)
+        skip_finish -- function called as skip_finish(in_queue) when the
+                       message is skipped; required if 'finish' reads any
+                       fields (default: None)
+
+        """
+        self.method = method
+        self.fields = tuple(fields)
+        self.args = tuple(args)
+        self.min_version = min_version
+        self.objects = tuple(objects)
+        self.finish = finish
+        self.skip_finish = skip_finish
+
+    def __len__(self):
+        """Return the number of fields in the fixed part of the message."""
+        return len(self.fields)
+
+    def compile(self, lazy=False):
+        """Return a function decode(in_queue, out_queue) that decodes this
+        message.
+
+        Keyword arguments:
+        lazy -- True to create the lazy class of each object that has one,
+                registering its layout as '<method>.<object name>'
+                (default: False)
+
+        """
+        lazy_classes = {}
+        if lazy:
+            lazy_classes = dict((item[0], item[2]) for item in self.objects
+                                if len(item) > 2)
+        lines = ['def decode(in_queue, out_queue):']
+        if len(lazy_classes) > 0:
+            lines.append('    fields = in_queue.take({0})'.format(
+                len(self.fields)))
+            lines.extend(unpack_lines(len(self.fields), 'fields'))
+        else:
+            lines.extend(unpack_lines(len(self.fields)))
+        if self.min_version > 0:
+            index = [target for target, kind in self.fields].index('version')
+            lines.append('    version = {0}'.format(
+                EXPRESSIONS[self.fields[index][1]].format('f{0}'.format(
+                    index))))
+            lines.append('    if version < {0}:'.format(self.min_version))
+            lines.append('        raise IBAPIPyError(VERSION_ERROR.format('
+                         'version, {0}))'.format(self.min_version))
+        namespace = {}
+        skip = ['version']
+        for item in self.objects:
+            name = item[0]
+            if name in lazy_classes:
+                layout = '{0}.{1}'.format(self.method, name)
+                register_layout(layout, lazy_layout(self.fields, name))
+                namespace['class_' + name] = lazy_classes[name]
+                lines.append('    {0} = class_{0}({1!r}, fields)'.format(
+                    name, layout))
+                skip.extend(target for target, kind in self.fields
+                            if target is not None and
+                            target.startswith(name + '.'))
+            else:
+                namespace['class_' + name] = item[1]
+                lines.append('    {0} = class_{0}()'.format(name))
+        lines.extend(assignment_lines(self.fields, skip=skip))
+        args = ''.join('{0}, '.format(arg) for arg in self.args)
+        if self.finish is not None:
+            namespace['finish'] = self.finish
+            lines.append('    finish(in_queue, {0})'.format(args))
+        lines.append('    out_queue.put(({0!r}, ({1})), block=False)'.format(
+            self.method, args))
+        function = build('\n'.join(lines), namespace, 'decode')
+        function.__name__ = self.method
+        return function
+
+    def compile_skip(self):
+        """Return a function skip(in_queue, out_queue) that reads past this
+        message without decoding it.
+
+        """
+        return compile_skip(self.method, len(self.fields), self.skip_finish)
+
+
+def assignment_lines(fields, skip=()):
+    """Return the lines of code that convert and assign each field.
+
+    Keyword arguments:
+    fields -- sequence of (target, type) tuples
+    skip   -- targets not to assign (default: ())
+
+    """
+    lines = []
+    for index, (target, kind) in enumerate(fields):
+        if target is None or target in skip:
+            continue
+        expression = EXPRESSIONS[kind].format('f{0}'.format(index))
+        lines.append('    {0} = {1}'.format(target, expression))
+    return lines
+
+
+def build(source, namespace, name):
+    """Execute the generated source and return the function it defines."""
+    namespace.update({'IBAPIPyError': IBAPIPyError,
+                      'JAVA_DOUBLE_MAX': config.JAVA_DOUBLE_MAX,
+                      'JAVA_INT_MAX': config.JAVA_INT_MAX,
+                      'VERSION_ERROR': VERSION_ERROR})
+    exec(compile(source, '<{0}>'.format(name), 'exec'), namespace)
+    function = namespace[name]
+    function.source = source
+    return function
+
+
+def compile_group(fields, objects=()):
+    """Compile a run of fields into a function read(in_queue, *objects).
+
+    The function reads and converts the fields, assigns dotted targets to the
+    objects passed in and returns a tuple of the values of the plain targets
+    in order.
+
+    Keyword arguments:
+    fields  -- sequence of (target, type) tuples in wire order
+    objects -- names of the objects that dotted targets refer to, in the
+               order they are passed to the function (default: ())
+
+    """
+    parms = ''.join(', {0}'.format(name) for name in objects)
+    lines = ['def read(in_queue{0}):'.format(parms)]
+    lines.extend(unpack_lines(len(fields)))
+    lines.extend(assignment_lines(fields))
+    names = [target for target, kind in fields
+             if target is not None and '.' not in target]
+    lines.append('    return ({0})'.format(
+        ''.join('{0}, '.format(name) for name in names)))
+    function = build('\n'.join(lines), {}, 'read')
+    function.fields = tuple(fields)
+    function.field_count = len(fields)
+    return function
+
+
+def compile_skip(method, count, finish=None):
+    """Return a function skip(in_queue, out_queue) that reads past a message
+    of 'count' fields without converting them or emitting anything.
+
+    Keyword arguments:
+    method -- name of the callback method of the message being skipped
+    count  -- number of fields in the fixed part of the message
+    finish -- function called as finish(in_queue) to read past any variable
+              length tail of the message (default: None)
+
+    """
+    lines = ['def skip(in_queue, out_queue):',
+             '    in_queue.skip({0})'.format(count)]
+    namespace = {}
+    if finish is not None:
+        namespace['finish'] = finish
+        lines.append('    finish(in_queue)')
+    function = build('\n'.join(lines), namespace, 'skip')
+    function.__name__ = 'skip_' + method
+    return function
+
+
+def converter(kind):
+    """Return a function that converts a raw field of the specified type."""
+    source = 'def convert(field):\n    return {0}'.format(
+        EXPRESSIONS[kind].format('field'))
+    return build(source, {}, 'convert')
+
+
+def lazy_layout(fields, name):
+    """Return the layout of the object with the specified name for its lazy
+    class: a dictionary of attribute name to (field index, converter) tuples
+    for the dotted targets that refer to it.
+
+    Keyword arguments:
+    fields -- sequence of (target, type) tuples in wire order
+    name   -- name of the object
+
+    """
+    prefix = name + '.'
+    return dict((target[len(prefix):], (index, CONVERTERS[kind]))
+                for index, (target, kind) in enumerate(fields)
+                if target is not None and target.startswith(prefix))
+
+
+def unpack_lines(count, source=None):
+    """Return the lines of code that read 'count' raw fields into the locals
+    f0, f1, ...
+
+    Keyword arguments:
+    count  -- number of fields
+    source -- expression holding the list of fields (default: a take() of
+              'count' fields from in_queue)
+
+    """
+    if source is None:
+        source = 'in_queue.take({0})'.format(count)
+    names = ''.join('f{0}, '.format(index) for index in range(count))
+    return ['    {0}= {1}'.format(names, source)]
+
+
+# Field type to function converting a raw field of that type
+CONVERTERS = dict((kind, converter(kind)) for kind in EXPRESSIONS)
@@ -1,37 +1,175 @@
 """Handle socket communications with the broker."""
 from multiprocessing import Process, Queue
+from multiprocessing.queues import Empty
 from ibapipy.ibapipy_error import IBAPIPyError
+import errno
+import functools
 import select
 import socket
+import time
+import ibapipy.core.instrumentation as instrumentation
 import ibapipy.core.reader as reader
+import ibapipy.core.shared_ring as shared_ring
+import ibapipy.core.session as session
 import ibapipy.config as config
 
 
+# Field separator as it appears on the wire
+EOL_BYTES = config.EOL.encode('utf-8')
+
+# Types of the items whose encodings are cached by encode_message(); bools
+# and floats are left out because they compare equal to values that encode
+# differently (True and 1, 0.0 and -0.0)
+CACHED_TYPES = frozenset([int, str])
+
+# Transports between the processes: multiprocessing queues or shared memory
+# rings (see ibapipy.core.shared_ring)
+QUEUE_TRANSPORT = 'queue'
+SHARED_MEMORY_TRANSPORT = 'shared_memory'
+
+# Data area sizes of the shared memory rings in bytes
+SOCKET_IN_RING_CAPACITY = 1 << 22
+SOCKET_OUT_RING_CAPACITY = 1 << 20
+MESSAGE_RING_CAPACITY = 1 << 24
+
+
+class SocketOptions:
+    """Socket settings applied by NetworkHandler.connect()."""
+
+    def __init__(self, no_delay=False, receive_buffer=None, send_buffer=None,
+                 read_size=config.BUFFER_SIZE, max_read_size=None,
+                 busy_poll=False):
+        """Initialize a new instance of SocketOptions.
+
+        Keyword arguments:
+        no_delay       -- True to set TCP_NODELAY so that requests and orders
+                          are sent right away rather than held back by
+                          Nagle's algorithm (default: False)
+        receive_buffer -- SO_RCVBUF size in bytes; None for the system
+                          default (default: None)
+        send_buffer    -- SO_SNDBUF size in bytes; None for the system
+                          default (default: None)
+        read_size      -- number of bytes asked for by each read
+                          (default: config.BUFFER_SIZE)
+        max_read_size  -- largest read size; reads that fill the whole read
+                          size double it up to this value and reads using
+                          less than a quarter of it halve it back down to
+                          read_size; None to always use read_size (default:
+                          None)
+        busy_poll      -- True to spin on non-blocking reads instead of
+                          sleeping in select(); this takes a whole core and
+                          only pays off with one to spare (default: False)
+
+        """
+        self.no_delay = no_delay
+        self.receive_buffer = receive_buffer
+        self.send_buffer = send_buffer
+        self.read_size = read_size
+        self.max_read_size = read_size if max_read_size is None \
+            else max(read_size, max_read_size)
+        self.busy_poll = busy_poll
+
+
+# Settings used unless others are passed to connect()
+DEFAULT_SOCKET_OPTIONS = SocketOptions()
+
+# Settings for the lowest latency short of busy polling
+LOW_LATENCY_SOCKET_OPTIONS = SocketOptions(
+    no_delay=True, receive_buffer=1 << 22, send_buffer=1 << 20,
+    read_size=1 << 16, max_read_size=1 << 20)
+
+
 class NetworkHandler:
 
-    def __init__(self):
-        """Initialize a new instance of a NetworkHandler."""
+    def __init__(self, historical_columns=False, capture_path=None,
+                 instrumented=False, transport=QUEUE_TRANSPORT, methods=None,
+                 lazy_objects=False):
+        """Initialize a new instance of a NetworkHandler.
+
+        Keyword arguments:
+        historical_columns -- True to receive each historical data message as
+                              a single structured NumPy array via
+                              historical_data_columns() (default: False)
+        capture_path       -- session file that received data is appended to
+                              (default: None)
+        instrumented       -- True to stamp each message with the time it
+                              was received, taken by the reader and decoded
+                              (see ibapipy.core.instrumentation) (default:
+                              False)
+        transport          -- QUEUE_TRANSPORT to pass data between the
+                              processes through multiprocessing queues, or
+                              SHARED_MEMORY_TRANSPORT to use shared memory
+                              rings; the rings are created on connect().
+                              The rings depend on the store ordering of
+                              x86-64, so queues are used on other machines
+                              (see shared_ring.STORE_ORDERED)
+                              (default: QUEUE_TRANSPORT)
+        methods            -- names of the callback methods that messages are
+                              wanted for; other messages are skipped without
+                              being decoded unless turned back on through
+                              message_switch (see
+                              reader.get_message_handlers()) (default: None)
+        lazy_objects       -- True to decode contracts, orders and executions
+                              into lazy objects that convert their fields on
+                              first access (default: False)
+
+        """
+        if transport not in (QUEUE_TRANSPORT, SHARED_MEMORY_TRANSPORT):
+            raise IBAPIPyError('Unknown transport: {0}'.format(transport))
+        if not shared_ring.STORE_ORDERED:
+            transport = QUEUE_TRANSPORT
+        self.message_switch = None
+        switch_flags = None
+        if methods is not None:
+            self.message_switch = reader.MessageSwitch()
+            switch_flags = self.message_switch.flags
+        # The message listener process builds its handlers from these
+        # arguments (see reader.get_message_handlers())
+        self.handler_arguments = (historical_columns, methods, lazy_objects,
+                                  switch_flags)
+        # Fail here rather than in the message listener process
+        reader.get_message_handlers(*self.handler_arguments)
+        self.capture_path = capture_path
+        self.instrumented = instrumented
+        self.transport = transport
         self.socket_in_queue = None
         self.socket_out_queue = None
-        self.message_queue = Queue()
+        self.message_queue = None
+        if transport == QUEUE_TRANSPORT:
+            self.message_queue = Queue()
         self.socket = None
         self.incoming_process = None
 
-    def connect(self, host, port, client_id):
+    def connect(self, host, port, client_id, socket_options=None):
         """Connect to the remote TWS and return the server version and TWS
         connection time.
 
         Keyword arguments:
-        host      -- host name or IP address of the TWS machine
-        port      -- port number on the TWS machine
-        client_id -- number used to identify this client connection
+        host           -- host name or IP address of the TWS machine
+        port           -- port number on the TWS machine
+        client_id      -- number used to identify this client connection
+        socket_options -- SocketOptions to apply, such as
+                          LOW_LATENCY_SOCKET_OPTIONS (default:
+                          DEFAULT_SOCKET_OPTIONS)
 
         """
         if self.socket is not None:
             return 0, 0
+        if socket_options is None:
+            socket_options = DEFAULT_SOCKET_OPTIONS
         # Connect
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # Buffer sizes are set before connecting so that the TCP window
+        # scale is negotiated for them
+        if socket_options.receive_buffer is not None:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                   socket_options.receive_buffer)
+        if socket_options.send_buffer is not None:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                                   socket_options.send_buffer)
+        if socket_options.no_delay:
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.socket.connect((host, port))
         # Initial handshake
         send(self.socket, config.CLIENT_VERSION)
@@ -43,20 +181,37 @@ class NetworkHandler:
                                           config.MIN_SERVER_VERSION))
         tws_connection_time = response[1]
         send(self.socket, client_id)
+        target = queue_message_listener
+        # Unless the fields are stamped, the reader splits the raw socket
+        # data itself when it comes through a ring
+        raw = False
+        if self.transport == QUEUE_TRANSPORT:
+            self.socket_out_queue = Queue()
+            self.socket_in_queue = Queue()
+        else:
+            self.socket_out_queue = shared_ring.SharedRing(
+                SOCKET_OUT_RING_CAPACITY, 'stop')
+            self.socket_in_queue = shared_ring.SharedRing(
+                SOCKET_IN_RING_CAPACITY, ['-1'])
+            self.message_queue = shared_ring.SharedRing(
+                MESSAGE_RING_CAPACITY, ('stop', None))
+            target = ring_message_listener
+            raw = not self.instrumented
         # Start the outoing request listener
-        self.socket_out_queue = Queue()
         process = Process(target=outgoing_listener,
                           args=(self.socket, self.socket_out_queue))
         process.start()
         # Start the incoming socket data --> incoming queue listener
-        self.socket_in_queue = Queue()
         process = Process(target=incoming_listener,
-                          args=(self.socket, self.socket_in_queue))
+                          args=(self.socket, self.socket_in_queue,
+                                self.capture_path, self.instrumented, raw,
+                                socket_options))
         self.incoming_process = process
         self.incoming_process.start()
         # Start the incoming data --> message listener
-        process = Process(target=reader.message_listener,
-                          args=(self.socket_in_queue, self.message_queue))
+        process = Process(target=target,
+                          args=(self.socket_in_queue, self.message_queue,
+                                self.handler_arguments, self.instrumented))
         process.start()
         return server_version, tws_connection_time
 
@@ -66,38 +221,205 @@ class NetworkHandler:
             return
         self.socket.shutdown(socket.SHUT_WR)
         self.socket_out_queue.put('stop')
-        self.socket_in_queue.put('-1')
-        self.message_queue.put(('stop', None))
+        if self.transport == QUEUE_TRANSPORT:
+            self.socket_in_queue.put(['-1'])
+            self.message_queue.put(('stop', None))
+        else:
+            # Each ring has a single producer, so the end of the incoming
+            # rings is flagged rather than put on them
+            self.socket_in_queue.finish()
+            self.message_queue.finish()
+            for ring in (self.socket_out_queue, self.socket_in_queue,
+                         self.message_queue):
+                ring.unlink()
         self.socket.close()
         self.socket = None
 
 
-def incoming_listener(in_socket, in_queue):
-    data_buffer = b''
+def incoming_listener(in_socket, in_queue, capture_path=None,
+                      instrumented=False, raw=False, socket_options=None):
+    """Read data from in_socket and place the decoded fields in in_queue.
+
+    Fields are framed: everything decoded from a single read is placed in the
+    queue as one list rather than field by field.
+
+    Keyword arguments:
+    in_socket    -- incoming socket
+    in_queue     -- queue that receives lists of fields
+    capture_path -- session file that the data read is appended to
+                    (default: None)
+    instrumented -- True to stamp each list of fields with the time it was
+                    read (default: False)
+    raw          -- True to place the data read in in_queue as it is rather
+                    than split into fields; in_queue must then be a
+                    SharedRing, which copies it (default: False)
+    socket_options -- SocketOptions with the read sizes and whether to busy
+                      poll (default: DEFAULT_SOCKET_OPTIONS)
+
+    """
+    decoder = None if raw else FieldDecoder()
+    writer = None
+    if capture_path is not None:
+        writer = session.SessionWriter(capture_path)
+    try:
+        read_socket(in_socket, in_queue, decoder, writer, instrumented,
+                    socket_options)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def read_socket(in_socket, in_queue, decoder, writer=None,
+                instrumented=False, socket_options=None):
+    """Read data from in_socket until it is closed, placing the decoded fields
+    in in_queue and recording the data with writer.
+
+    Data is received into a single reusable buffer with recv_into(), and the
+    read size adapts to the amount of data waiting (see SocketOptions).
+
+    Keyword arguments:
+    in_socket      -- incoming socket
+    in_queue       -- queue that receives lists of fields
+    decoder        -- FieldDecoder for the stream; None to place the data
+                      read in in_queue as it is
+    writer         -- ibapipy.core.session.SessionWriter object (default:
+                      None)
+    instrumented   -- True to place ibapipy.core.instrumentation.TimedFields
+                      stamped with the time of the read (default: False)
+    socket_options -- SocketOptions with the read sizes and whether to busy
+                      poll (default: DEFAULT_SOCKET_OPTIONS)
+
+    """
+    if socket_options is None:
+        socket_options = DEFAULT_SOCKET_OPTIONS
+    min_size = socket_options.read_size
+    max_size = socket_options.max_read_size
+    size = min_size
+    buffer = bytearray(max_size)
+    view = memoryview(buffer)
     while True:
-        try:
-            inputready, outputready, exceptrdy = select.select(
-                [in_socket], [], [], config.TIMEOUT)
-        except select.error as ex:
-            # If we close the socket on the client end, select will see a bad
-            # file descriptor (the closed socket) and raise an exception with
-            # ID 9 (bad file descriptor)
-            if ex.args[0] == 9:
-                return
-            else:
-                raise IBAPIPyError('select error', ex)
-        for item in inputready:
-            raw_data = in_socket.recv(config.BUFFER_SIZE)
-            data_buffer += raw_data
-            # No more data, go ahead and shut down
-            if len(raw_data) == 0:
-                in_socket.close()
-                return
-            else:
-                data, remainder = decode(data_buffer)
-                data_buffer = remainder
-                for item in data:
-                    in_queue.put(item, block=False)
+        if socket_options.busy_poll:
+            try:
+                count = in_socket.recv_into(buffer, size, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                continue
+            except OSError as ex:
+                # The socket was closed on the client end
+                if ex.errno == errno.EBADF:
+                    return
+                raise
+        else:
+            try:
+                inputready, outputready, exceptrdy = select.select(
+                    [in_socket], [], [], config.TIMEOUT)
+            except select.error as ex:
+                # If we close the socket on the client end, select will see a
+                # bad file descriptor (the closed socket) and raise an
+                # exception with ID 9 (bad file descriptor)
+                if ex.args[0] == 9:
+                    return
+                else:
+                    raise IBAPIPyError('select error', ex)
+            if len(inputready) == 0:
+                continue
+            count = in_socket.recv_into(buffer, size)
+        received = time.monotonic_ns() if instrumented else 0
+        # No more data, go ahead and shut down
+        if count == 0:
+            in_socket.close()
+            return
+        if writer is not None:
+            writer.write(view[:count])
+        if decoder is None:
+            in_queue.put(view[:count], block=False)
+        else:
+            data = decoder.feed_buffer(buffer, count)
+            if len(data) > 0:
+                if instrumented:
+                    data = instrumentation.TimedFields(data)
+                    data.received = received
+                in_queue.put(data, block=False)
+        # Read more at once while data is piling up, less once it is not
+        if count == size and size < max_size:
+            size = min(size * 2, max_size)
+        elif count < size // 4 and size > min_size:
+            size = max(size // 2, min_size)
+
+
+class FieldDecoder:
+    """Incrementally decodes a stream of fields separated by the hexadecimal
+    value EOL.
+
+    Only newly received bytes are scanned for EOL, and only complete fields
+    are decoded. The partial field at the end of the stream is kept as raw
+    bytes in a bytearray until the rest of it arrives, so a field that spans
+    many reads is decoded once rather than once per read. Since decoding never
+    happens on a partial field, multi-byte characters split between reads are
+    handled as well.
+
+    """
+
+    def __init__(self):
+        """Initialize a new instance of a FieldDecoder."""
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Add the specified data to the stream and return a list of the
+        fields that have been completed by it.
+
+        Keyword arguments:
+        data -- bytes received from the network
+
+        """
+        buffer = self.buffer
+        # Common case: nothing left over from the previous read
+        if len(buffer) == 0:
+            end = data.rfind(EOL_BYTES)
+            if end < 0:
+                buffer += data
+                return []
+            if end + 1 < len(data):
+                buffer += data[end + 1:]
+            return data[:end].decode('utf-8').split(config.EOL)
+        scan_start = len(buffer)
+        buffer += data
+        end = buffer.rfind(EOL_BYTES, scan_start)
+        if end < 0:
+            return []
+        fields = buffer[:end].decode('utf-8').split(config.EOL)
+        del buffer[:end + 1]
+        return fields
+
+    def feed_buffer(self, data, size):
+        """Like feed() for the first 'size' bytes of a reusable buffer.
+
+        The fields are decoded straight from the buffer and only a partial
+        field at its end is copied, so the buffer can be refilled as soon as
+        this returns.
+
+        Keyword arguments:
+        data -- bytearray the network data was received into
+        size -- number of bytes received
+
+        """
+        buffer = self.buffer
+        view = memoryview(data)[:size]
+        if len(buffer) == 0:
+            end = data.rfind(EOL_BYTES, 0, size)
+            if end < 0:
+                buffer += view
+                return []
+            if end + 1 < size:
+                buffer += view[end + 1:]
+            return str(view[:end], 'utf-8').split(config.EOL)
+        scan_start = len(buffer)
+        buffer += view
+        end = buffer.rfind(EOL_BYTES, scan_start)
+        if end < 0:
+            return []
+        fields = buffer[:end].decode('utf-8').split(config.EOL)
+        del buffer[:end + 1]
+        return fields
 
 
 def decode(item):
@@ -145,12 +467,59 @@ def encode(item):
     return result.encode('utf-8')
 
 
+@functools.lru_cache(maxsize=4096)
+def encode_cached(item):
+    """Return encode(item), caching the result. Only call this for items
+    whose type is in CACHED_TYPES.
+
+    Keyword arguments:
+    item -- int or str to encode
+
+    """
+    return encode(item)
+
+
+def encode_message(*args):
+    """Encode the specified items and return them joined into a single bytes
+    object ready to be written to the network in one call.
+
+    Keyword arguments:
+    *args -- items to encode
+
+    """
+    return b''.join([encode_cached(item) if type(item) in CACHED_TYPES
+                     else encode(item) for item in args])
+
+
 def outgoing_listener(out_socket, out_queue):
+    """Write the encoded messages placed in out_queue to out_socket.
+
+    Every message already waiting in the queue is coalesced into a single
+    write, so a burst of requests costs one system call.
+
+    Keyword arguments:
+    out_socket -- outgoing socket
+    out_queue  -- queue of encoded messages
+
+    """
     while True:
         item = out_queue.get()
         if item == 'stop':
             return
-        send(out_socket, item)
+        items = [item]
+        stop = False
+        while True:
+            try:
+                item = out_queue.get_nowait()
+            except Empty:
+                break
+            if item == 'stop':
+                stop = True
+                break
+            items.append(item)
+        out_socket.sendall(b''.join(items))
+        if stop:
+            return
 
 
 def send(out_socket, *args):
@@ -161,5 +530,74 @@ def send(out_socket, *args):
     *args      -- items to send over the network
 
     """
-    for item in args:
-        out_socket.sendall(encode(item))
+    out_socket.sendall(encode_message(*args))
+
+
+class RawFieldQueue:
+    """Splits the raw socket data taken from a ring into fields, handing out
+    a list of fields per get() like the socket queue of the queue transport.
+
+    """
+
+    def __init__(self, ring):
+        """Initialize a new instance of a RawFieldQueue.
+
+        Keyword arguments:
+        ring -- ibapipy.core.shared_ring.SharedRing of raw socket data and
+                lists of fields
+
+        """
+        self.ring = ring
+        self.decoder = FieldDecoder()
+
+    def get(self, block=True, timeout=None):
+        """Return the next non-empty list of fields.
+
+        Keyword arguments:
+        block   -- passed on to the ring (default: True)
+        timeout -- seconds to wait for each item of the ring (default: None)
+
+        """
+        while True:
+            item = self.ring.get(block, timeout)
+            if type(item) is not bytes:
+                return item
+            fields = self.decoder.feed(item)
+            if len(fields) > 0:
+                return fields
+
+
+def queue_message_listener(socket_in_queue, message_queue,
+                           handler_arguments, instrumented=False):
+    """Run reader.message_listener() with message handlers built in this
+    process.
+
+    Keyword arguments:
+    socket_in_queue   -- queue of fields filled by the incoming listener
+    message_queue     -- queue that receives the decoded messages
+    handler_arguments -- arguments of reader.get_message_handlers()
+    instrumented      -- True to stamp each message (default: False)
+
+    """
+    reader.message_listener(socket_in_queue, message_queue,
+                            reader.get_message_handlers(*handler_arguments),
+                            instrumented)
+
+
+def ring_message_listener(socket_in_ring, message_ring, handler_arguments,
+                          instrumented=False):
+    """Run reader.message_listener() over the data of a socket ring, with
+    message handlers built in this process.
+
+    Keyword arguments:
+    socket_in_ring    -- ibapipy.core.shared_ring.SharedRing filled by the
+                         incoming listener
+    message_ring      -- ibapipy.core.shared_ring.SharedRing that receives
+                         the decoded messages
+    handler_arguments -- arguments of reader.get_message_handlers()
+    instrumented      -- True to stamp each message (default: False)
+
+    """
+    reader.message_listener(RawFieldQueue(socket_in_ring), message_ring,
+                            reader.get_message_handlers(*handler_arguments),
+                            instrumented)
@@ -0,0 +1,278 @@
+"""Maintains market depth books from update_mkt_depth() and
+update_mkt_depth_l2() messages.
+
+An OrderBook keeps the price, size and market maker of every level of each
+market depth request in preallocated arrays, one block of 'depth' levels per
+side and request, and applies the insert, update and delete operations sent
+by TWS in place. The best bid and ask are always at the first level of their
+block, so reading them is a pair of index lookups; depth snapshots are taken
+with NumPy views of the same arrays.
+
+Like the QuoteBook, book changes are coalesced: poll() returns each changed
+request at most once per 'interval_ms' milliseconds.
+
+"""
+from array import array
+from ibapipy.ibapipy_error import IBAPIPyError
+import time
+import ibapipy.config as config
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Methods that are applied to the order book when one is attached
+DEPTH_METHODS = ('update_mkt_depth', 'update_mkt_depth_l2')
+
+# Layout of a single level in a snapshot
+DEPTH_DTYPE = [('bid', 'f8'), ('bid_size', 'i8'), ('ask', 'f8'),
+               ('ask_size', 'i8')]
+
+
+class OrderBook:
+    """Market depth books keyed by market depth request ID."""
+
+    def __init__(self, capacity=256, depth=10, interval_ms=100):
+        """Initialize a new instance of an OrderBook.
+
+        Keyword arguments:
+        capacity    -- maximum number of requests tracked (default: 256)
+        depth       -- number of levels kept per side; levels beyond it are
+                       dropped (default: 10)
+        interval_ms -- minimum number of milliseconds between two published
+                       changes for the same request; 0 publishes every
+                       change (default: 100)
+
+        """
+        self.capacity = capacity
+        self.depth = depth
+        self.interval_ms = interval_ms
+        self.rows = {}
+        self.local_symbols = [''] * capacity
+        self.free_rows = list(range(capacity - 1, -1, -1))
+        size = capacity * depth
+        self.milliseconds = array('q', [0]) * capacity
+        self.published = array('q', [0]) * capacity
+        # Prices, sizes and market makers indexed by side (DEPTH_ASK or
+        # DEPTH_BID), then row * depth + position
+        self.prices = (array('d', [0.0]) * size, array('d', [0.0]) * size)
+        self.sizes = (array('q', [0]) * size, array('q', [0]) * size)
+        self.market_makers = ([''] * size, [''] * size)
+        self.changed = {}
+        # NumPy views of the price and size arrays, shaped (capacity, depth),
+        # used for snapshots
+        self.views = None
+        if np is not None:
+            self.views = tuple(
+                (np.frombuffer(self.prices[side], dtype=np.float64).reshape(
+                    capacity, depth),
+                 np.frombuffer(self.sizes[side], dtype=np.int64).reshape(
+                    capacity, depth))
+                for side in (config.DEPTH_ASK, config.DEPTH_BID))
+
+    def __contains__(self, req_id):
+        """Return True if the specified request ID has a row in the book."""
+        return req_id in self.rows
+
+    def add(self, req_id, contract=None):
+        """Assign a row to the specified request ID, clear it and return it.
+
+        Keyword arguments:
+        req_id   -- market depth request ID
+        contract -- ibapipy.data.contract.Contract object used to label the
+                    book (default: None)
+
+        """
+        row = self.rows.get(req_id)
+        if row is None:
+            if len(self.free_rows) == 0:
+                msg = 'Order book is full ({0} requests).'
+                raise IBAPIPyError(msg.format(self.capacity))
+            row = self.free_rows.pop()
+            self.rows[req_id] = row
+            self.clear(row)
+        if contract is not None:
+            self.local_symbols[row] = contract.local_symbol
+        return row
+
+    def apply(self, method, parms, milliseconds=None):
+        """Apply an update_mkt_depth or update_mkt_depth_l2 message to the
+        book and return True if the book changed.
+
+        Keyword arguments:
+        method       -- 'update_mkt_depth' or 'update_mkt_depth_l2'
+        parms        -- parameters of the message
+        milliseconds -- time of the update in milliseconds since the Epoch
+                        (default: current time)
+
+        """
+        if method == 'update_mkt_depth':
+            req_id, position, operation, side, price, size = parms
+            market_maker = ''
+        elif method == 'update_mkt_depth_l2':
+            req_id, position, market_maker, operation, side, price, size = \
+                parms
+        else:
+            return False
+        return self.update(req_id, position, market_maker, operation, side,
+                           price, size, milliseconds)
+
+    def best_ask(self, req_id):
+        """Return the (price, size) of the best ask of a request."""
+        start = self.rows[req_id] * self.depth
+        return (self.prices[config.DEPTH_ASK][start],
+                self.sizes[config.DEPTH_ASK][start])
+
+    def best_bid(self, req_id):
+        """Return the (price, size) of the best bid of a request."""
+        start = self.rows[req_id] * self.depth
+        return (self.prices[config.DEPTH_BID][start],
+                self.sizes[config.DEPTH_BID][start])
+
+    def clear(self, row):
+        """Empty every level of the specified row."""
+        start = row * self.depth
+        end = start + self.depth
+        for side in (config.DEPTH_ASK, config.DEPTH_BID):
+            prices = self.prices[side]
+            sizes = self.sizes[side]
+            market_makers = self.market_makers[side]
+            for index in range(start, end):
+                prices[index] = 0.0
+                sizes[index] = 0
+                market_makers[index] = ''
+        self.milliseconds[row] = 0
+        self.published[row] = 0
+        self.local_symbols[row] = ''
+
+    def levels(self, req_id, side):
+        """Return a list of the (price, size, market maker) of each level on
+        one side of a request's book, best first, up to the first empty
+        level.
+
+        Keyword arguments:
+        req_id -- market depth request ID
+        side   -- config.DEPTH_ASK or config.DEPTH_BID
+
+        """
+        start = self.rows[req_id] * self.depth
+        prices = self.prices[side]
+        sizes = self.sizes[side]
+        market_makers = self.market_makers[side]
+        result = []
+        for index in range(start, start + self.depth):
+            if sizes[index] == 0 and prices[index] == 0.0:
+                break
+            result.append((prices[index], sizes[index],
+                           market_makers[index]))
+        return result
+
+    def poll(self, milliseconds=None):
+        """Return a list of the request IDs whose books have changed and
+        were last published at least 'interval_ms' milliseconds ago. The
+        returned requests are marked as published.
+
+        Keyword arguments:
+        milliseconds -- current time in milliseconds since the Epoch
+                        (default: current time)
+
+        """
+        if len(self.changed) == 0:
+            return []
+        if milliseconds is None:
+            milliseconds = int(time.time() * 1000)
+        due = milliseconds - self.interval_ms
+        published = self.published
+        result = []
+        for req_id, row in list(self.changed.items()):
+            if published[row] <= due:
+                published[row] = milliseconds
+                del self.changed[req_id]
+                result.append(req_id)
+        return result
+
+    def remove(self, req_id):
+        """Release the row used by the specified request ID."""
+        row = self.rows.pop(req_id, None)
+        if row is None:
+            return
+        self.changed.pop(req_id, None)
+        self.free_rows.append(row)
+
+    def snapshot(self, req_id):
+        """Return a structured NumPy array (see DEPTH_DTYPE) with one record
+        per level of a request's book, best first. Empty levels are zero.
+
+        Keyword arguments:
+        req_id -- market depth request ID
+
+        """
+        if np is None:
+            raise IBAPIPyError('NumPy is required for snapshot().')
+        row = self.rows[req_id]
+        ask_prices, ask_sizes = self.views[config.DEPTH_ASK]
+        bid_prices, bid_sizes = self.views[config.DEPTH_BID]
+        result = np.empty(self.depth, dtype=DEPTH_DTYPE)
+        result['bid'] = bid_prices[row]
+        result['bid_size'] = bid_sizes[row]
+        result['ask'] = ask_prices[row]
+        result['ask_size'] = ask_sizes[row]
+        return result
+
+    def update(self, req_id, position, market_maker, operation, side, price,
+               size, milliseconds=None):
+        """Apply a single depth operation and return True if the book
+        changed. Positions beyond the book depth are ignored.
+
+        Keyword arguments are those of ClientSocket.update_mkt_depth_l2()
+        plus:
+        milliseconds -- time of the update in milliseconds since the Epoch
+                        (default: current time)
+
+        """
+        depth = self.depth
+        if position < 0 or position >= depth:
+            return False
+        row = self.rows.get(req_id)
+        if row is None:
+            row = self.add(req_id)
+        prices = self.prices[side]
+        sizes = self.sizes[side]
+        market_makers = self.market_makers[side]
+        start = row * depth
+        index = start + position
+        end = start + depth
+        if operation == config.DEPTH_UPDATE:
+            if prices[index] == price and sizes[index] == size and \
+                    market_makers[index] == market_maker:
+                return False
+        elif operation == config.DEPTH_INSERT:
+            # Shift the levels from the position down, dropping the last.
+            # Element by element, as slices would copy (and the arrays are
+            # exported to the NumPy views)
+            for target in range(end - 1, index, -1):
+                prices[target] = prices[target - 1]
+                sizes[target] = sizes[target - 1]
+                market_makers[target] = market_makers[target - 1]
+        elif operation == config.DEPTH_DELETE:
+            # Shift the levels after the position up, emptying the last
+            for target in range(index, end - 1):
+                prices[target] = prices[target + 1]
+                sizes[target] = sizes[target + 1]
+                market_makers[target] = market_makers[target + 1]
+            prices[end - 1] = 0.0
+            sizes[end - 1] = 0
+            market_makers[end - 1] = ''
+        else:
+            return False
+        if operation != config.DEPTH_DELETE:
+            prices[index] = price
+            sizes[index] = size
+            market_makers[index] = market_maker
+        if milliseconds is None:
+            milliseconds = int(time.time() * 1000)
+        self.milliseconds[row] = milliseconds
+        self.changed[req_id] = row
+        return True
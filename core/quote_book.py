@@ -0,0 +1,237 @@
+"""Aggregates tick_price() and tick_size() updates into top-of-book quotes.
+
+A QuoteBook keeps the current bid, ask, bid size, ask size and volume of each
+market data request in preallocated arrays and updates them in place. Quote
+changes are coalesced: poll() returns each changed request at most once per
+'interval_ms' milliseconds, no matter how many ticks arrived in between.
+
+Only the ticks of requests that have been added to the book and of the tick
+types it tracks are consumed (see consumes()); clients deliver the others
+through the usual tick_price() and tick_size() callbacks.
+
+"""
+from array import array
+from ibapipy.data.tick import Tick
+from ibapipy.ibapipy_error import IBAPIPyError
+import time
+import ibapipy.config as config
+
+
+# Tick types tracked by tick_price() and tick_size()
+PRICE_TICK_TYPES = (config.BID, config.ASK)
+SIZE_TICK_TYPES = (config.BID_SIZE, config.ASK_SIZE, config.VOLUME)
+
+
+class QuoteBook:
+    """Top-of-book quotes keyed by market data request ID.
+
+    Rows are assigned to request IDs via add(), which
+    ClientSocket.req_mkt_data() calls when a book is attached and which also
+    allows looking up quotes by contract ID. Ticks of other request IDs are
+    ignored.
+
+    """
+
+    def __init__(self, capacity=1024, interval_ms=100):
+        """Initialize a new instance of a QuoteBook.
+
+        Keyword arguments:
+        capacity    -- maximum number of requests tracked (default: 1024)
+        interval_ms -- minimum number of milliseconds between two published
+                       changes for the same request (default: 100)
+
+        """
+        self.capacity = capacity
+        self.interval_ms = interval_ms
+        self.rows = {}
+        self.con_ids = {}
+        self.local_symbols = [''] * capacity
+        self.free_rows = list(range(capacity - 1, -1, -1))
+        self.milliseconds = array('q', [0]) * capacity
+        self.bid = array('d', [0.0]) * capacity
+        self.ask = array('d', [0.0]) * capacity
+        self.bid_size = array('q', [0]) * capacity
+        self.ask_size = array('q', [0]) * capacity
+        self.volume = array('q', [0]) * capacity
+        self.published = array('q', [0]) * capacity
+        self.changed = {}
+
+    def __contains__(self, req_id):
+        """Return True if the specified request ID has a row in the book."""
+        return req_id in self.rows
+
+    def add(self, req_id, contract=None):
+        """Assign a row to the specified request ID and return it.
+
+        Keyword arguments:
+        req_id   -- market data request ID
+        contract -- ibapipy.data.contract.Contract object used to look the
+                    quote up by contract ID and to label published ticks
+                    (default: None)
+
+        """
+        row = self.rows.get(req_id)
+        if row is None:
+            if len(self.free_rows) == 0:
+                msg = 'Quote book is full ({0} requests).'
+                raise IBAPIPyError(msg.format(self.capacity))
+            row = self.free_rows.pop()
+            self.rows[req_id] = row
+            self.milliseconds[row] = 0
+            self.bid[row] = 0.0
+            self.ask[row] = 0.0
+            self.bid_size[row] = 0
+            self.ask_size[row] = 0
+            self.volume[row] = 0
+            self.published[row] = 0
+            self.local_symbols[row] = ''
+        if contract is not None:
+            self.local_symbols[row] = contract.local_symbol
+            self.con_ids[contract.con_id] = req_id
+        return row
+
+    def apply(self, method, parms, milliseconds=None):
+        """Apply a tick_price or tick_size message to the book and return True
+        if the quote changed.
+
+        Keyword arguments:
+        method       -- 'tick_price' or 'tick_size'
+        parms        -- parameters of the message
+        milliseconds -- time of the update in milliseconds since the Epoch
+                        (default: current time)
+
+        """
+        if method == 'tick_price':
+            return self.tick_price(parms[0], parms[1], parms[2],
+                                   milliseconds=milliseconds)
+        elif method == 'tick_size':
+            return self.tick_size(parms[0], parms[1], parms[2],
+                                  milliseconds=milliseconds)
+        return False
+
+    def consumes(self, method, parms):
+        """Return True if the specified tick_price or tick_size message
+        belongs to a request in the book and is of a tracked tick type.
+
+        Keyword arguments:
+        method -- 'tick_price' or 'tick_size'
+        parms  -- parameters of the message
+
+        """
+        if parms[0] not in self.rows:
+            return False
+        if method == 'tick_price':
+            return parms[1] in PRICE_TICK_TYPES
+        elif method == 'tick_size':
+            return parms[1] in SIZE_TICK_TYPES
+        return False
+
+    def poll(self, milliseconds=None):
+        """Return a list of the request IDs whose quotes have changed and
+        were last published at least 'interval_ms' milliseconds ago. The
+        returned requests are marked as published.
+
+        Keyword arguments:
+        milliseconds -- current time in milliseconds since the Epoch
+                        (default: current time)
+
+        """
+        if len(self.changed) == 0:
+            return []
+        if milliseconds is None:
+            milliseconds = int(time.time() * 1000)
+        due = milliseconds - self.interval_ms
+        published = self.published
+        result = []
+        for req_id, row in list(self.changed.items()):
+            if published[row] <= due:
+                published[row] = milliseconds
+                del self.changed[req_id]
+                result.append(req_id)
+        return result
+
+    def remove(self, req_id):
+        """Release the row used by the specified request ID."""
+        row = self.rows.pop(req_id, None)
+        if row is None:
+            return
+        self.changed.pop(req_id, None)
+        for con_id in [key for key, value in self.con_ids.items()
+                       if value == req_id]:
+            del self.con_ids[con_id]
+        self.free_rows.append(row)
+
+    def tick(self, req_id):
+        """Return the current quote for the specified request ID as a Tick.
+
+        Keyword arguments:
+        req_id -- market data request ID
+
+        """
+        row = self.rows[req_id]
+        tick = Tick(self.local_symbols[row], self.milliseconds[row])
+        tick.bid = self.bid[row]
+        tick.ask = self.ask[row]
+        tick.bid_size = self.bid_size[row]
+        tick.ask_size = self.ask_size[row]
+        tick.volume = self.volume[row]
+        return tick
+
+    def tick_for_con_id(self, con_id):
+        """Return the current quote for the specified contract ID as a
+        Tick.
+
+        """
+        return self.tick(self.con_ids[con_id])
+
+    def tick_price(self, req_id, tick_type, price, can_auto_execute=0,
+                   milliseconds=None):
+        """Apply a price update and return True if the quote changed. Tick
+        types other than bid and ask are ignored.
+
+        Keyword arguments are those of ClientSocket.tick_price() plus:
+        milliseconds -- time of the update in milliseconds since the Epoch
+                        (default: current time)
+
+        """
+        if tick_type == config.BID:
+            column = self.bid
+        elif tick_type == config.ASK:
+            column = self.ask
+        else:
+            return False
+        return self.update(req_id, column, price, milliseconds)
+
+    def tick_size(self, req_id, tick_type, size, milliseconds=None):
+        """Apply a size update and return True if the quote changed. Tick
+        types other than bid size, ask size and volume are ignored.
+
+        Keyword arguments are those of ClientSocket.tick_size() plus:
+        milliseconds -- time of the update in milliseconds since the Epoch
+                        (default: current time)
+
+        """
+        if tick_type == config.BID_SIZE:
+            column = self.bid_size
+        elif tick_type == config.ASK_SIZE:
+            column = self.ask_size
+        elif tick_type == config.VOLUME:
+            column = self.volume
+        else:
+            return False
+        return self.update(req_id, column, size, milliseconds)
+
+    def update(self, req_id, column, value, milliseconds):
+        """Set the value of the specified column for a request and return
+        True if it changed. Requests that are not in the book are ignored.
+
+        """
+        row = self.rows.get(req_id)
+        if row is None or column[row] == value:
+            return False
+        column[row] = value
+        if milliseconds is None:
+            milliseconds = int(time.time() * 1000)
+        self.milliseconds[row] = milliseconds
+        self.changed[req_id] = row
+        return True
@@ -10,45 +10,38 @@ raise a warning if that minimum is not met.
 
 """
 from multiprocessing.queues import Empty
+from multiprocessing.sharedctypes import RawArray
+from ibapipy.core.message_schema import (BOOL, FLOAT, FLOAT_MAX, INT, INT_MAX,
+                                         STR, VERSION_ERROR, MessageSchema,
+                                         compile_group, compile_skip,
+                                         lazy_layout)
 from ibapipy.ibapipy_error import IBAPIPyError
 from ibapipy.data.combo_leg import ComboLeg
 from ibapipy.data.commission_report import CommissionReport
-from ibapipy.data.contract import Contract
-from ibapipy.data.execution import Execution
-from ibapipy.data.order import Order
+from ibapipy.data.contract import Contract, LazyContract
+from ibapipy.data.execution import Execution, LazyExecution
+from ibapipy.data.lazy_object import register_layout
+from ibapipy.data.order import LazyOrder, Order
 from ibapipy.data.order_combo_leg import OrderComboLeg
 from ibapipy.data.tag_value import TagValue
 from ibapipy.data.under_comp import UnderComp
-import calendar
-import pytz
+import threading
+import time
+import ibapipy.core.instrumentation as instrumentation
+import ibapipy.core.timestamps as timestamps
 import ibapipy.config as config
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
-# Error message for versions.
-VERSION_ERROR = 'Version is {0:d} (min {1:d} needed)'
-
-
-def _str_to_ms(time_str, timezone='UTC', formatting='%Y-%m-%d %H:%M:%S.%f'):
-    """Return the time in milliseconds since the Epoch for the specified
-    time string.
-
-    Keyword arguments:
-    time_str -- time string
-
-    """
-    dtime = pytz.datetime.datetime.strptime(time_str, formatting)
-    # Note that in order for daylight savings conversions to work, we
-    # MUST use localize() here and cannot simply pass a timezone into the
-    # datetime constructor. This is because derple, werpy, durp, durp ...
-    tzone = pytz.timezone(timezone)
-    dtime = pytz.datetime.datetime(dtime.year, dtime.month, dtime.day,
-                                   dtime.hour, dtime.minute, dtime.second,
-                                   dtime.microsecond)
-    dtime = tzone.localize(dtime)
-    dtime = dtime.astimezone(pytz.timezone('UTC'))
-    milliseconds = calendar.timegm(dtime.utctimetuple()) * 1000
-    milliseconds = int(milliseconds + dtime.microsecond / 1000.0)
-    return milliseconds
+# Layout of the structured array passed to historical_data_columns()
+HISTORICAL_DATA_DTYPE = [('date', 'U32'), ('milliseconds', 'i8'),
+                         ('open', 'f8'), ('high', 'f8'), ('low', 'f8'),
+                         ('close', 'f8'), ('volume', 'i8'),
+                         ('bar_count', 'i8'), ('wap', 'f8'),
+                         ('has_gaps', '?')]
 
 
 def get_bool(socket_in_queue, timeout=10):
@@ -71,136 +64,389 @@ def get_str(socket_in_queue, timeout=10):
     return socket_in_queue.get(timeout=timeout).lower()
 
 
-def message_listener(socket_in_queue, message_queue):
-    # Message ID to function mappings.
-    message_ids = {config.ACCT_DOWNLOAD_END: account_download_end,
-                   config.ACCT_UPDATE_TIME: account_update_time,
-                   config.ACCT_VALUE: account_value,
-                   config.CONTRACT_DATA: contract_details,
-                   config.CONTRACT_DATA_END: contract_details_end,
-                   config.CURRENT_TIME: current_time,
-                   config.ERR_MSG: error,
-                   config.EXECUTION_DATA: exec_details,
-                   config.EXECUTION_DATA_END: exec_details_end,
-                   config.HISTORICAL_DATA: historical_data,
-                   config.MANAGED_ACCTS: managed_accounts,
-                   config.NEXT_VALID_ID: next_valid_id,
-                   config.OPEN_ORDER: open_order,
-                   config.OPEN_ORDER_END: open_order_end,
-                   config.ORDER_STATUS: order_status,
-                   config.PORTFOLIO_VALUE: portfolio_value,
-                   config.TICK_GENERIC: tick_generic,
-                   config.TICK_PRICE: tick_price,
-                   config.TICK_SIZE: tick_size,
-                   config.TICK_STRING: tick_string,
-                   config.COMMISSION_REPORT: commission_report}
-    while True:
-        try:
-            message_id = get_int(socket_in_queue)
-        except Empty:
-            continue
-        if message_id in message_ids:
-            message_ids[message_id](socket_in_queue, message_queue)
-        elif message_id < 0:
-            return
-        else:
-            raise IBAPIPyError('Unsupported message ID: {0}'.format(message_id))
+def get_fields(socket_in_queue, count, timeout=10):
+    """Return a list of the next 'count' raw (unconverted) fields.
 
+    Keyword arguments:
+    socket_in_queue -- queue, FieldBuffer or FieldList to read from
+    count           -- number of fields to read
+    timeout         -- seconds to wait for each field (default: 10)
 
-def account_download_end(in_queue, out_queue):
-    get_int(in_queue)      # version
-    account_name = get_str(in_queue)
-    result = ('account_download_end', (account_name,))
-    out_queue.put(result, block=False)
+    """
+    if hasattr(socket_in_queue, 'take'):
+        return socket_in_queue.take(count, timeout)
+    return [socket_in_queue.get(timeout=timeout) for index in range(count)]
 
 
-def account_update_time(in_queue, out_queue):
-    get_int(in_queue)      # version
-    timestamp = get_str(in_queue)
-    result = ('update_account_time', (timestamp,))
-    out_queue.put(result, block=False)
+def skip_fields(socket_in_queue, count, timeout=10):
+    """Read past the next 'count' fields without copying them.
 
+    Keyword arguments:
+    socket_in_queue -- queue, FieldBuffer or FieldList to read from
+    count           -- number of fields to skip
+    timeout         -- seconds to wait for each field (default: 10)
 
-def account_value(in_queue, out_queue):
-    get_int(in_queue)      # version
-    key = get_str(in_queue)
-    value = get_str(in_queue)
-    currency = get_str(in_queue)
-    account_name = get_str(in_queue)
-    result = ('update_account_value', (key, value, currency, account_name))
-    out_queue.put(result, block=False)
+    """
+    if hasattr(socket_in_queue, 'skip'):
+        socket_in_queue.skip(count, timeout)
+    else:
+        for index in range(count):
+            socket_in_queue.get(timeout=timeout)
 
 
-def commission_report(in_queue, out_queue):
-    get_int(in_queue)      # version
-    report = CommissionReport()
-    report.exec_id = get_str(in_queue)
-    report.commission = get_float(in_queue)
-    report.currency = get_str(in_queue)
-    report.realized_pnl = get_float(in_queue)
-    report.yield_value = get_float(in_queue)
-    report.yield_redemption_date = get_int(in_queue)
-    result = ('commission_report', (report,))
-    out_queue.put(result, block=False)
+class FieldBuffer:
+    """Hands out single fields from the framed chunks placed on the socket
+    queue by the incoming listener.
 
+    Each chunk is a list of fields, so a queue operation is only needed once
+    the current chunk has been used up rather than once per field. Instances
+    expose the same get() method as a queue and can be passed anywhere the
+    get_*() functions expect one.
 
-def contract_details(in_queue, out_queue):
-    version = get_int(in_queue)
-    if version < 8:
-        raise IBAPIPyError(VERSION_ERROR.format(version, 8))
-    req_id = get_int(in_queue)
-    contract = Contract()
-    contract.symbol = get_str(in_queue)
-    contract.sec_type = get_str(in_queue)
-    contract.expiry = get_str(in_queue)
-    contract.strike = get_float(in_queue)
-    contract.right = get_str(in_queue)
-    contract.exchange = get_str(in_queue)
-    contract.currency = get_str(in_queue)
-    contract.local_symbol = get_str(in_queue)
-    contract.market_name = get_str(in_queue)
-    contract.trading_class = get_str(in_queue)
-    contract.con_id = get_int(in_queue)
-    contract.min_tick = get_float(in_queue)
-    contract.multiplier = get_str(in_queue)
-    contract.order_types = get_str(in_queue)
-    contract.valid_exchanges = get_str(in_queue)
-    contract.price_magnifier = get_int(in_queue)
-    contract.under_con_id = get_int(in_queue)
-    contract.long_name = get_str(in_queue)
-    contract.primary_exch = get_str(in_queue)
-    contract.contract_month = get_str(in_queue)
-    contract.industry = get_str(in_queue)
-    contract.category = get_str(in_queue)
-    contract.subcategory = get_str(in_queue)
-    contract.time_zone_id = get_str(in_queue)
-    contract.trading_hours = get_str(in_queue)
-    contract.liquid_hours = get_str(in_queue)
-    contract.ev_rule = get_str(in_queue)
-    contract.ev_multiplier = get_float(in_queue)
-    sec_id_list_count = get_int(in_queue)
-    if sec_id_list_count > 0:
-        contract.sec_id_list = []
-        tag_value = TagValue()
-        tag_value.tag = get_str(in_queue)
-        tag_value.value = get_str(in_queue)
-        contract.sec_id_list.append(tag_value)
-    result = ('contract_details', (req_id, contract))
-    out_queue.put(result, block=False)
+    """
 
+    def __init__(self, socket_in_queue):
+        """Initialize a new instance of a FieldBuffer.
+
+        Keyword arguments:
+        socket_in_queue -- queue of field lists
+
+        """
+        self.socket_in_queue = socket_in_queue
+        self.fields = []
+        self.index = 0
+
+    def get(self, timeout=10):
+        """Return the next field, waiting up to 'timeout' seconds for a new
+        chunk if the current one has been exhausted.
+
+        Keyword arguments:
+        timeout -- seconds to wait for a new chunk (default: 10)
+
+        """
+        while self.index >= len(self.fields):
+            self.fields = self.next_chunk(timeout)
+            self.index = 0
+        item = self.fields[self.index]
+        self.index += 1
+        return item
+
+    def take(self, count, timeout=10):
+        """Return a list of the next 'count' fields, waiting up to 'timeout'
+        seconds for each new chunk that is needed.
+
+        Keyword arguments:
+        count   -- number of fields to return
+        timeout -- seconds to wait for a new chunk (default: 10)
+
+        """
+        end = self.index + count
+        result = self.fields[self.index:end]
+        self.index = min(end, len(self.fields))
+        while len(result) < count:
+            self.fields = self.next_chunk(timeout)
+            self.index = min(count - len(result), len(self.fields))
+            result.extend(self.fields[:self.index])
+        return result
+
+    def next_chunk(self, timeout):
+        """Return the next chunk of fields from the socket queue."""
+        return self.socket_in_queue.get(timeout=timeout)
+
+    def skip(self, count, timeout=10):
+        """Move past the next 'count' fields, waiting up to 'timeout'
+        seconds for each new chunk that is needed.
+
+        Keyword arguments:
+        count   -- number of fields to skip
+        timeout -- seconds to wait for a new chunk (default: 10)
+
+        """
+        remaining = self.index + count - len(self.fields)
+        while remaining > 0:
+            self.fields = self.next_chunk(timeout)
+            self.index = 0
+            remaining -= len(self.fields)
+        self.index = len(self.fields) + remaining
+
+
+class TimedFieldBuffer(FieldBuffer):
+    """FieldBuffer that keeps the time the current chunk was read from the
+    socket (received) and taken off the socket queue (taken), in
+    nanoseconds.
 
-def contract_details_end(in_queue, out_queue):
-    get_int(in_queue)      # version
-    req_id = get_int(in_queue)
-    result = ('contract_details_end', (req_id,))
-    out_queue.put(result, block=False)
+    """
 
+    def __init__(self, socket_in_queue):
+        """Initialize a new instance of a TimedFieldBuffer.
 
-def current_time(in_queue, out_queue):
-    get_int(in_queue)     # version
-    seconds = get_int(in_queue)
-    result = ('current_time', (seconds,))
-    out_queue.put(result, block=False)
+        Keyword arguments:
+        socket_in_queue -- queue of ibapipy.core.instrumentation.TimedFields
+
+        """
+        FieldBuffer.__init__(self, socket_in_queue)
+        self.received = 0
+        self.taken = 0
+
+    def next_chunk(self, timeout):
+        """Return the next chunk of fields and note its stamps."""
+        fields = self.socket_in_queue.get(timeout=timeout)
+        self.taken = time.monotonic_ns()
+        self.received = getattr(fields, 'received', self.taken)
+        return fields
+
+
+class FieldList:
+    """Hands out fields from an in-memory list for callers that decode
+    messages in-process rather than through a socket queue.
+
+    Unlike FieldBuffer, get() never waits: Empty is raised as soon as the
+    list runs out, which lets read_messages() rewind to the start of a
+    message that has not been fully received yet.
+
+    """
+
+    def __init__(self):
+        """Initialize a new instance of a FieldList."""
+        self.fields = []
+        self.index = 0
+
+    def extend(self, fields):
+        """Append the specified fields, discarding the ones already read.
+
+        Keyword arguments:
+        fields -- list of fields to append
+
+        """
+        if self.index > 0:
+            del self.fields[:self.index]
+            self.index = 0
+        self.fields.extend(fields)
+
+    def get(self, timeout=None):
+        """Return the next field or raise Empty if there are none left.
+
+        Keyword arguments:
+        timeout -- ignored; present for compatibility with queues
+
+        """
+        if self.index >= len(self.fields):
+            raise Empty
+        item = self.fields[self.index]
+        self.index += 1
+        return item
+
+    def take(self, count, timeout=None):
+        """Return a list of the next 'count' fields or raise Empty if there
+        are not that many left.
+
+        Keyword arguments:
+        count   -- number of fields to return
+        timeout -- ignored; present for compatibility with FieldBuffer
+
+        """
+        end = self.index + count
+        if end > len(self.fields):
+            raise Empty
+        result = self.fields[self.index:end]
+        self.index = end
+        return result
+
+    def skip(self, count, timeout=None):
+        """Move past the next 'count' fields or raise Empty if there are not
+        that many left.
+
+        Keyword arguments:
+        count   -- number of fields to skip
+        timeout -- ignored; present for compatibility with FieldBuffer
+
+        """
+        end = self.index + count
+        if end > len(self.fields):
+            raise Empty
+        self.index = end
+
+
+class MessageList(list):
+    """List that accepts messages through the put() method of a queue."""
+
+    def put(self, item, block=True, timeout=None):
+        """Append the specified message.
+
+        Keyword arguments:
+        item    -- message to append
+        block   -- ignored; present for compatibility with queues
+        timeout -- ignored; present for compatibility with queues
+
+        """
+        self.append(item)
+
+
+class MessageSwitch:
+    """Turns the decoding of skipped messages back on while they are
+    needed, such as while a request is waiting for its responses.
+
+    The flags live in shared memory so that the message listener process
+    sees them change. The number of users of each message is counted in the
+    process that calls enable() and disable(), which must be the same.
+
+    """
+
+    def __init__(self):
+        """Initialize a new instance of a MessageSwitch."""
+        self.flags = RawArray('b', max(MESSAGE_METHODS) + 1)
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def disable(self, methods):
+        """Undo an earlier enable() of the specified callback methods."""
+        with self.lock:
+            for message_id in self.message_ids(methods):
+                self.counts[message_id] -= 1
+                if self.counts[message_id] == 0:
+                    self.flags[message_id] = 0
+
+    def enable(self, methods):
+        """Decode the messages of the specified callback methods until
+        disable() is called with them.
+
+        Keyword arguments:
+        methods -- names of the callback methods
+
+        """
+        with self.lock:
+            for message_id in self.message_ids(methods):
+                self.counts[message_id] = self.counts.get(message_id, 0) + 1
+                self.flags[message_id] = 1
+
+    def message_ids(self, methods):
+        """Return the switchable IDs of the messages translated into any of
+        the specified callback methods.
+
+        """
+        return [message_id for message_id, names in MESSAGE_METHODS.items()
+                if message_id < len(self.flags) and
+                not set(names).isdisjoint(methods)]
+
+
+def get_message_handlers(historical_columns=False, methods=None,
+                         lazy_objects=False, switch_flags=None):
+    """Return a dictionary of message ID to function mappings.
+
+    Keyword arguments:
+    historical_columns -- True to decode historical data into a single
+                          structured NumPy array per message rather than
+                          one message per bar (default: False)
+    methods            -- names of the callback methods that messages are
+                          wanted for; messages that only translate into other
+                          callbacks are read past without being decoded or
+                          emitted (see SKIP_HANDLERS). Errors are always
+                          decoded. None to decode every message (default:
+                          None)
+    lazy_objects       -- True to emit lazy contracts, orders and executions
+                          that convert their raw fields on first access (see
+                          LAZY_HANDLERS) (default: False)
+    switch_flags       -- flags of a MessageSwitch that turns the decoding of
+                          skipped messages back on (default: None)
+
+    The handlers include generated code that cannot be pickled, so a process
+    that decodes messages builds its own from these (picklable) arguments.
+
+    """
+    message_handlers = dict(MESSAGE_HANDLERS)
+    if lazy_objects:
+        message_handlers.update(LAZY_HANDLERS)
+    if historical_columns:
+        if np is None:
+            raise IBAPIPyError('NumPy is required for historical columns.')
+        message_handlers[config.HISTORICAL_DATA] = historical_data_columns
+    if methods is not None:
+        methods = set(methods)
+        for message_id, skip in SKIP_HANDLERS.items():
+            if not methods.isdisjoint(MESSAGE_METHODS[message_id]):
+                continue
+            if switch_flags is None:
+                message_handlers[message_id] = skip
+            else:
+                message_handlers[message_id] = switch_handler(
+                    message_handlers[message_id], skip, switch_flags,
+                    message_id)
+    return message_handlers
+
+
+def switch_handler(decode, skip, flags, message_id):
+    """Return a handler that decodes the message while its flag is set and
+    skips it otherwise.
+
+    Keyword arguments:
+    decode     -- handler that decodes the message
+    skip       -- handler that reads past the message
+    flags      -- MessageSwitch.flags
+    message_id -- incoming message ID
+
+    """
+    def handle(in_queue, out_queue):
+        if flags[message_id]:
+            decode(in_queue, out_queue)
+        else:
+            skip(in_queue, out_queue)
+    handle.__name__ = 'switch_' + decode.__name__
+    return handle
+
+
+def message_listener(socket_in_queue, message_queue, message_handlers=None,
+                     instrumented=False):
+    if message_handlers is None:
+        message_handlers = MESSAGE_HANDLERS
+    if instrumented:
+        in_queue = TimedFieldBuffer(socket_in_queue)
+        message_queue = instrumentation.StampingQueue(message_queue, in_queue)
+    else:
+        in_queue = FieldBuffer(socket_in_queue)
+    while True:
+        try:
+            message_id = get_int(in_queue)
+        except Empty:
+            continue
+        if message_id in message_handlers:
+            message_handlers[message_id](in_queue, message_queue)
+        elif message_id < 0:
+            return
+        else:
+            raise IBAPIPyError('Unsupported message ID: {0}'.format(message_id))
+
+
+def read_messages(fields, messages, message_handlers=None):
+    """Decode every complete message available in 'fields' and append the
+    results to 'messages'.
+
+    Decoding stops at the first message that has not been fully received; the
+    fields for that message are left in place so that decoding can resume
+    once more data has been added to 'fields'.
+
+    Keyword arguments:
+    fields           -- FieldList to decode
+    messages         -- list that receives ('method name', (parm1, ...))
+                        tuples
+    message_handlers -- message ID to function mappings (default:
+                        MESSAGE_HANDLERS)
+
+    """
+    if message_handlers is None:
+        message_handlers = MESSAGE_HANDLERS
+    while True:
+        start = fields.index
+        results = MessageList()
+        try:
+            message_id = get_int(fields)
+            if message_id not in message_handlers:
+                msg = 'Unsupported message ID: {0}'.format(message_id)
+                raise IBAPIPyError(msg)
+            message_handlers[message_id](fields, results)
+        except Empty:
+            fields.index = start
+            return
+        messages.extend(results)
 
 
 def error(in_queue, out_queue):
@@ -209,205 +455,117 @@ def error(in_queue, out_queue):
         message = get_str(in_queue)
         result = ('error', (0, 0, message))
     else:
-        req_id = get_int(in_queue)
-        code = get_int(in_queue)
-        message = get_str(in_queue)
+        req_id, code, message = ERROR_FIELDS(in_queue)
         result = ('error', (req_id, code, message))
     out_queue.put(result, block=False)
 
 
-def exec_details(in_queue, out_queue):
-    version = get_int(in_queue)
-    if version < 9:
-        raise IBAPIPyError(VERSION_ERROR.format(version, 9))
-    req_id = get_int(in_queue)
-    order_id = get_int(in_queue)
-    # Contract fields
-    contract = Contract()
-    contract.con_id = get_int(in_queue)
-    contract.symbol = get_str(in_queue)
-    contract.sec_type = get_str(in_queue)
-    contract.expiry = get_str(in_queue)
-    contract.strike = get_float(in_queue)
-    contract.right = get_str(in_queue)
-    contract.multiplier = get_str(in_queue)
-    contract.exchange = get_str(in_queue)
-    contract.currency = get_str(in_queue)
-    contract.local_symbol = get_str(in_queue)
-    # Execution fields
-    execution = Execution()
-    execution.order_id = order_id
-    execution.exec_id = get_str(in_queue)
-    execution.time = get_str(in_queue)
-    # Milliseconds is not part of the standard IB Execution, but we add it here
-    execution.milliseconds = _str_to_ms(execution.time, timezone='UTC',
-                                        formatting='%Y%m%d  %H:%M:%S')
-    execution.acct_number = get_str(in_queue)
-    execution.exchange = get_str(in_queue)
-    execution.side = get_str(in_queue)
-    execution.shares = get_int(in_queue)
-    execution.price = get_float(in_queue)
-    execution.perm_id = get_int(in_queue)
-    execution.client_id = get_int(in_queue)
-    execution.liquidation = get_int(in_queue)
-    execution.cum_qty = get_int(in_queue)
-    execution.avg_price = get_float(in_queue)
-    execution.order_ref = get_str(in_queue)
-    execution.ev_rule = get_str(in_queue)
-    execution.ev_multiplier = get_float(in_queue)
-    result = ('exec_details', (req_id, contract, execution))
-    out_queue.put(result, block=False)
-
-
-def exec_details_end(in_queue, out_queue):
-    get_int(in_queue)      # version
-    req_id = get_int(in_queue)
-    result = ('exec_details_end', (req_id,))
-    out_queue.put(result, block=False)
+def historical_data(in_queue, out_queue):
+    """Decode a historical data message into one historical_data message per
+    bar followed by the 'finished-...' sentinel.
 
+    Bar dates are passed on as received: the callback has no parameter for
+    the milliseconds column of historical_data_columns(), so convert them
+    with timestamps.ib_time_to_ms(date, config.TIMEZONE) where needed.
 
-def historical_data(in_queue, out_queue):
-    version = get_int(in_queue)
+    """
+    version, req_id, start_date, end_date, item_count = \
+        HISTORICAL_DATA_FIELDS(in_queue)
     if version < 3:
         raise IBAPIPyError(VERSION_ERROR.format(version, 3))
-    req_id = get_int(in_queue)
-    start_date = get_str(in_queue)
-    end_date = get_str(in_queue)
     completed_indicator = 'finished-{0}-{1}'.format(start_date, end_date)
-    item_count = get_int(in_queue)
-    for index in range(item_count):
-        date = get_str(in_queue)
-        open = get_float(in_queue)
-        high = get_float(in_queue)
-        low = get_float(in_queue)
-        close = get_float(in_queue)
-        volume = get_int(in_queue)
-        wap = get_float(in_queue)
-        has_gaps = get_str(in_queue)
-        has_gaps = True if has_gaps == 'true' else 'false'
-        bar_count = get_int(in_queue)
-        result = ('historical_data', (req_id, date, open, high, low, close,
-                                      volume, bar_count, wap, has_gaps))
-        out_queue.put(result, block=False)
+    fields = get_fields(in_queue, item_count * 9)
+    put = out_queue.put
+    for index in range(0, item_count * 9, 9):
+        date, open, high, low, close, volume, wap, has_gaps, bar_count = \
+            fields[index:index + 9]
+        has_gaps = True if has_gaps.lower() == 'true' else 'false'
+        result = ('historical_data', (req_id, date.lower(),
+                                      float(open) if open else 0,
+                                      float(high) if high else 0,
+                                      float(low) if low else 0,
+                                      float(close) if close else 0,
+                                      int(volume) if volume else 0,
+                                      int(bar_count) if bar_count else 0,
+                                      float(wap) if wap else 0, has_gaps))
+        put(result, block=False)
     result = ('historical_data', (req_id, completed_indicator, -1, -1, -1, -1,
                                   -1, -1, -1, False))
     out_queue.put(result, block=False)
 
 
-def managed_accounts(in_queue, out_queue):
-    get_int(in_queue)     # version
-    accounts = get_str(in_queue)
-    result = ('managed_accounts', (accounts,))
-    out_queue.put(result, block=False)
+def historical_data_columns(in_queue, out_queue):
+    """Decode a historical data message into a single structured NumPy array
+    with one row per bar (see HISTORICAL_DATA_DTYPE) and emit it as one
+    historical_data_columns message.
 
+    The milliseconds column holds each bar date converted to milliseconds
+    since the Epoch, taking dates without a time zone to be in
+    config.TIMEZONE.
 
-def next_valid_id(in_queue, out_queue):
-    get_int(in_queue)     # version
-    req_id = get_int(in_queue)
-    result = ('next_valid_id', (req_id,))
+    """
+    version, req_id, start_date, end_date, item_count = \
+        HISTORICAL_DATA_FIELDS(in_queue)
+    if version < 3:
+        raise IBAPIPyError(VERSION_ERROR.format(version, 3))
+    fields = get_fields(in_queue, item_count * 9)
+    bars = np.empty(item_count, dtype=HISTORICAL_DATA_DTYPE)
+    bars['date'] = fields[0::9]
+    bars['milliseconds'] = timestamps.bar_dates_to_ms(bars['date'],
+                                                      config.TIMEZONE)
+    bars['open'] = fields[1::9]
+    bars['high'] = fields[2::9]
+    bars['low'] = fields[3::9]
+    bars['close'] = fields[4::9]
+    bars['volume'] = fields[5::9]
+    bars['wap'] = fields[6::9]
+    has_gaps = np.array(fields[7::9], dtype=str)
+    bars['has_gaps'] = np.char.lower(has_gaps) == 'true'
+    bars['bar_count'] = fields[8::9]
+    result = ('historical_data_columns', (req_id, start_date, end_date, bars))
     out_queue.put(result, block=False)
 
 
 def open_order(in_queue, out_queue):
-    version = get_int(in_queue)
-    if version < 31:
-        raise IBAPIPyError(VERSION_ERROR.format(version, 31))
-    # Order ID
     order = Order()
-    order.order_id = get_int(in_queue)
-    # Contract fields
     contract = Contract()
-    contract.con_id = get_int(in_queue)
-    contract.symbol = get_str(in_queue)
-    contract.sec_type = get_str(in_queue)
-    contract.expiry = get_str(in_queue)
-    contract.strike = get_float(in_queue)
-    contract.right = get_str(in_queue)
-    contract.exchange = get_str(in_queue)
-    contract.currency = get_str(in_queue)
-    contract.local_symbol = get_str(in_queue)
-    # Order fields
-    order.action = get_str(in_queue)
-    order.total_quantity = get_int(in_queue)
-    order.order_type = get_str(in_queue)
-    order.lmt_price = get_float(in_queue)
-    order.aux_price = get_float(in_queue)
-    order.tif = get_str(in_queue)
-    order.oca_group = get_str(in_queue)
-    order.account = get_str(in_queue)
-    order.open_close = get_str(in_queue)
-    order.origin = get_int(in_queue)
-    order.order_ref = get_str(in_queue)
-    order.client_id = get_int(in_queue)
-    order.perm_id = get_int(in_queue)
-    order.outside_rth = get_bool(in_queue)
-    order.hidden = get_bool(in_queue)
-    order.discretionary_amt = get_float(in_queue)
-    order.good_after_time = get_str(in_queue)
-    get_str(in_queue)     # deprecated shares_allocation field
-    order.fa_group = get_str(in_queue)
-    order.fa_method = get_str(in_queue)
-    order.fa_percentage = get_str(in_queue)
-    order.fa_profile = get_str(in_queue)
-    order.good_till_date = get_str(in_queue)
-    order.rule_80a = get_str(in_queue)
-    order.percent_offset = get_float(in_queue)
-    order.settling_firm = get_str(in_queue)
-    order.short_sale_slot = get_int(in_queue)
-    order.designated_location = get_str(in_queue)
-    order.exempt_code = get_int(in_queue)
-    order.auction_strategy = get_int(in_queue)
-    order.starting_price = get_float(in_queue)
-    order.stock_ref_price = get_float(in_queue)
-    order.delta = get_float(in_queue)
-    order.stock_range_lower = get_float(in_queue)
-    order.stock_range_upper = get_float(in_queue)
-    order.display_size = get_int(in_queue)
-    order.block_order = get_bool(in_queue)
-    order.sweep_to_fill = get_bool(in_queue)
-    order.all_or_none = get_bool(in_queue)
-    order.min_qty = get_int(in_queue)
-    order.oca_type = get_int(in_queue)
-    order.etrade_only = get_bool(in_queue)
-    order.firm_quote_only = get_bool(in_queue)
-    order.nbbo_price_cap = get_float(in_queue)
-    order.parent_id = get_int(in_queue)
-    order.trigger_method = get_int(in_queue)
-    order.volatility = get_float(in_queue)
-    order.volatility_type = get_int(in_queue)
-    order.delta_neutral_order_type = get_str(in_queue)
-    order.delta_neutral_aux_price = get_float(in_queue)
+    version, = OPEN_ORDER_FIELDS(in_queue, order, contract)
+    if version < 31:
+        raise IBAPIPyError(VERSION_ERROR.format(version, 31))
+    read_open_order_tail(in_queue, order, contract)
+    result = ('open_order', (order.order_id, contract, order))
+    out_queue.put(result, block=False)
+
+
+def open_order_lazy(in_queue, out_queue):
+    """Decode an open order message into a LazyContract and a LazyOrder
+    backed by the fields of the fixed part of the message. The optional
+    parts that follow are decoded as usual.
+
+    """
+    fields = get_fields(in_queue, OPEN_ORDER_FIELDS.field_count)
+    version = int(fields[0]) if fields[0] else 0
+    if version < 31:
+        raise IBAPIPyError(VERSION_ERROR.format(version, 31))
+    order = LazyOrder('open_order.order', fields)
+    contract = LazyContract('open_order.contract', fields)
+    read_open_order_tail(in_queue, order, contract)
+    result = ('open_order', (order.order_id, contract, order))
+    out_queue.put(result, block=False)
+
+
+def read_open_order_tail(in_queue, order, contract):
+    """Read the part of an open order message that follows the fields in
+    OPEN_ORDER_FIELDS into the order and contract.
+
+    """
     if len(order.delta_neutral_order_type) > 0:
-        order.delta_neutral_con_id = get_int(in_queue)
-        order.delta_neutral_settling_firm = get_str(in_queue)
-        order.delta_neutral_clearing_account = get_str(in_queue)
-        order.delta_neutral_clearing_intent = get_str(in_queue)
-        order.delta_neutral_open_close = get_str(in_queue)
-        order.delta_neutral_short_sale = get_bool(in_queue)
-        order.delta_neutral_short_sale_slot = get_int(in_queue)
-        order.delta_neutral_designation_location = get_str(in_queue)
-    order.continuous_update = get_int(in_queue)
-    order.reference_price_type = get_int(in_queue)
-    order.trail_stop_price = get_float(in_queue, True)
-    order.trailing_percent = get_float(in_queue, True)
-    order.basis_points = get_float(in_queue)
-    order.basis_points_type = get_int(in_queue)
-    contract.combo_legs_descrip = get_str(in_queue)
-    combo_legs_count = get_int(in_queue)
+        OPEN_ORDER_DELTA_NEUTRAL_FIELDS(in_queue, order)
+    combo_legs_count, = OPEN_ORDER_MIDDLE_FIELDS(in_queue, order, contract)
     if combo_legs_count > 0:
         contract.combo_legs = []
         for index in range(combo_legs_count):
-            con_id = get_int(in_queue)
-            ratio = get_int(in_queue)
-            action = get_str(in_queue)
-            exchange = get_str(in_queue)
-            open_close = get_int(in_queue)
-            short_sale_slot = get_int(in_queue)
-            designated_location = get_str(in_queue)
-            exempt_code = get_int(in_queue)
-            combo_leg = ComboLeg(con_id, ratio, action, exchange, open_close,
-                                 short_sale_slot, designated_location,
-                                 exempt_code)
+            combo_leg = ComboLeg(*COMBO_LEG_FIELDS(in_queue))
             contract.combo_legs.append(combo_leg)
     order_combo_legs_count = get_int(in_queue)
     if order_combo_legs_count > 0:
@@ -418,135 +576,35 @@ def open_order(in_queue, out_queue):
             order.order_combo_legs.append(order_combo_leg)
     smart_params_count = get_int(in_queue)
     if smart_params_count > 0:
-        order.smart_combo_routing_params = []
-        for index in range(0, smart_params_count):
-            tag_value = TagValue()
-            tag_value.tag = get_str(in_queue)
-            tag_value.value = get_str(in_queue)
-            order.smart_combo_routing_params.append(tag_value)
-    order.scale_init_level_size = get_int(in_queue, True)
-    order.scale_subs_level_size = get_int(in_queue, True)
-    order.scale_price_increment = get_float(in_queue, True)
+        order.smart_combo_routing_params = get_tag_values(in_queue,
+                                                          smart_params_count)
+    OPEN_ORDER_SCALE_FIELDS(in_queue, order)
     if order.scale_price_increment > 0 and \
             order.scale_price_increment < config.JAVA_DOUBLE_MAX:
-        order.scale_price_adjust_value = get_float(in_queue, True)
-        order.scale_price_adjust_interval = get_int(in_queue, True)
-        order.scale_profit_offset = get_float(in_queue, True)
-        order.scale_auto_reset = get_bool(in_queue)
-        order.scale_init_position = get_int(in_queue, True)
-        order.scale_init_fill_qty = get_int(in_queue, True)
-        order.scale_random_percent = get_bool(in_queue)
+        OPEN_ORDER_SCALE_PRICE_FIELDS(in_queue, order)
     order.hedge_type = get_str(in_queue)
     if len(order.hedge_type) > 0:
         order.hedge_param = get_str(in_queue)
-    order.opt_out_smart_routing = get_bool(in_queue)
-    order.clearing_account = get_str(in_queue)
-    order.clearing_intent = get_str(in_queue)
-    order.not_held = get_bool(in_queue)
-    if get_bool(in_queue):
+    has_under_comp, = OPEN_ORDER_CLEARING_FIELDS(in_queue, order)
+    if has_under_comp:
         under_comp = UnderComp()
-        under_comp.con_id = get_int(in_queue)
-        under_comp.delta = get_float(in_queue)
-        under_comp.price = get_float(in_queue)
+        UNDER_COMP_FIELDS(in_queue, under_comp)
         contract.under_comp = under_comp
     order.algo_strategy = get_str(in_queue)
     if len(order.algo_strategy) > 0:
         algo_params_count = get_int(in_queue)
         if algo_params_count > 0:
-            order.algo_params = []
-            for index in range(0, algo_params_count):
-                tag_value = TagValue()
-                tag_value.tag = get_str(in_queue)
-                tag_value.value = get_str(in_queue)
-                order.algo_params.append(tag_value)
-    order.what_if = get_bool(in_queue)
+            order.algo_params = get_tag_values(in_queue, algo_params_count)
     # Order state
-    order.status = get_str(in_queue)
-    order.init_margin = get_str(in_queue)
-    order.maint_margin = get_str(in_queue)
-    order.equity_with_loan = get_str(in_queue)
-    order.commission = get_float(in_queue, True)
-    order.min_commission = get_float(in_queue, True)
-    order.max_commission = get_float(in_queue, True)
-    order.commission_currency = get_str(in_queue)
-    order.warning_text = get_str(in_queue)
-    result = ('open_order', (order.order_id, contract, order))
-    out_queue.put(result, block=False)
-
-
-def open_order_end(in_queue, out_queue):
-    get_int(in_queue)       # version
-    result = ('open_order_end', ())
-    out_queue.put(result, block=False)
-
-
-def order_status(in_queue, out_queue):
-    version = get_int(in_queue)
-    if version < 6:
-        raise IBAPIPyError(VERSION_ERROR.format(version, 6))
-    req_id = get_int(in_queue)
-    status = get_str(in_queue)
-    filled = get_int(in_queue)
-    remaining = get_int(in_queue)
-    avg_fill_price = get_float(in_queue)
-    perm_id = get_int(in_queue)
-    parent_id = get_int(in_queue)
-    last_fill_price = get_float(in_queue)
-    client_id = get_int(in_queue)
-    why_held = get_str(in_queue)
-    result = ('order_status', (req_id, status, filled, remaining,
-                               avg_fill_price, perm_id, parent_id,
-                               last_fill_price, client_id, why_held))
-    out_queue.put(result, block=False)
-
-
-def portfolio_value(in_queue, out_queue):
-    version = get_int(in_queue)
-    if version < 7:
-        raise IBAPIPyError(VERSION_ERROR.format(version, 7))
-    contract = Contract()
-    contract.con_id = get_int(in_queue)
-    contract.symbol = get_str(in_queue)
-    contract.sec_type = get_str(in_queue)
-    contract.expiry = get_str(in_queue)
-    contract.strike = get_float(in_queue)
-    contract.right = get_str(in_queue)
-    contract.multiplier = get_str(in_queue)
-    contract.primary_exch = get_str(in_queue)
-    contract.currency = get_str(in_queue)
-    contract.local_symbol = get_str(in_queue)
-    position = get_int(in_queue)
-    market_price = get_float(in_queue)
-    market_value = get_float(in_queue)
-    average_cost = get_float(in_queue)
-    unrealized_pnl = get_float(in_queue)
-    realized_pnl = get_float(in_queue)
-    account_name = get_str(in_queue)
-    result = ('update_portfolio', (contract, position, market_price,
-                                   market_value, average_cost, unrealized_pnl,
-                                   realized_pnl, account_name))
-    out_queue.put(result, block=False)
-
-
-def tick_generic(in_queue, out_queue):
-    get_int(in_queue)      # version
-    req_id = get_int(in_queue)
-    tick_type = get_int(in_queue)
-    value = get_float(in_queue)
-    result = ('tick_generic', (req_id, tick_type, value))
-    out_queue.put(result, block=False)
+    OPEN_ORDER_STATE_FIELDS(in_queue, order)
 
 
 def tick_price(in_queue, out_queue):
     # Tick price
-    version = get_int(in_queue)
+    version, req_id, tick_type, price, size, can_auto_execute = \
+        TICK_PRICE_FIELDS(in_queue)
     if version < 3:
         raise IBAPIPyError(VERSION_ERROR.format(version, 3))
-    req_id = get_int(in_queue)
-    tick_type = get_int(in_queue)
-    price = get_float(in_queue)
-    size = get_int(in_queue)
-    can_auto_execute = get_int(in_queue)
     result = ('tick_price', (req_id, tick_type, price, can_auto_execute))
     out_queue.put(result, block=False)
     # Tick size
@@ -562,19 +620,396 @@ def tick_price(in_queue, out_queue):
         out_queue.put(result, block=False)
 
 
-def tick_size(in_queue, out_queue):
-    get_int(in_queue)     # version
-    req_id = get_int(in_queue)
-    tick_type = get_int(in_queue)
-    size = get_int(in_queue)
-    result = ('tick_size', (req_id, tick_type, size))
-    out_queue.put(result, block=False)
+def skip_historical_data(in_queue, out_queue):
+    """Read past a historical data message, only converting its bar
+    count.
+
+    """
+    item_count = get_fields(in_queue, HISTORICAL_DATA_FIELDS.field_count)[-1]
+    skip_fields(in_queue, int(item_count) * 9 if item_count else 0)
 
 
-def tick_string(in_queue, out_queue):
-    get_int(in_queue)     # version
-    req_id = get_int(in_queue)
-    tick_type = get_int(in_queue)
-    value = get_str(in_queue)
-    result = ('tick_string', (req_id, tick_type, value))
-    out_queue.put(result, block=False)
+def skip_open_order(in_queue, out_queue):
+    """Read past an open order message, only looking at the fields that
+    determine which optional parts of it are present.
+
+    """
+    fields = get_fields(in_queue, OPEN_ORDER_FIELDS.field_count)
+    # Delta neutral order type
+    if len(fields[-2]) > 0:
+        skip_fields(in_queue, OPEN_ORDER_DELTA_NEUTRAL_FIELDS.field_count)
+    combo_legs_count = get_fields(in_queue,
+                                  OPEN_ORDER_MIDDLE_FIELDS.field_count)[-1]
+    if combo_legs_count:
+        skip_fields(in_queue,
+                    int(combo_legs_count) * COMBO_LEG_FIELDS.field_count)
+    # Order combo legs and smart combo routing parameters
+    skip_fields(in_queue, get_int(in_queue))
+    skip_fields(in_queue, get_int(in_queue) * 2)
+    scale_price_increment = get_fields(
+        in_queue, OPEN_ORDER_SCALE_FIELDS.field_count)[-1]
+    if scale_price_increment and \
+            0 < float(scale_price_increment) < config.JAVA_DOUBLE_MAX:
+        skip_fields(in_queue, OPEN_ORDER_SCALE_PRICE_FIELDS.field_count)
+    # Hedge type and parameter
+    if len(in_queue.get(timeout=10)) > 0:
+        skip_fields(in_queue, 1)
+    has_under_comp = get_fields(in_queue,
+                                OPEN_ORDER_CLEARING_FIELDS.field_count)[-1]
+    if has_under_comp and int(has_under_comp) != 0:
+        skip_fields(in_queue, UNDER_COMP_FIELDS.field_count)
+    # Algo strategy and parameters
+    if len(in_queue.get(timeout=10)) > 0:
+        skip_fields(in_queue, get_int(in_queue) * 2)
+    skip_fields(in_queue, OPEN_ORDER_STATE_FIELDS.field_count)
+
+
+def skip_sec_id_list(in_queue):
+    """Read past the security ID list at the end of a contract details
+    message.
+
+    """
+    skip_fields(in_queue, get_int(in_queue) * 2)
+
+
+def get_tag_values(in_queue, count):
+    """Read 'count' tag/value pairs and return them as a list of TagValue
+    objects.
+
+    """
+    fields = get_fields(in_queue, count * 2)
+    return [TagValue(fields[index].lower(), fields[index + 1].lower())
+            for index in range(0, count * 2, 2)]
+
+
+def read_sec_id_list(in_queue, req_id, contract):
+    """Read the security ID list at the end of a contract details message."""
+    sec_id_list_count = get_int(in_queue)
+    if sec_id_list_count > 0:
+        contract.sec_id_list = get_tag_values(in_queue, sec_id_list_count)
+
+
+def set_execution_milliseconds(in_queue, req_id, contract, execution):
+    """Fill in the milliseconds attribute of an execution from its time."""
+    # Milliseconds is not part of the standard IB Execution, but we add it here
+    execution.milliseconds = timestamps.ib_time_to_ms(execution.time)
+
+
+def register_schema(message_id, schema):
+    """Add or replace the schema for the specified message ID and compile its
+    decoder into MESSAGE_HANDLERS.
+
+    Keyword arguments:
+    message_id -- incoming message ID
+    schema     -- ibapipy.core.message_schema.MessageSchema object
+
+    """
+    SCHEMAS[message_id] = schema
+    MESSAGE_HANDLERS[message_id] = schema.compile()
+    MESSAGE_METHODS[message_id] = (schema.method,)
+    SKIP_HANDLERS[message_id] = schema.compile_skip()
+    LAZY_HANDLERS.pop(message_id, None)
+    if any(len(item) > 2 for item in schema.objects):
+        LAZY_HANDLERS[message_id] = schema.compile(lazy=True)
+
+
+# *****************************************************************************
+# FIELD GROUPS USED BY THE HAND-WRITTEN HANDLERS
+# *****************************************************************************
+
+COMBO_LEG_FIELDS = compile_group((
+    ('con_id', INT), ('ratio', INT), ('action', STR), ('exchange', STR),
+    ('open_close', INT), ('short_sale_slot', INT),
+    ('designated_location', STR), ('exempt_code', INT)))
+
+ERROR_FIELDS = compile_group((('req_id', INT), ('code', INT),
+                              ('message', STR)))
+
+HISTORICAL_DATA_FIELDS = compile_group((
+    ('version', INT), ('req_id', INT), ('start_date', STR),
+    ('end_date', STR), ('item_count', INT)))
+
+OPEN_ORDER_FIELDS = compile_group((
+    ('version', INT),
+    # Order ID
+    ('order.order_id', INT),
+    # Contract fields
+    ('contract.con_id', INT), ('contract.symbol', STR),
+    ('contract.sec_type', STR), ('contract.expiry', STR),
+    ('contract.strike', FLOAT), ('contract.right', STR),
+    ('contract.exchange', STR), ('contract.currency', STR),
+    ('contract.local_symbol', STR),
+    # Order fields
+    ('order.action', STR), ('order.total_quantity', INT),
+    ('order.order_type', STR), ('order.lmt_price', FLOAT),
+    ('order.aux_price', FLOAT), ('order.tif', STR),
+    ('order.oca_group', STR), ('order.account', STR),
+    ('order.open_close', STR), ('order.origin', INT),
+    ('order.order_ref', STR), ('order.client_id', INT),
+    ('order.perm_id', INT), ('order.outside_rth', BOOL),
+    ('order.hidden', BOOL), ('order.discretionary_amt', FLOAT),
+    ('order.good_after_time', STR),
+    (None, STR),       # deprecated shares_allocation field
+    ('order.fa_group', STR), ('order.fa_method', STR),
+    ('order.fa_percentage', STR), ('order.fa_profile', STR),
+    ('order.good_till_date', STR), ('order.rule_80a', STR),
+    ('order.percent_offset', FLOAT), ('order.settling_firm', STR),
+    ('order.short_sale_slot', INT), ('order.designated_location', STR),
+    ('order.exempt_code', INT), ('order.auction_strategy', INT),
+    ('order.starting_price', FLOAT), ('order.stock_ref_price', FLOAT),
+    ('order.delta', FLOAT), ('order.stock_range_lower', FLOAT),
+    ('order.stock_range_upper', FLOAT), ('order.display_size', INT),
+    ('order.block_order', BOOL), ('order.sweep_to_fill', BOOL),
+    ('order.all_or_none', BOOL), ('order.min_qty', INT),
+    ('order.oca_type', INT), ('order.etrade_only', BOOL),
+    ('order.firm_quote_only', BOOL), ('order.nbbo_price_cap', FLOAT),
+    ('order.parent_id', INT), ('order.trigger_method', INT),
+    ('order.volatility', FLOAT), ('order.volatility_type', INT),
+    ('order.delta_neutral_order_type', STR),
+    ('order.delta_neutral_aux_price', FLOAT)), ('order', 'contract'))
+
+OPEN_ORDER_DELTA_NEUTRAL_FIELDS = compile_group((
+    ('order.delta_neutral_con_id', INT),
+    ('order.delta_neutral_settling_firm', STR),
+    ('order.delta_neutral_clearing_account', STR),
+    ('order.delta_neutral_clearing_intent', STR),
+    ('order.delta_neutral_open_close', STR),
+    ('order.delta_neutral_short_sale', BOOL),
+    ('order.delta_neutral_short_sale_slot', INT),
+    ('order.delta_neutral_designation_location', STR)), ('order',))
+
+OPEN_ORDER_MIDDLE_FIELDS = compile_group((
+    ('order.continuous_update', INT), ('order.reference_price_type', INT),
+    ('order.trail_stop_price', FLOAT_MAX),
+    ('order.trailing_percent', FLOAT_MAX), ('order.basis_points', FLOAT),
+    ('order.basis_points_type', INT), ('contract.combo_legs_descrip', STR),
+    ('combo_legs_count', INT)), ('order', 'contract'))
+
+OPEN_ORDER_SCALE_FIELDS = compile_group((
+    ('order.scale_init_level_size', INT_MAX),
+    ('order.scale_subs_level_size', INT_MAX),
+    ('order.scale_price_increment', FLOAT_MAX)), ('order',))
+
+OPEN_ORDER_SCALE_PRICE_FIELDS = compile_group((
+    ('order.scale_price_adjust_value', FLOAT_MAX),
+    ('order.scale_price_adjust_interval', INT_MAX),
+    ('order.scale_profit_offset', FLOAT_MAX),
+    ('order.scale_auto_reset', BOOL),
+    ('order.scale_init_position', INT_MAX),
+    ('order.scale_init_fill_qty', INT_MAX),
+    ('order.scale_random_percent', BOOL)), ('order',))
+
+OPEN_ORDER_CLEARING_FIELDS = compile_group((
+    ('order.opt_out_smart_routing', BOOL), ('order.clearing_account', STR),
+    ('order.clearing_intent', STR), ('order.not_held', BOOL),
+    ('has_under_comp', BOOL)), ('order',))
+
+OPEN_ORDER_STATE_FIELDS = compile_group((
+    ('order.what_if', BOOL),
+    # Order state
+    ('order.status', STR), ('order.init_margin', STR),
+    ('order.maint_margin', STR), ('order.equity_with_loan', STR),
+    ('order.commission', FLOAT_MAX), ('order.min_commission', FLOAT_MAX),
+    ('order.max_commission', FLOAT_MAX), ('order.commission_currency', STR),
+    ('order.warning_text', STR)), ('order',))
+
+TICK_PRICE_FIELDS = compile_group((
+    ('version', INT), ('req_id', INT), ('tick_type', INT), ('price', FLOAT),
+    ('size', INT), ('can_auto_execute', INT)))
+
+UNDER_COMP_FIELDS = compile_group((
+    ('under_comp.con_id', INT), ('under_comp.delta', FLOAT),
+    ('under_comp.price', FLOAT)), ('under_comp',))
+
+
+# *****************************************************************************
+# MESSAGE SCHEMAS
+# *****************************************************************************
+
+# Message ID to schema mappings for all messages with a fixed layout
+SCHEMAS = {
+    config.ACCT_DOWNLOAD_END: MessageSchema(
+        'account_download_end',
+        ((None, INT), ('account_name', STR)),
+        ('account_name',)),
+    config.ACCT_UPDATE_TIME: MessageSchema(
+        'update_account_time',
+        ((None, INT), ('timestamp', STR)),
+        ('timestamp',)),
+    config.ACCT_VALUE: MessageSchema(
+        'update_account_value',
+        ((None, INT), ('key', STR), ('value', STR), ('currency', STR),
+         ('account_name', STR)),
+        ('key', 'value', 'currency', 'account_name')),
+    config.COMMISSION_REPORT: MessageSchema(
+        'commission_report',
+        ((None, INT), ('report.exec_id', STR), ('report.commission', FLOAT),
+         ('report.currency', STR), ('report.realized_pnl', FLOAT),
+         ('report.yield_value', FLOAT),
+         ('report.yield_redemption_date', INT)),
+        ('report',), objects=(('report', CommissionReport),)),
+    config.CONTRACT_DATA: MessageSchema(
+        'contract_details',
+        (('version', INT), ('req_id', INT), ('contract.symbol', STR),
+         ('contract.sec_type', STR), ('contract.expiry', STR),
+         ('contract.strike', FLOAT), ('contract.right', STR),
+         ('contract.exchange', STR), ('contract.currency', STR),
+         ('contract.local_symbol', STR), ('contract.market_name', STR),
+         ('contract.trading_class', STR), ('contract.con_id', INT),
+         ('contract.min_tick', FLOAT), ('contract.multiplier', STR),
+         ('contract.order_types', STR), ('contract.valid_exchanges', STR),
+         ('contract.price_magnifier', INT), ('contract.under_con_id', INT),
+         ('contract.long_name', STR), ('contract.primary_exch', STR),
+         ('contract.contract_month', STR), ('contract.industry', STR),
+         ('contract.category', STR), ('contract.subcategory', STR),
+         ('contract.time_zone_id', STR), ('contract.trading_hours', STR),
+         ('contract.liquid_hours', STR), ('contract.ev_rule', STR),
+         ('contract.ev_multiplier', FLOAT)),
+        ('req_id', 'contract'), min_version=8,
+        objects=(('contract', Contract, LazyContract),),
+        finish=read_sec_id_list,
+        skip_finish=skip_sec_id_list),
+    config.CONTRACT_DATA_END: MessageSchema(
+        'contract_details_end',
+        ((None, INT), ('req_id', INT)),
+        ('req_id',)),
+    config.CURRENT_TIME: MessageSchema(
+        'current_time',
+        ((None, INT), ('seconds', INT)),
+        ('seconds',)),
+    config.EXECUTION_DATA: MessageSchema(
+        'exec_details',
+        (('version', INT), ('req_id', INT), ('execution.order_id', INT),
+         # Contract fields
+         ('contract.con_id', INT), ('contract.symbol', STR),
+         ('contract.sec_type', STR), ('contract.expiry', STR),
+         ('contract.strike', FLOAT), ('contract.right', STR),
+         ('contract.multiplier', STR), ('contract.exchange', STR),
+         ('contract.currency', STR), ('contract.local_symbol', STR),
+         # Execution fields
+         ('execution.exec_id', STR), ('execution.time', STR),
+         ('execution.acct_number', STR), ('execution.exchange', STR),
+         ('execution.side', STR), ('execution.shares', INT),
+         ('execution.price', FLOAT), ('execution.perm_id', INT),
+         ('execution.client_id', INT), ('execution.liquidation', INT),
+         ('execution.cum_qty', INT), ('execution.avg_price', FLOAT),
+         ('execution.order_ref', STR), ('execution.ev_rule', STR),
+         ('execution.ev_multiplier', FLOAT)),
+        ('req_id', 'contract', 'execution'), min_version=9,
+        objects=(('contract', Contract, LazyContract),
+                 ('execution', Execution, LazyExecution)),
+        finish=set_execution_milliseconds),
+    config.EXECUTION_DATA_END: MessageSchema(
+        'exec_details_end',
+        ((None, INT), ('req_id', INT)),
+        ('req_id',)),
+    config.MANAGED_ACCTS: MessageSchema(
+        'managed_accounts',
+        ((None, INT), ('accounts', STR)),
+        ('accounts',)),
+    config.MARKET_DEPTH: MessageSchema(
+        'update_mkt_depth',
+        ((None, INT), ('req_id', INT), ('position', INT),
+         ('operation', INT), ('side', INT), ('price', FLOAT), ('size', INT)),
+        ('req_id', 'position', 'operation', 'side', 'price', 'size')),
+    config.MARKET_DEPTH_L2: MessageSchema(
+        'update_mkt_depth_l2',
+        ((None, INT), ('req_id', INT), ('position', INT),
+         ('market_maker', STR), ('operation', INT), ('side', INT),
+         ('price', FLOAT), ('size', INT)),
+        ('req_id', 'position', 'market_maker', 'operation', 'side', 'price',
+         'size')),
+    config.NEXT_VALID_ID: MessageSchema(
+        'next_valid_id',
+        ((None, INT), ('req_id', INT)),
+        ('req_id',)),
+    config.OPEN_ORDER_END: MessageSchema(
+        'open_order_end',
+        ((None, INT),)),
+    config.ORDER_STATUS: MessageSchema(
+        'order_status',
+        (('version', INT), ('req_id', INT), ('status', STR),
+         ('filled', INT), ('remaining', INT), ('avg_fill_price', FLOAT),
+         ('perm_id', INT), ('parent_id', INT), ('last_fill_price', FLOAT),
+         ('client_id', INT), ('why_held', STR)),
+        ('req_id', 'status', 'filled', 'remaining', 'avg_fill_price',
+         'perm_id', 'parent_id', 'last_fill_price', 'client_id', 'why_held'),
+        min_version=6),
+    config.PORTFOLIO_VALUE: MessageSchema(
+        'update_portfolio',
+        (('version', INT), ('contract.con_id', INT),
+         ('contract.symbol', STR), ('contract.sec_type', STR),
+         ('contract.expiry', STR), ('contract.strike', FLOAT),
+         ('contract.right', STR), ('contract.multiplier', STR),
+         ('contract.primary_exch', STR), ('contract.currency', STR),
+         ('contract.local_symbol', STR), ('position', INT),
+         ('market_price', FLOAT), ('market_value', FLOAT),
+         ('average_cost', FLOAT), ('unrealized_pnl', FLOAT),
+         ('realized_pnl', FLOAT), ('account_name', STR)),
+        ('contract', 'position', 'market_price', 'market_value',
+         'average_cost', 'unrealized_pnl', 'realized_pnl', 'account_name'),
+        min_version=7, objects=(('contract', Contract, LazyContract),)),
+    config.REAL_TIME_BARS: MessageSchema(
+        'real_time_bar',
+        ((None, INT), ('req_id', INT), ('time', INT), ('open', FLOAT),
+         ('high', FLOAT), ('low', FLOAT), ('close', FLOAT), ('volume', INT),
+         ('wap', FLOAT), ('count', INT)),
+        ('req_id', 'time', 'open', 'high', 'low', 'close', 'volume', 'wap',
+         'count')),
+    config.TICK_GENERIC: MessageSchema(
+        'tick_generic',
+        ((None, INT), ('req_id', INT), ('tick_type', INT),
+         ('value', FLOAT)),
+        ('req_id', 'tick_type', 'value')),
+    config.TICK_SIZE: MessageSchema(
+        'tick_size',
+        ((None, INT), ('req_id', INT), ('tick_type', INT), ('size', INT)),
+        ('req_id', 'tick_type', 'size')),
+    config.TICK_SNAPSHOT_END: MessageSchema(
+        'tick_snapshot_end',
+        ((None, INT), ('req_id', INT)),
+        ('req_id',)),
+    config.TICK_STRING: MessageSchema(
+        'tick_string',
+        ((None, INT), ('req_id', INT), ('tick_type', INT), ('value', STR)),
+        ('req_id', 'tick_type', 'value')),
+}
+
+# Message ID to function mappings: compiled schemas plus the hand-written
+# handlers for messages whose layout depends on the values read
+MESSAGE_HANDLERS = dict((message_id, schema.compile())
+                        for message_id, schema in SCHEMAS.items())
+MESSAGE_HANDLERS.update({config.ERR_MSG: error,
+                         config.HISTORICAL_DATA: historical_data,
+                         config.OPEN_ORDER: open_order,
+                         config.TICK_PRICE: tick_price})
+
+# Message ID to the names of the callback methods it translates into
+MESSAGE_METHODS = dict((message_id, (schema.method,))
+                       for message_id, schema in SCHEMAS.items())
+MESSAGE_METHODS.update({config.ERR_MSG: ('error',),
+                        config.HISTORICAL_DATA: ('historical_data',
+                                                 'historical_data_columns'),
+                        config.OPEN_ORDER: ('open_order',),
+                        config.TICK_PRICE: ('tick_price', 'tick_size')})
+
+# Message ID to functions that read past a message without decoding it, used
+# in place of the handlers of messages that nobody is listening to
+SKIP_HANDLERS = dict((message_id, schema.compile_skip())
+                     for message_id, schema in SCHEMAS.items())
+SKIP_HANDLERS.update({config.HISTORICAL_DATA: skip_historical_data,
+                      config.OPEN_ORDER: skip_open_order,
+                      config.TICK_PRICE: compile_skip(
+                          'tick_price', TICK_PRICE_FIELDS.field_count)})
+
+# Layouts of the lazy objects created by open_order_lazy()
+for name in ('contract', 'order'):
+    register_layout('open_order.' + name,
+                    lazy_layout(OPEN_ORDER_FIELDS.fields, name))
+
+# Message ID to functions that emit lazy contracts, orders and executions,
+# used in place of the corresponding MESSAGE_HANDLERS on request
+LAZY_HANDLERS = dict((message_id, schema.compile(lazy=True))
+                     for message_id, schema in SCHEMAS.items()
+                     if any(len(item) > 2 for item in schema.objects))
+LAZY_HANDLERS[config.OPEN_ORDER] = open_order_lazy
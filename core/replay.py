@@ -0,0 +1,79 @@
+"""Replay of session files into a client.
+
+The payloads recorded in a session file are fed through the same FieldDecoder
+and message handlers as a live connection, and the resulting messages are
+delivered by calling the client callbacks directly. Replay runs either at the
+recorded pace or as fast as decoding and callbacks allow, which makes it
+possible to reproduce a production session or run a strategy over recorded
+days at CPU speed.
+
+"""
+from ibapipy.core.client_socket import (MARKET_DATA_METHODS, dispatch,
+                                        publish_books, publish_quotes,
+                                        route_market_data)
+from ibapipy.core.network_handler import FieldDecoder
+import time
+import ibapipy.core.reader as reader
+import ibapipy.core.session as session
+
+
+def replay(path, client, paced=False, speed=1.0, historical_columns=False):
+    """Feed a session file into the callbacks of a client and return the
+    number of messages delivered.
+
+    Messages are decoded in the calling thread and delivered by calling the
+    client methods directly. Market data is routed as it is on a live
+    connection (see route_market_data()): if the client has a quote book or
+    an order book, tick_price(), tick_size() and market depth messages are
+    folded into it using the recorded times and delivered as update_quote()
+    and update_order_book() calls, and real_time_bar() messages are appended
+    to the client's bar buffers before the callback is made.
+
+    Keyword arguments:
+    path               -- session file to replay
+    client             -- ibapipy.core.client_socket.ClientSocket object, or
+                          any other object with the callback methods
+    paced              -- True to deliver data at the pace it was recorded;
+                          False to deliver it as fast as possible
+                          (default: False)
+    speed              -- factor applied to the recorded pace, e.g. 10 to
+                          replay ten times faster (default: 1.0)
+    historical_columns -- True to deliver historical data via
+                          historical_data_columns() (default: False)
+
+    """
+    message_handlers = reader.get_message_handlers(historical_columns)
+    books = [(book, publish) for book, publish in
+             ((getattr(client, 'quote_book', None), publish_quotes),
+              (getattr(client, 'order_book', None), publish_books))
+             if book is not None]
+    decoder = FieldDecoder()
+    fields = reader.FieldList()
+    messages = []
+    count = 0
+    start = None
+    milliseconds = 0
+    records = session.read_records(path) if paced \
+        else session.read_chunks(path)
+    for nanoseconds, data in records:
+        if paced:
+            if start is None:
+                start = (nanoseconds, time.time())
+            due = start[1] + (nanoseconds - start[0]) / 1e9 / speed
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        fields.extend(decoder.feed(data))
+        reader.read_messages(fields, messages, message_handlers)
+        milliseconds = nanoseconds // 1000000
+        for method, parms in messages:
+            if method not in MARKET_DATA_METHODS or \
+                    not route_market_data(client, method, parms,
+                                          milliseconds=milliseconds):
+                dispatch(client, method, parms)
+        count += len(messages)
+        messages.clear()
+    # Publish the changes still held back by the book intervals
+    for book, publish in books:
+        publish(client, milliseconds=milliseconds + book.interval_ms)
+    return count
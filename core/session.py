@@ -0,0 +1,107 @@
+"""Session files holding the raw inbound byte stream of a connection.
+
+A session file is an append-only sequence of records, one per read from the
+socket. Each record is a header with the receive time in nanoseconds since the
+Epoch and the payload length, followed by the payload exactly as it was
+received. The handshake is not recorded; a session starts with the first
+message after it.
+
+Session files are read through a memory map; see the replay module for
+feeding them back into a client.
+
+"""
+import mmap
+import struct
+import time
+
+
+# Record header: receive time in nanoseconds since the Epoch, payload length
+RECORD_HEADER = struct.Struct('<qI')
+
+# Default minimum number of bytes per chunk returned by read_chunks()
+CHUNK_SIZE = 65536
+
+
+class SessionWriter:
+    """Appends timestamped records of received data to a session file."""
+
+    def __init__(self, path):
+        """Initialize a new instance of a SessionWriter.
+
+        Keyword arguments:
+        path -- session file to append to; created if it does not exist
+
+        """
+        # Unbuffered so every record reaches the file as soon as it has been
+        # received, even if the process dies afterwards
+        self.file = open(path, 'ab', buffering=0)
+
+    def close(self):
+        """Close the session file."""
+        self.file.close()
+
+    def write(self, data, nanoseconds=None):
+        """Append a record with the specified data.
+
+        Keyword arguments:
+        data        -- bytes received from the network
+        nanoseconds -- time the data was received in nanoseconds since the
+                       Epoch (default: current time)
+
+        """
+        if nanoseconds is None:
+            nanoseconds = time.time_ns()
+        self.file.write(RECORD_HEADER.pack(nanoseconds, len(data)) + data)
+
+
+def read_records(path):
+    """Iterate over the (nanoseconds, data) records in a session file.
+
+    A record cut short at the end of the file, as left behind by a process
+    that died while writing it, is ignored.
+
+    Keyword arguments:
+    path -- session file to read
+
+    """
+    with open(path, 'rb') as session_file:
+        session_file.seek(0, 2)
+        if session_file.tell() == 0:
+            return
+        with mmap.mmap(session_file.fileno(), 0,
+                       access=mmap.ACCESS_READ) as data:
+            size = len(data)
+            header_size = RECORD_HEADER.size
+            unpack_from = RECORD_HEADER.unpack_from
+            offset = 0
+            while offset + header_size <= size:
+                nanoseconds, length = unpack_from(data, offset)
+                start = offset + header_size
+                offset = start + length
+                if offset > size:
+                    return
+                yield nanoseconds, data[start:offset]
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """Iterate over (nanoseconds, data) tuples where the data of consecutive
+    records has been joined into chunks of at least 'chunk_size' bytes. The
+    time of a chunk is that of its last record.
+
+    Keyword arguments:
+    path       -- session file to read
+    chunk_size -- minimum number of bytes per chunk (default:
+                  CHUNK_SIZE)
+
+    """
+    pending = []
+    pending_size = 0
+    for nanoseconds, data in read_records(path):
+        pending.append(data)
+        pending_size += len(data)
+        if pending_size >= chunk_size:
+            yield nanoseconds, b''.join(pending)
+            pending = []
+            pending_size = 0
+    if len(pending) > 0:
+        yield nanoseconds, b''.join(pending)
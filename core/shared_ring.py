@@ -0,0 +1,396 @@
+"""Single-producer, single-consumer ring buffer in shared memory.
+
+A SharedRing carries length-prefixed frames between two processes through a
+multiprocessing.shared_memory block, offering the subset of the queue
+interface that the network handler uses (put(), get(), get_nowait() and
+qsize()). Compared to a multiprocessing.Queue there is no feeder thread and
+no pipe: bytes are copied into the ring as they are, other items are
+pickled, and a put() is a copy plus an update of the write position.
+
+Layout of the block: the write position (head) and read position (tail) are
+byte counts that only ever grow, each on its own cache line and each only
+written by one side, followed by a few flags and the data area. A frame is a
+4 byte length and a 1 byte kind followed by the payload; frames wrap around
+the end of the data area, and frames larger than the ring are streamed
+through it as the consumer catches up.
+
+When there is nothing to read, the consumer spins for a while, then raises
+its waiting flag and sleeps on a semaphore that the producer only releases
+when the flag is up, so a busy ring costs no system calls at all. The same
+goes for a producer waiting for space. Sleeps are capped at POLL_SECONDS, so
+a wakeup lost to the two flags being checked at the same moment only delays
+the other side rather than stalling it.
+
+The ring relies on stores becoming visible to the other process in program
+order, as is the case on x86-64. STORE_ORDERED tells whether this machine
+is one of those; the network handler falls back to queues where it is not.
+
+Besides the byte positions, each side counts the frames it has written or
+read, so that qsize() returns a number of items like a queue's.
+
+Each ring has a single producer and a single consumer. Threads of the
+producing process are serialized by a lock, but another process must not
+put() on the ring; it can call finish() instead, after which get() returns
+the 'stop_item' once the ring has been drained.
+
+"""
+from multiprocessing import Semaphore, resource_tracker
+from multiprocessing.queues import Empty
+from multiprocessing.reduction import ForkingPickler
+from multiprocessing.shared_memory import SharedMemory
+import os
+import pickle
+import platform
+import struct
+import sys
+import threading
+import time
+
+
+# True if stores become visible to other processes in program order on this
+# machine (x86-64)
+STORE_ORDERED = platform.machine().lower() in ('x86_64', 'amd64')
+
+# Default size of the data area in bytes
+DEFAULT_CAPACITY = 1 << 22
+
+# Longest sleep while waiting for the other side, in seconds
+POLL_SECONDS = 0.01
+
+# Number of checks made before going to sleep when waiting; spinning only
+# takes time away from the other side on a single CPU
+SPIN_COUNT = 200 if (os.cpu_count() or 1) > 1 else 0
+
+# Offsets of the header fields
+HEAD_OFFSET = 0
+PUT_COUNT_OFFSET = 8
+TAIL_OFFSET = 64
+GET_COUNT_OFFSET = 72
+CONSUMER_WAITING_OFFSET = 128
+PRODUCER_WAITING_OFFSET = 136
+FINISHED_OFFSET = 144
+DATA_OFFSET = 192
+
+# Header fields are signed 64 bit integers
+FIELD = struct.Struct('q')
+
+# Frame header: payload length and kind
+FRAME_HEADER = struct.Struct('<IB')
+
+# Kinds of frames
+RAW_FRAME = 0
+PICKLED_FRAME = 1
+
+# Serializes the attach() calls that stop blocks from being registered
+TRACKER_LOCK = threading.Lock()
+
+
+class SharedRing:
+    """Ring buffer of frames in a shared memory block."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, stop_item=None,
+                 spin_count=SPIN_COUNT):
+        """Initialize a new instance of a SharedRing, creating its shared
+        memory block.
+
+        Keyword arguments:
+        capacity   -- size of the data area in bytes (default:
+                      DEFAULT_CAPACITY)
+        stop_item  -- item returned by get() once the ring has been finished
+                      and drained (default: None)
+        spin_count -- number of checks made before sleeping when waiting
+                      (default: SPIN_COUNT)
+
+        """
+        self.capacity = capacity
+        self.end = DATA_OFFSET + capacity
+        self.stop_item = stop_item
+        self.spin_count = spin_count
+        self.memory = SharedMemory(create=True, size=DATA_OFFSET + capacity)
+        self.memory.buf[:DATA_OFFSET] = bytes(DATA_OFFSET)
+        self.data_ready = Semaphore(0)
+        self.space_ready = Semaphore(0)
+        self.owner = True
+        self.lock = threading.Lock()
+        self.head = 0
+        self.tail = 0
+        self.puts = 0
+        self.gets = 0
+
+    def __getstate__(self):
+        """Return the state passed to a process started with spawn."""
+        return {'name': self.memory.name, 'capacity': self.capacity,
+                'stop_item': self.stop_item, 'spin_count': self.spin_count,
+                'data_ready': self.data_ready,
+                'space_ready': self.space_ready}
+
+    def __setstate__(self, state):
+        """Attach to the shared memory block of a ring in another process."""
+        self.capacity = state['capacity']
+        self.end = DATA_OFFSET + self.capacity
+        self.stop_item = state['stop_item']
+        self.spin_count = state['spin_count']
+        self.memory = attach(state['name'])
+        self.data_ready = state['data_ready']
+        self.space_ready = state['space_ready']
+        self.owner = False
+        self.lock = threading.Lock()
+        self.head = self.load(HEAD_OFFSET)
+        self.tail = self.load(TAIL_OFFSET)
+        self.puts = self.load(PUT_COUNT_OFFSET)
+        self.gets = self.load(GET_COUNT_OFFSET)
+
+    def empty(self):
+        """Return True if there is nothing to read."""
+        return self.load(HEAD_OFFSET) == self.load(TAIL_OFFSET)
+
+    def finish(self):
+        """Mark the ring as finished: once it has been drained, get() returns
+        the stop item. May be called from any process.
+
+        """
+        self.store(FINISHED_OFFSET, 1)
+        self.data_ready.release()
+
+    def get(self, block=True, timeout=None):
+        """Remove and return the next item, or the stop item if the ring has
+        been finished and drained.
+
+        Keyword arguments:
+        block   -- False to raise Empty right away if there is no item
+                   (default: True)
+        timeout -- seconds to wait for an item before raising Empty; None to
+                   wait forever (default: None)
+
+        """
+        size = FRAME_HEADER.size
+        buf = self.memory.buf
+        tail = self.tail
+        available = FIELD.unpack_from(buf, HEAD_OFFSET)[0] - tail
+        start = DATA_OFFSET + tail % self.capacity
+        # Fast path: a whole frame that does not wrap around
+        if available >= size and start + size <= self.end:
+            length, kind = FRAME_HEADER.unpack_from(buf, start)
+            end = start + size + length
+            if available >= size + length and end <= self.end:
+                payload = buf[start + size:end].tobytes()
+                self.tail = tail + size + length
+                self.gets += 1
+                FIELD.pack_into(buf, TAIL_OFFSET, self.tail)
+                FIELD.pack_into(buf, GET_COUNT_OFFSET, self.gets)
+                if FIELD.unpack_from(buf, PRODUCER_WAITING_OFFSET)[0]:
+                    self.wake_producer()
+                if kind == RAW_FRAME:
+                    return payload
+                return pickle.loads(payload)
+        if available < size:
+            if not block:
+                if available == 0 and self.load(FINISHED_OFFSET):
+                    return self.stop_item
+                raise Empty
+            deadline = None
+            if timeout is not None:
+                deadline = time.monotonic() + timeout
+            if not self.wait_for_data(size, deadline):
+                return self.stop_item
+        length, kind = FRAME_HEADER.unpack(self.read(size))
+        payload = self.read(length)
+        self.gets += 1
+        self.store(TAIL_OFFSET, self.tail)
+        self.store(GET_COUNT_OFFSET, self.gets)
+        self.wake_producer()
+        if kind == RAW_FRAME:
+            return payload
+        return pickle.loads(payload)
+
+    def get_nowait(self):
+        """Remove and return the next item or raise Empty."""
+        return self.get(False)
+
+    def load(self, offset):
+        """Return the header field at the specified offset."""
+        return FIELD.unpack_from(self.memory.buf, offset)[0]
+
+    def put(self, item, block=True, timeout=None):
+        """Add an item, waiting for space if the ring is full.
+
+        Like the unbounded queues that rings stand in for, put() always
+        waits for space; block and timeout are ignored.
+
+        Keyword arguments:
+        item    -- bytes-like object, which is copied as it is and read
+                   back as bytes, or any other picklable item
+        block   -- ignored
+        timeout -- ignored
+
+        """
+        if isinstance(item, (bytes, bytearray, memoryview)):
+            kind = RAW_FRAME
+            payload = item
+        else:
+            kind = PICKLED_FRAME
+            payload = ForkingPickler.dumps(item, pickle.HIGHEST_PROTOCOL)
+        size = FRAME_HEADER.size + len(payload)
+        with self.lock:
+            buf = self.memory.buf
+            head = self.head
+            start = DATA_OFFSET + head % self.capacity
+            # Fast path: the frame fits without waiting or wrapping around
+            if size <= self.capacity - (head - FIELD.unpack_from(
+                    buf, TAIL_OFFSET)[0]) and start + size <= self.end:
+                FRAME_HEADER.pack_into(buf, start, len(payload), kind)
+                buf[start + FRAME_HEADER.size:start + size] = payload
+                self.head = head + size
+            else:
+                self.write(FRAME_HEADER.pack(len(payload), kind))
+                self.write(payload)
+            self.puts += 1
+            FIELD.pack_into(buf, HEAD_OFFSET, self.head)
+            FIELD.pack_into(buf, PUT_COUNT_OFFSET, self.puts)
+            if FIELD.unpack_from(buf, CONSUMER_WAITING_OFFSET)[0]:
+                self.store(CONSUMER_WAITING_OFFSET, 0)
+                self.data_ready.release()
+
+    def qsize(self):
+        """Return the number of items waiting to be read."""
+        return self.load(PUT_COUNT_OFFSET) - self.load(GET_COUNT_OFFSET)
+
+    def read(self, count):
+        """Copy the next 'count' bytes out of the ring, waiting for the
+        producer if the frame is still being written.
+
+        """
+        capacity = self.capacity
+        buf = self.memory.buf
+        chunks = []
+        while count > 0:
+            available = self.load(HEAD_OFFSET) - self.tail
+            if available == 0:
+                # Let a producer streaming a large frame continue
+                self.store(TAIL_OFFSET, self.tail)
+                self.wake_producer()
+                self.wait_for_data(1, None)
+                continue
+            size = min(count, available)
+            start = self.tail % capacity
+            first = min(size, capacity - start)
+            chunks.append(bytes(buf[DATA_OFFSET + start:
+                                    DATA_OFFSET + start + first]))
+            if size > first:
+                chunks.append(bytes(buf[DATA_OFFSET:
+                                        DATA_OFFSET + size - first]))
+            self.tail += size
+            count -= size
+        if len(chunks) == 1:
+            return chunks[0]
+        return b''.join(chunks)
+
+    def store(self, offset, value):
+        """Set the header field at the specified offset."""
+        FIELD.pack_into(self.memory.buf, offset, value)
+
+    def unlink(self):
+        """Remove the shared memory block once every process is done with
+        it. Processes that already have it mapped keep their mapping.
+
+        """
+        if self.owner:
+            self.owner = False
+            self.memory.unlink()
+
+    def wait_for_data(self, count, deadline):
+        """Wait until at least 'count' bytes can be read and return True, or
+        return False if the ring is finished and empty. Raise Empty if the
+        deadline (in time.monotonic() seconds) passes first.
+
+        """
+        spins = self.spin_count
+        while True:
+            available = self.load(HEAD_OFFSET) - self.tail
+            if available >= count:
+                return True
+            if available == 0 and self.load(FINISHED_OFFSET):
+                return False
+            if spins > 0:
+                spins -= 1
+                continue
+            wait = POLL_SECONDS
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    raise Empty
+            self.store(CONSUMER_WAITING_OFFSET, 1)
+            if self.load(HEAD_OFFSET) - self.tail < count:
+                self.data_ready.acquire(timeout=wait)
+            self.store(CONSUMER_WAITING_OFFSET, 0)
+
+    def wake_producer(self):
+        """Wake the producer if it is waiting for space."""
+        if self.load(PRODUCER_WAITING_OFFSET):
+            self.store(PRODUCER_WAITING_OFFSET, 0)
+            self.space_ready.release()
+
+    def write(self, data):
+        """Copy data into the ring, publishing what has been written and
+        waiting for the consumer whenever the ring is full.
+
+        """
+        capacity = self.capacity
+        buf = self.memory.buf
+        view = memoryview(data)
+        spins = self.spin_count
+        while len(view) > 0:
+            free = capacity - (self.head - self.load(TAIL_OFFSET))
+            if free == 0:
+                self.store(HEAD_OFFSET, self.head)
+                if self.load(CONSUMER_WAITING_OFFSET):
+                    self.store(CONSUMER_WAITING_OFFSET, 0)
+                    self.data_ready.release()
+                if spins > 0:
+                    spins -= 1
+                    continue
+                self.store(PRODUCER_WAITING_OFFSET, 1)
+                if self.head - self.load(TAIL_OFFSET) >= capacity:
+                    self.space_ready.acquire(timeout=POLL_SECONDS)
+                self.store(PRODUCER_WAITING_OFFSET, 0)
+                continue
+            size = min(free, len(view))
+            start = self.head % capacity
+            first = min(size, capacity - start)
+            buf[DATA_OFFSET + start:DATA_OFFSET + start + first] = \
+                view[:first]
+            if size > first:
+                buf[DATA_OFFSET:DATA_OFFSET + size - first] = \
+                    view[first:size]
+            self.head += size
+            view = view[size:]
+            spins = self.spin_count
+        view.release()
+
+
+def attach(name):
+    """Return the existing shared memory block with the specified name
+    without registering it with the resource tracker.
+
+    Before Python 3.13, SharedMemory registers every block it attaches to,
+    so the tracker would unlink the block (with a leak warning) when the
+    attaching process exits. Unregistering afterwards does not help: the
+    tracker is shared with the creating process, and its registration would
+    be dropped along with ours. Registration is skipped instead, which also
+    skips it for blocks created by other threads during the call.
+
+    """
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    with TRACKER_LOCK:
+        register = resource_tracker.register
+        resource_tracker.register = skip_register
+        try:
+            return SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def skip_register(name, rtype):
+    """Stand in for resource_tracker.register() during attach()."""
+    pass
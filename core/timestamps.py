@@ -0,0 +1,228 @@
+"""Conversion of the time strings sent by TWS to milliseconds since the Epoch.
+
+TWS sends times as 'YYYYMMDD  HH:MM:SS' (executions and intraday bars),
+'YYYYMMDD' (daily bars) or, when historical data is requested with
+format_date=2, as seconds since the Epoch. Rather than running strptime() and
+looking up the time zone for every string, the fixed formats are sliced
+directly and the expensive parts are memoized:
+
+* time zone objects are looked up once per name;
+* the start of each day and the UTC offset of each hour of a day are computed
+  once per time zone, falling back to a lookup per time for the rare hours
+  in which the offset changes (transitions that are not on the hour, as in
+  Australia/Lord_Howe); and
+* whole strings are memoized, so repeated times (e.g. thousands of fills
+  replayed after a reconnect) cost a single dictionary lookup.
+
+bar_dates_to_ms() converts a whole column of bar dates at once with NumPy.
+
+"""
+from ibapipy.ibapipy_error import IBAPIPyError
+import calendar
+import datetime
+import functools
+import pytz
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Number of milliseconds in a day
+DAY_MS = 86400000
+
+
+@functools.lru_cache(maxsize=None)
+def get_timezone(name):
+    """Return the pytz time zone with the specified name."""
+    return pytz.timezone(name)
+
+
+@functools.lru_cache(maxsize=65536)
+def day_ms(day):
+    """Return the start of the specified 'YYYYMMDD' day in UTC in milliseconds
+    since the Epoch.
+
+    """
+    return calendar.timegm((int(day[0:4]), int(day[4:6]), int(day[6:8]), 0,
+                            0, 0)) * 1000
+
+
+def exact_offset_ms(timezone, dtime):
+    """Return the UTC offset in milliseconds of the specified time zone at a
+    naive local datetime. Ambiguous and skipped times are resolved the same
+    way as pytz's localize().
+
+    """
+    offset = get_timezone(timezone).localize(dtime).utcoffset()
+    return int(offset.total_seconds() * 1000)
+
+
+@functools.lru_cache(maxsize=65536)
+def utc_offset_ms(timezone, day, hour):
+    """Return the UTC offset in milliseconds of the specified time zone
+    during the given hour of a 'YYYYMMDD' day, or None if the offset changes
+    within the hour, in which case exact_offset_ms() must be used for each
+    time.
+
+    """
+    dtime = datetime.datetime(int(day[0:4]), int(day[4:6]), int(day[6:8]),
+                              hour)
+    offset = exact_offset_ms(timezone, dtime)
+    last = dtime.replace(minute=59, second=59)
+    if exact_offset_ms(timezone, last) != offset:
+        return None
+    return offset
+
+
+@functools.lru_cache(maxsize=65536)
+def ib_time_to_ms(time_str, timezone='UTC'):
+    """Return the time in milliseconds since the Epoch for a time string in
+    one of the formats sent by TWS.
+
+    Supported formats are 'YYYYMMDD  HH:MM:SS' (with one or more spaces and
+    an optional trailing time zone name, which takes precedence over the
+    'timezone' argument), 'YYYYMMDD' and seconds since the Epoch.
+
+    Keyword arguments:
+    time_str -- time string
+    timezone -- name of the time zone the time is expressed in
+                (default: 'UTC')
+
+    """
+    time_str = time_str.strip()
+    if len(time_str) != 8 and time_str.isdigit():
+        return int(time_str) * 1000
+    day = time_str[0:8]
+    parts = time_str[8:].split()
+    if len(parts) == 0:
+        hour, minute, second = 0, 0, 0
+    else:
+        try:
+            hour, minute, second = (int(item) for item in parts[0].split(':'))
+        except ValueError:
+            raise IBAPIPyError('Unsupported time: {0}'.format(time_str))
+        if len(parts) > 1:
+            timezone = parts[1]
+    milliseconds = day_ms(day) + (hour * 3600 + minute * 60 + second) * 1000
+    if timezone.upper() != 'UTC':
+        offset = utc_offset_ms(timezone, day, hour)
+        if offset is None:
+            offset = exact_offset_ms(timezone, datetime.datetime(
+                int(day[0:4]), int(day[4:6]), int(day[6:8]), hour, minute,
+                second))
+        milliseconds -= offset
+    return milliseconds
+
+
+def str_to_ms(time_str, timezone='UTC', formatting='%Y-%m-%d %H:%M:%S.%f'):
+    """Return the time in milliseconds since the Epoch for a time string in
+    an arbitrary format.
+
+    Keyword arguments:
+    time_str   -- time string
+    timezone   -- name of the time zone the time is expressed in
+                  (default: 'UTC')
+    formatting -- strptime() format of the string
+                  (default: '%Y-%m-%d %H:%M:%S.%f')
+
+    """
+    dtime = datetime.datetime.strptime(time_str, formatting)
+    # Note that in order for daylight savings conversions to work, we
+    # MUST use localize() here and cannot simply pass a timezone into the
+    # datetime constructor.
+    dtime = get_timezone(timezone).localize(dtime)
+    milliseconds = calendar.timegm(dtime.utctimetuple()) * 1000
+    return int(milliseconds + dtime.microsecond / 1000.0)
+
+
+def bar_dates_to_ms(dates, timezone='UTC'):
+    """Return a NumPy int64 array with the time in milliseconds since the
+    Epoch of each bar date.
+
+    Columns made up entirely of 'YYYYMMDD  HH:MM:SS' strings, 'YYYYMMDD'
+    strings or seconds since the Epoch are converted without a Python loop;
+    anything else falls back to ib_time_to_ms() for each date.
+
+    Keyword arguments:
+    dates    -- sequence or array of bar date strings
+    timezone -- name of the time zone the dates are expressed in
+                (default: 'UTC')
+
+    """
+    if np is None:
+        raise IBAPIPyError('NumPy is required for bar_dates_to_ms().')
+    dates = np.char.strip(np.asarray(dates, dtype=str))
+    if len(dates) == 0:
+        return np.empty(0, dtype=np.int64)
+    lengths = np.char.str_len(dates)
+    width = lengths.max()
+    if lengths.min() == width:
+        digits = dates.astype('S{0}'.format(width)).view(np.uint8).reshape(
+            len(dates), width).astype(np.int64) - ord('0')
+        colon = ord(':') - ord('0')
+        valid_days = ((digits[:, :8] >= 0) & (digits[:, :8] <= 9)).all()
+        if width == 8 and valid_days:
+            return convert_digits(digits, None, None, None, timezone)
+        # 'YYYYMMDD HH:MM:SS' with one or two spaces
+        start = width - 8
+        if width in (17, 18) and valid_days and \
+                (digits[:, start + 2] == colon).all() and \
+                (digits[:, start + 5] == colon).all():
+            return convert_digits(digits, (start, start + 1),
+                                  (start + 3, start + 4),
+                                  (start + 6, start + 7), timezone)
+        if width != 8 and np.char.isdigit(dates).all():
+            return dates.astype(np.int64) * 1000
+    return np.array([ib_time_to_ms(str(date), timezone) for date in dates],
+                    dtype=np.int64)
+
+
+def convert_digits(digits, hours, minutes, seconds, timezone):
+    """Return the milliseconds for a matrix of date digits with one row per
+    date. 'hours', 'minutes' and 'seconds' are the column indices of the two
+    digits of each part of the time, or None for date-only rows.
+
+    """
+    def number(*columns):
+        result = digits[:, columns[0]]
+        for column in columns[1:]:
+            result = result * 10 + digits[:, column]
+        return result
+    years = number(0, 1, 2, 3)
+    months = number(4, 5)
+    days = number(6, 7)
+    epoch_days = ((years - 1970).astype('datetime64[Y]').astype(
+        'datetime64[M]') + (months - 1)).astype('datetime64[D]') + (days - 1)
+    milliseconds = epoch_days.astype(np.int64) * DAY_MS
+    if hours is None:
+        hour_values = np.zeros(len(digits), dtype=np.int64)
+    else:
+        hour_values = number(*hours)
+        milliseconds += (hour_values * 3600 + number(*minutes) * 60 +
+                         number(*seconds)) * 1000
+    if timezone.upper() != 'UTC':
+        # One UTC offset lookup per distinct hour rather than per date
+        keys = epoch_days.astype(np.int64) * 24 + hour_values
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        offsets = np.empty(len(unique_keys), dtype=np.int64)
+        irregular = []
+        for index, key in enumerate(unique_keys):
+            day = (np.datetime64(int(key // 24), 'D').astype(str)
+                   .replace('-', ''))
+            offset = utc_offset_ms(timezone, day, int(key % 24))
+            if offset is None:
+                irregular.append(index)
+                offset = 0
+            offsets[index] = offset
+        row_offsets = offsets[inverse]
+        # Hours in which the offset changes are converted one date at a time
+        epoch = datetime.datetime(1970, 1, 1)
+        for index in irregular:
+            for row in np.nonzero(inverse == index)[0]:
+                local = epoch + datetime.timedelta(
+                    milliseconds=int(milliseconds[row]))
+                row_offsets[row] = exact_offset_ms(timezone, local)
+        milliseconds -= row_offsets
+    return milliseconds
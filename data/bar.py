@@ -14,6 +14,9 @@ class Bar:
 
     """
 
+    __slots__ = ('local_symbol', 'milliseconds', 'open', 'high', 'low',
+                 'close', 'volume', 'count')
+
     def __init__(self, local_symbol, milliseconds):
         """Initialize a new instance of a Bar.
 
@@ -0,0 +1,49 @@
+"""Stores a time series of bars for a single symbol in preallocated
+columns."""
+from ibapipy.data.ring_buffer import RingBuffer
+
+
+# Layout of a single record
+BAR_DTYPE = [('milliseconds', 'i8'), ('open', 'f8'), ('high', 'f8'),
+             ('low', 'f8'), ('close', 'f8'), ('volume', 'i8'), ('count', 'i8')]
+
+
+class BarBuffer(RingBuffer):
+    """Stores the most recent bars for a single symbol."""
+
+    def __init__(self, local_symbol='', capacity=100000):
+        """Initialize a new instance of a BarBuffer.
+
+        Keyword arguments:
+        local_symbol -- ticker symbol (default: '')
+        capacity     -- maximum number of bars held (default: 100000)
+
+        """
+        RingBuffer.__init__(self, BAR_DTYPE, capacity)
+        self.local_symbol = local_symbol
+
+    def append(self, bar):
+        """Append the specified bar.
+
+        Keyword arguments:
+        bar -- ibapipy.data.bar.Bar object
+
+        """
+        self.append_row((bar.milliseconds, bar.open, bar.high, bar.low,
+                         bar.close, bar.volume, bar.count))
+
+    def append_values(self, milliseconds, open, high, low, close, volume,
+                      count):
+        """Append a bar made up of the specified values.
+
+        Keyword arguments:
+        milliseconds -- time in milliseconds since the Epoch
+        open         -- opening price for the time period
+        high         -- high price
+        low          -- low price
+        close        -- close price
+        volume       -- volume
+        count        -- number of trades
+
+        """
+        self.append_row((milliseconds, open, high, low, close, volume, count))
@@ -4,6 +4,7 @@ This merges the Contract and ContractDetails classes from the Java API into a
 single class.
 
 """
+from ibapipy.data.lazy_object import LazyObject
 
 
 class Contract:
@@ -97,3 +98,12 @@ class Contract:
 
         """
         return self.local_symbol < other.local_symbol
+
+
+class LazyContract(LazyObject, Contract):
+    """Contract whose attributes are converted from the raw fields of a message
+    on first access (see ibapipy.data.lazy_object).
+
+    """
+
+    __slots__ = ()
@@ -1,4 +1,5 @@
 """Represents a single trade execution."""
+from ibapipy.data.lazy_object import LazyObject
 
 
 class Execution:
@@ -49,3 +50,12 @@ class Execution:
 
         """
         return self.milliseconds < other.milliseconds
+
+
+class LazyExecution(LazyObject, Execution):
+    """Execution whose attributes are converted from the raw fields of a
+    message on first access (see ibapipy.data.lazy_object).
+
+    """
+
+    __slots__ = ()
@@ -0,0 +1,150 @@
+"""Base class for data objects backed by the raw fields of a message.
+
+A lazy object keeps the list of raw fields it was decoded from along with the
+name of a layout that maps attribute names to the index of their field and
+the function that converts it. Nothing is converted up front: the first
+access to an attribute converts its field and stores the result like any
+other attribute, and attributes that are not in the message get the default
+value of the class the lazy object stands in for.
+
+The raw fields and layout name are kept in slots, but Contract, Order and
+Execution are ordinary classes, so lazy instances still have a __dict__ for
+the attributes that get converted. What they save is the conversion of the
+fields that are never read and the size of the pickled message, not the
+size of the object itself: most of a lazy object's memory is the raw field
+strings.
+
+Layouts are registered by name so that lazy objects passed between the
+network handler processes only carry the name; both processes have the
+layouts registered when ibapipy.core.reader is imported. Anywhere else, such
+as in files, lazy objects are pickled as instances of the data class they
+stand in for with every attribute converted, so that loading them does not
+depend on the layouts.
+
+"""
+from multiprocessing.reduction import ForkingPickler
+
+
+# Layout name to {attribute name: (field index, converter)} mappings
+LAYOUTS = {}
+
+
+class LazyObject:
+    """Converts attributes from raw fields on first access.
+
+    Subclasses also derive from the data class they stand in for, whose
+    default attributes become DEFAULTS.
+
+    """
+
+    __slots__ = ('__layout__', '__raw__')
+
+    # Attribute name to default value mappings
+    DEFAULTS = {}
+
+    # Data class that instances stand in for
+    DATA_CLASS = None
+
+    def __init_subclass__(cls, **kwargs):
+        """Set up the defaults of a lazy class and keep its instances lazy
+        when they are passed between processes.
+
+        """
+        super().__init_subclass__(**kwargs)
+        cls.DATA_CLASS = [base for base in cls.__mro__
+                          if not issubclass(base, LazyObject)][0]
+        cls.DEFAULTS = vars(cls.DATA_CLASS())
+        ForkingPickler.register(cls, reduce_lazy)
+
+    def __init__(self, layout, fields):
+        """Initialize a new instance of a LazyObject.
+
+        Keyword arguments:
+        layout -- name of a layout registered with register_layout()
+        fields -- list of raw fields that the layout indexes into
+
+        """
+        self.__layout__ = layout
+        self.__raw__ = fields
+
+    def __getattr__(self, name):
+        """Convert and return the specified attribute on first access."""
+        if name.startswith('__'):
+            raise AttributeError(name)
+        layout = get_layout(self.__layout__)
+        if name in layout:
+            index, convert = layout[name]
+            value = convert(self.__raw__[index])
+        elif name in self.DEFAULTS:
+            value = self.DEFAULTS[name]
+            if isinstance(value, list):
+                value = list(value)
+        else:
+            raise AttributeError(name)
+        setattr(self, name, value)
+        return value
+
+    def __reduce__(self):
+        """Pickle as an instance of the data class with every attribute
+        converted.
+
+        """
+        self.materialize()
+        return rebuild, (self.DATA_CLASS, dict(self.__dict__))
+
+    def materialize(self):
+        """Convert every attribute that has not been accessed yet and return
+        this object.
+
+        """
+        for name in get_layout(self.__layout__):
+            getattr(self, name)
+        for name in self.DEFAULTS:
+            getattr(self, name)
+        return self
+
+
+def get_layout(name):
+    """Return the layout with the specified name, raising AttributeError if
+    it has not been registered in this process.
+
+    """
+    layout = LAYOUTS.get(name)
+    if layout is None:
+        raise AttributeError('Unknown lazy object layout: {0}'.format(name))
+    return layout
+
+
+def rebuild(cls, attributes):
+    """Return an instance of cls with the specified attributes, without
+    calling its constructor.
+
+    """
+    instance = cls.__new__(cls)
+    instance.__dict__.update(attributes)
+    return instance
+
+
+def rebuild_lazy(cls, layout, fields, attributes):
+    """Return a lazy object pickled by reduce_lazy()."""
+    instance = cls(layout, fields)
+    instance.__dict__.update(attributes)
+    return instance
+
+
+def reduce_lazy(instance):
+    """Pickle a lazy object as it is, for passing it between processes."""
+    return rebuild_lazy, (type(instance), instance.__layout__,
+                          instance.__raw__, instance.__dict__)
+
+
+def register_layout(name, layout):
+    """Add or replace the layout with the specified name.
+
+    Keyword arguments:
+    name   -- layout name stored in the lazy objects that use it
+    layout -- dictionary of attribute name to (field index, converter)
+              tuples, where converter is a function taking the raw field
+
+    """
+    LAYOUTS[name] = layout
@@ -4,6 +4,7 @@ Unlike the Order class in the native TWSAPI, this merges the information
 contained inside the corresponding OrderState class.
 
 """
+from ibapipy.data.lazy_object import LazyObject
 import ibapipy.config as config
 
 
@@ -151,3 +152,12 @@ class Order:
 
         """
         return self.perm_id < other.perm_id
+
+
+class LazyOrder(LazyObject, Order):
+    """Order whose attributes are converted from the raw fields of a message
+    on first access (see ibapipy.data.lazy_object).
+
+    """
+
+    __slots__ = ()
@@ -0,0 +1,106 @@
+"""Fixed-capacity, time-ordered store of records backed by a preallocated
+NumPy structured array.
+
+Every record is written twice, once at its slot and once at the same slot in
+a mirrored second half of the array. This means the most recent records are
+always available as a single contiguous slice, so reading them back never
+copies data, even after the buffer has wrapped around.
+
+"""
+from ibapipy.ibapipy_error import IBAPIPyError
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class RingBuffer:
+    """Fixed-capacity, time-ordered store of records.
+
+    Records must be appended in non-decreasing order of their 'milliseconds'
+    field. Once the buffer is full, each append overwrites the oldest record.
+
+    """
+
+    def __init__(self, dtype, capacity):
+        """Initialize a new instance of a RingBuffer.
+
+        Keyword arguments:
+        dtype    -- NumPy dtype of a record; must include an integer
+                    'milliseconds' field
+        capacity -- maximum number of records held
+
+        """
+        if np is None:
+            raise IBAPIPyError('NumPy is required for {0}.'.format(
+                type(self).__name__))
+        if capacity < 1:
+            raise IBAPIPyError('Capacity must be at least 1.')
+        self.capacity = capacity
+        self.data = np.zeros(capacity * 2, dtype=dtype)
+        self.position = 0
+        self.count = 0
+
+    def __getitem__(self, name):
+        """Return a view of the specified field for all records, oldest
+        first.
+
+        Keyword arguments:
+        name -- field name
+
+        """
+        return self.view()[name]
+
+    def __len__(self):
+        """Return the number of records currently held."""
+        return self.count
+
+    def append_row(self, row):
+        """Append a record, overwriting the oldest one if the buffer is full.
+
+        Keyword arguments:
+        row -- tuple of values in dtype field order
+
+        """
+        position = self.position
+        self.data[position] = row
+        self.data[position + self.capacity] = row
+        position += 1
+        self.position = 0 if position == self.capacity else position
+        if self.count < self.capacity:
+            self.count += 1
+
+    def between(self, start_ms, end_ms):
+        """Return a view of the records with start_ms <= milliseconds <
+        end_ms, oldest first.
+
+        Keyword arguments:
+        start_ms -- start time in milliseconds since the Epoch (inclusive)
+        end_ms   -- end time in milliseconds since the Epoch (exclusive)
+
+        """
+        records = self.view()
+        milliseconds = records['milliseconds']
+        start = np.searchsorted(milliseconds, start_ms, side='left')
+        end = np.searchsorted(milliseconds, end_ms, side='left')
+        return records[start:end]
+
+    def clear(self):
+        """Remove all records."""
+        self.position = 0
+        self.count = 0
+
+    def last(self, count):
+        """Return a view of the most recent 'count' records, oldest first.
+
+        Keyword arguments:
+        count -- number of records
+
+        """
+        records = self.view()
+        return records[max(len(records) - count, 0):]
+
+    def view(self):
+        """Return a view of all records, oldest first."""
+        start = (self.position - self.count) % self.capacity
+        return self.data[start:start + self.count]
@@ -13,6 +13,9 @@ class Tick:
 
     """
 
+    __slots__ = ('local_symbol', 'milliseconds', 'bid', 'ask', 'bid_size',
+                 'ask_size', 'volume')
+
     def __init__(self, local_symbol='', milliseconds=0):
         """Initialize a new instance of a Tick.
 
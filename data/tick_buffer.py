@@ -0,0 +1,134 @@
+"""Stores a time series of ticks for a single symbol in preallocated
+columns."""
+from ibapipy.data.ring_buffer import RingBuffer
+import ibapipy.config as config
+
+
+# Layout of a single record
+TICK_DTYPE = [('milliseconds', 'i8'), ('bid', 'f8'), ('ask', 'f8'),
+              ('bid_size', 'i8'), ('ask_size', 'i8'), ('volume', 'i8')]
+
+
+class TickBuffer(RingBuffer):
+    """Stores the most recent ticks for a single symbol.
+
+    Each record holds the full quote (the fields of a Tick) as of a point in
+    time. The tick_price() and tick_size() methods take the parameters of the
+    ClientSocket callbacks of the same name plus a timestamp, carry the rest
+    of the quote forward and append the updated quote.
+
+    """
+
+    def __init__(self, local_symbol='', capacity=100000):
+        """Initialize a new instance of a TickBuffer.
+
+        Keyword arguments:
+        local_symbol -- ticker symbol (default: '')
+        capacity     -- maximum number of ticks held (default: 100000)
+
+        """
+        RingBuffer.__init__(self, TICK_DTYPE, capacity)
+        self.local_symbol = local_symbol
+        self.quote = [0, 0.0, 0.0, 0, 0, 0]
+
+    def append(self, tick):
+        """Append the specified tick.
+
+        Keyword arguments:
+        tick -- ibapipy.data.tick.Tick object
+
+        """
+        self.append_values(tick.milliseconds, tick.bid, tick.ask,
+                           tick.bid_size, tick.ask_size, tick.volume)
+
+    def append_values(self, milliseconds, bid, ask, bid_size, ask_size,
+                      volume):
+        """Append a tick made up of the specified values.
+
+        Keyword arguments:
+        milliseconds -- time in milliseconds since the Epoch
+        bid          -- bid price
+        ask          -- ask price
+        bid_size     -- size of the bid
+        ask_size     -- size of the ask
+        volume       -- shares or units traded
+
+        """
+        self.quote = [milliseconds, bid, ask, bid_size, ask_size, volume]
+        self.append_row(tuple(self.quote))
+
+    def midpoint(self, start_ms=None, end_ms=None):
+        """Return an array of the midpoints between the bid and ask prices,
+        optionally restricted to start_ms <= milliseconds < end_ms.
+
+        Keyword arguments:
+        start_ms -- start time in milliseconds since the Epoch (default: None)
+        end_ms   -- end time in milliseconds since the Epoch (default: None)
+
+        """
+        records = self.select(start_ms, end_ms)
+        return (records['ask'] + records['bid']) * 0.5
+
+    def select(self, start_ms=None, end_ms=None):
+        """Return a view of all ticks or, if both times are given, the ticks
+        with start_ms <= milliseconds < end_ms.
+
+        """
+        if start_ms is None or end_ms is None:
+            return self.view()
+        return self.between(start_ms, end_ms)
+
+    def spread(self, start_ms=None, end_ms=None):
+        """Return an array of the differences between the bid and ask prices,
+        optionally restricted to start_ms <= milliseconds < end_ms.
+
+        Keyword arguments:
+        start_ms -- start time in milliseconds since the Epoch (default: None)
+        end_ms   -- end time in milliseconds since the Epoch (default: None)
+
+        """
+        records = self.select(start_ms, end_ms)
+        return records['ask'] - records['bid']
+
+    def tick_price(self, milliseconds, tick_type, price):
+        """Apply a price update and append the resulting quote. Tick types
+        other than bid and ask are ignored.
+
+        Keyword arguments:
+        milliseconds -- time in milliseconds since the Epoch
+        tick_type    -- tick type (config.BID or config.ASK)
+        price        -- price
+
+        """
+        quote = self.quote
+        if tick_type == config.BID:
+            quote[1] = price
+        elif tick_type == config.ASK:
+            quote[2] = price
+        else:
+            return
+        quote[0] = milliseconds
+        self.append_row(tuple(quote))
+
+    def tick_size(self, milliseconds, tick_type, size):
+        """Apply a size update and append the resulting quote. Tick types
+        other than bid size, ask size and volume are ignored.
+
+        Keyword arguments:
+        milliseconds -- time in milliseconds since the Epoch
+        tick_type    -- tick type (config.BID_SIZE, config.ASK_SIZE or
+                        config.VOLUME)
+        size         -- size
+
+        """
+        quote = self.quote
+        if tick_type == config.BID_SIZE:
+            quote[3] = size
+        elif tick_type == config.ASK_SIZE:
+            quote[4] = size
+        elif tick_type == config.VOLUME:
+            quote[5] = size
+        else:
+            return
+        quote[0] = milliseconds
+        self.append_row(tuple(quote))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Tests for the Dispatcher class."""
+import threading
+import time
+import unittest
+from queue import Queue
+from ibapipy.core.client_socket import ClientSocket
+from ibapipy.core.dispatcher import Dispatcher
+from ibapipy.data.commission_report import CommissionReport
+from ibapipy.data.execution import Execution
+
+
+class DispatcherTests(unittest.TestCase):
+    """Test cases for the Dispatcher class."""
+
+    def test_priority_lane(self):
+        release = threading.Event()
+        status = threading.Event()
+        class MockClientSocket(ClientSocket):
+            def historical_data(self, *args):
+                release.wait(5)
+            def order_status(self, *args):
+                status.set()
+        dispatcher = Dispatcher(workers=1)
+        dispatcher.start(MockClientSocket())
+        dispatcher.submit('historical_data', (1,) + (0,) * 9)
+        dispatcher.submit('order_status', (2,) + (0,) * 9)
+        self.assertTrue(status.wait(5))
+        release.set()
+        dispatcher.stop()
+
+    def test_order_errors(self):
+        release = threading.Event()
+        errors = Queue()
+        class MockClientSocket(ClientSocket):
+            def historical_data(self, *args):
+                release.wait(5)
+            def error(self, req_id, code, message):
+                errors.put(req_id)
+        dispatcher = Dispatcher(workers=1)
+        dispatcher.start(MockClientSocket())
+        dispatcher.submit('order_status', (7,) + (0,) * 9)
+        dispatcher.submit('historical_data', (1,) + (0,) * 9)
+        dispatcher.submit('error', (8, 200, 'Not an order'))
+        dispatcher.submit('error', (7, 201, 'Order rejected'))
+        # The order error overtakes the blocked request lane
+        self.assertEqual(errors.get(timeout=5), 7)
+        release.set()
+        self.assertEqual(errors.get(timeout=5), 8)
+        dispatcher.stop()
+
+    def test_ordering_per_key(self):
+        results = {}
+        class MockClientSocket(ClientSocket):
+            def tick_size(self, req_id, tick_type, size):
+                results.setdefault(req_id, []).append(size)
+        dispatcher = Dispatcher(workers=4)
+        dispatcher.start(MockClientSocket())
+        for size in range(1000):
+            for req_id in range(8):
+                dispatcher.submit('tick_size', (req_id, 0, size))
+        dispatcher.stop()
+        for req_id in range(8):
+            self.assertEqual(results[req_id], list(range(1000)))
+
+    def test_commission_reports_follow_executions(self):
+        handled = set()
+        results = []
+        class MockClientSocket(ClientSocket):
+            def exec_details(self, req_id, contract, execution):
+                time.sleep(0.01)
+                handled.add(execution.exec_id)
+            def commission_report(self, report):
+                results.append(report.exec_id in handled)
+        dispatcher = Dispatcher(workers=1, priority_workers=4)
+        dispatcher.start(MockClientSocket())
+        for order_id in range(1, 9):
+            execution = Execution()
+            execution.order_id = order_id
+            execution.exec_id = '{0:08x}.01'.format(order_id)
+            report = CommissionReport()
+            report.exec_id = execution.exec_id
+            dispatcher.submit('exec_details', (-1, None, execution))
+            dispatcher.submit('commission_report', (report,))
+            dispatcher.submit('order_status', (order_id, 'Filled') + (0,) * 8)
+        dispatcher.stop()
+        # Each report is handled after the execution it belongs to
+        self.assertEqual(results, [True] * 8)
+        # Nothing is kept for the filled orders and reported executions
+        self.assertEqual((dispatcher.order_ids, dispatcher.exec_order_ids),
+                         (set(), {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
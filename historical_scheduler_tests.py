@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Tests for the historical_scheduler module."""
+import calendar
+import time
+import unittest
+from ibapipy.benchmarks.mock_tws import MockTWS
+from ibapipy.core.client_socket import ClientSocket
+from ibapipy.core.historical_scheduler import HistoricalJob, \
+    HistoricalScheduler, Pacer
+from ibapipy.data.contract import Contract
+from ibapipy.ibapipy_error import IBAPIPyError
+import ibapipy.config as config
+
+
+# 2014-10-17 00:00:00 UTC
+END_MS = 1413504000000
+
+
+def day_before(day):
+    """Return the 'YYYYMMDD' day before the specified one."""
+    seconds = calendar.timegm(time.strptime(day, '%Y%m%d')) - 86400
+    return time.strftime('%Y%m%d', time.gmtime(seconds))
+
+
+class HistoricalSchedulerTests(unittest.TestCase):
+    """Test cases for the HistoricalScheduler class."""
+
+    def test_split(self):
+        contract = Contract('STK', 'AAPL', 'USD', 'SMART')
+        job = HistoricalJob(contract, END_MS, '5000 S', '5 secs')
+        self.assertEqual([(chunk.end_date_time, chunk.duration)
+                          for chunk in job.chunks],
+                         [('20141017 00:00:00 GMT', '3600 S'),
+                          ('20141016 23:00:00 GMT', '1400 S')])
+        job = HistoricalJob(contract, END_MS, '1 Y', '1 min')
+        self.assertEqual(len(job.chunks), 365)
+        self.assertEqual(job.chunks[0].duration, '1 D')
+        for duration in ('0 S', '-1 D', '1 X'):
+            self.assertRaises(IBAPIPyError, HistoricalJob, contract, END_MS,
+                              duration, '1 min')
+
+    def test_pacer(self):
+        contract = Contract('STK', 'AAPL', 'USD', 'SMART')
+        chunks = HistoricalJob(contract, END_MS, '10 D', '1 min').chunks
+        pacer = Pacer(window_requests=7, window_seconds=600)
+        for index in range(5):
+            self.assertEqual(pacer.delay(chunks[index], 100.0), 0)
+            pacer.record(chunks[index], 100.0)
+        # Identical request and burst limits
+        self.assertEqual(pacer.delay(chunks[0], 101.0), 14.0)
+        self.assertEqual(pacer.delay(chunks[5], 101.0), 1.0)
+        pacer.record(chunks[5], 102.0)
+        pacer.record(chunks[6], 102.0)
+        # Window limit
+        self.assertEqual(pacer.delay(chunks[7], 110.0), 590.0)
+
+    def test_run(self):
+        requests = []
+        def script(connection):
+            while True:
+                fields = [connection.read_field() for index in range(20)]
+                req_id, symbol, end = int(fields[2]), fields[3], fields[14]
+                requests.append((symbol, end))
+                if symbol == 'EMPTY':
+                    connection.send([config.ERR_MSG, 2, req_id, 162,
+                                     'HMDS query returned no data'])
+                    continue
+                if len(requests) == 2:
+                    connection.send([config.ERR_MSG, 2, req_id, 162,
+                                     'Historical data request pacing '
+                                     'violation'])
+                    continue
+                day = end[0:8]
+                message = [config.HISTORICAL_DATA, 3, req_id, day_before(day),
+                           day, 2]
+                for date in (day_before(day), day):
+                    message.extend((date, 1.0, 2.0, 0.5, 1.5, 100, 1.2,
+                                    'false', 10))
+                connection.send(message)
+        server = MockTWS(script)
+        port = server.start()
+        scheduler = HistoricalScheduler(pacer=Pacer(identical_seconds=0.1),
+                                        retry_delay=0.1)
+        client = ClientSocket(historical_scheduler=scheduler)
+        client.connect('127.0.0.1', port, 1)
+        jobs = [HistoricalJob(Contract('STK', symbol, 'USD', 'SMART'), END_MS,
+                              '2 D', '1 min')
+                for symbol in ('AAA', 'BBB', 'EMPTY')]
+        completed = []
+        try:
+            scheduler.run(client, jobs, completed.append, timeout=10)
+        finally:
+            client.disconnect()
+            server.stop()
+        self.assertEqual(len(requests), 7)
+        self.assertEqual(len(completed), 3)
+        for job in jobs[:2]:
+            self.assertIsNone(job.error)
+            self.assertEqual([bar[0] for bar in job.bars],
+                             ['20141015', '20141016', '20141017'])
+        self.assertEqual(jobs[2].bars, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Tests for the instrumentation module."""
+import unittest
+from queue import Queue
+from ibapipy.benchmarks.mock_tws import MockTWS, tick_price_message
+from ibapipy.core.client_socket import ClientSocket
+from ibapipy.core.instrumentation import (Instrumentation, LatencyHistogram,
+                                          STAGES, format_stats)
+import ibapipy.config as config
+
+
+class InstrumentationTests(unittest.TestCase):
+    """Test cases for the instrumentation module."""
+
+    def test_histogram(self):
+        histogram = LatencyHistogram(precision=6)
+        for value in range(1, 10001):
+            histogram.record(value)
+        summary = histogram.summary()
+        self.assertEqual((summary['count'], summary['min'], summary['max']),
+                         (10000, 1, 10000))
+        # Within the relative error of the buckets
+        for percent in (50.0, 90.0, 99.0):
+            expected = percent * 100
+            self.assertLessEqual(abs(histogram.percentile(percent) -
+                                     expected), expected / 32.0)
+        other = LatencyHistogram(precision=6)
+        other.record(2 ** 50)
+        histogram.merge(other)
+        self.assertEqual(histogram.count, 10001)
+        self.assertEqual(histogram.percentile(100.0), 2 ** 50)
+
+    def test_client(self):
+        def script(connection):
+            connection.read_field()
+            connection.read_field()
+            connection.send(*[tick_price_message(sequence, 1.5)
+                              for sequence in range(20)])
+            connection.send([config.CURRENT_TIME, 1, 0])
+        result_queue = Queue()
+        class MockClientSocket(ClientSocket):
+            def current_time(self, seconds):
+                result_queue.put(seconds)
+        instrumentation = Instrumentation(sample_interval=0.01)
+        server = MockTWS(script)
+        port = server.start()
+        client = MockClientSocket(instrumentation=instrumentation)
+        client.connect('127.0.0.1', port, 1)
+        try:
+            client.req_current_time()
+            self.assertEqual(result_queue.get(timeout=10), 0)
+        finally:
+            client.disconnect()
+            server.stop()
+        # Every tick has been recorded by the time current_time() is called
+        stats = instrumentation.stats()
+        for stage in STAGES:
+            self.assertEqual(stats['stages'][stage]['tick_price']['count'],
+                             20)
+        self.assertEqual(set(stats['queues']),
+                         set(('message_queue', 'socket_in_queue',
+                              'socket_out_queue')))
+        self.assertIn('tick_price', format_stats(stats))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""Tests for the mock TWS server."""
+import asyncio
+import multiprocessing
+import unittest
+from queue import Queue
+from ibapipy.benchmarks.mock_tws import MockTWS, Traffic, \
+    exec_details_message, open_order_message, real_time_bar_message, \
+    tick_size_message
+from ibapipy.core.async_client_socket import AsyncClientSocket
+from ibapipy.core.client_socket import ClientSocket
+from ibapipy.core.network_handler import (QUEUE_TRANSPORT,
+                                          SHARED_MEMORY_TRANSPORT)
+from ibapipy.data.contract import Contract
+from ibapipy.data.execution_filter import ExecutionFilter
+from ibapipy.ibapipy_error import IBAPIPyError
+import ibapipy.config as config
+
+
+# Number of fields in each request answered by request_script()
+REQUEST_FIELDS = {config.CANCEL_MKT_DATA: 3,
+                  config.REQ_ALL_OPEN_ORDERS: 2,
+                  config.REQ_CONTRACT_DATA: 16,
+                  config.REQ_CURRENT_TIME: 2,
+                  config.REQ_EXECUTIONS: 10,
+                  config.REQ_MKT_DATA: 17,
+                  config.REQ_OPEN_ORDERS: 2}
+
+
+def request_script(connection):
+    """Answer executions with a warning and a single fill, contract details
+    with an error and every current time request but the first. Open orders
+    requests are never answered.
+
+    """
+    time_requests = 0
+    while True:
+        message_id = int(connection.read_field())
+        fields = [connection.read_field()
+                  for index in range(REQUEST_FIELDS[message_id] - 1)]
+        if message_id == config.REQ_EXECUTIONS:
+            message = exec_details_message(0, 1.5)
+            message[2] = int(fields[1])
+            connection.send([config.ERR_MSG, 2, int(fields[1]), 2104,
+                             'Market data farm connection is OK'],
+                            message, [config.EXECUTION_DATA_END, 1,
+                                      int(fields[1])])
+        elif message_id == config.REQ_CONTRACT_DATA:
+            connection.send([config.ERR_MSG, 2, int(fields[1]), 200,
+                             'No security definition'])
+        elif message_id in (config.REQ_ALL_OPEN_ORDERS,
+                            config.REQ_OPEN_ORDERS):
+            pass
+        elif time_requests > 0:
+            connection.send([config.CURRENT_TIME, 1, time_requests])
+        else:
+            time_requests += 1
+
+
+class MockTWSTests(unittest.TestCase):
+    """Test cases for the MockTWS class."""
+
+    def test_traffic(self):
+        result_queue = Queue()
+        class MockClientSocket(ClientSocket):
+            def current_time(self, seconds):
+                result_queue.put(('current_time', seconds))
+            def exec_details(self, req_id, contract, execution):
+                result_queue.put(('exec_details', execution.order_id))
+            def historical_data(self, req_id, date, *args):
+                if date.startswith('finished'):
+                    result_queue.put(('historical_data', req_id))
+            def open_order(self, req_id, contract, order):
+                result_queue.put(('open_order', req_id))
+        rates = {'exec_details': 20, 'historical_data': 10, 'open_order': 20,
+                 'tick_price': 100, 'tick_size': 100}
+        server = MockTWS(Traffic(rates, duration=0.1, bar_count=3))
+        port = server.start()
+        client = MockClientSocket()
+        client.connect('127.0.0.1', port, 1)
+        results = []
+        while True:
+            method, value = result_queue.get(timeout=10)
+            if method == 'current_time':
+                break
+            results.append((method, value))
+        client.disconnect()
+        server.stop()
+        self.assertEqual(value, 25)
+        self.assertEqual(results.count(('historical_data', 1000)), 1)
+        self.assertEqual([value for method, value in results
+                          if method == 'open_order'], [1, 2])
+        self.assertEqual([value for method, value in results
+                          if method == 'exec_details'], [1, 2])
+
+    def test_script(self):
+        def script(connection):
+            self.assertEqual(int(connection.read_field()),
+                             config.REQ_CURRENT_TIME)
+            connection.read_field()
+            connection.send([config.CURRENT_TIME, 1, connection.client_id])
+        async def run(port):
+            client = AsyncClientSocket()
+            await client.connect('127.0.0.1', port, 7)
+            result = await client.get_current_time(timeout=10)
+            await client.disconnect()
+            return result
+        server = MockTWS(script)
+        port = server.start()
+        self.assertEqual(asyncio.run(run(port)), 7)
+        server.stop()
+
+    def test_skip_unhandled(self):
+        def script(connection):
+            contract = [config.CONTRACT_DATA, 8, 5, 'SYM'] + [1] * 27 + [0]
+            connection.send(open_order_message(0, 1.5), contract,
+                            tick_size_message(0, 1.5))
+            while True:
+                message_id = int(connection.read_field())
+                fields = [connection.read_field()
+                          for index in range(REQUEST_FIELDS[message_id] - 1)]
+                if message_id == config.REQ_CONTRACT_DATA:
+                    contract[2] = int(fields[1])
+                    connection.send(open_order_message(1, 1.5), contract,
+                                    [config.CONTRACT_DATA_END, 1,
+                                     int(fields[1])])
+                else:
+                    connection.send([config.CURRENT_TIME, 1, 42])
+        result_queue = Queue()
+        class Recorder:
+            """Dispatcher that records the messages delivered."""
+            def start(self, client):
+                pass
+            def stop(self):
+                pass
+            def submit(self, method, parms):
+                result_queue.put((method, parms[0]))
+        class MockClientSocket(ClientSocket):
+            def tick_size(self, req_id, tick_type, size):
+                pass
+        server = MockTWS(script)
+        port = server.start()
+        client = MockClientSocket(dispatcher=Recorder(), skip_unhandled=True)
+        client.connect('127.0.0.1', port, 1)
+        try:
+            # Everything sent before the tick has been read by now
+            self.assertEqual(result_queue.get(timeout=10), ('tick_size', 1))
+            future = client.req_contract_details_future(7, Contract())
+            contracts = future.result(timeout=10)
+            self.assertEqual(client.req_current_time_future().result(10), 42)
+        finally:
+            client.disconnect()
+            server.stop()
+        self.assertEqual([contract.symbol for contract in contracts],
+                         ['sym'])
+        # Only the responses to the pending requests were decoded
+        self.assertEqual([result_queue.get_nowait()
+                          for index in range(result_queue.qsize())],
+                         [('contract_details', 7),
+                          ('contract_details_end', 7), ('current_time', 42)])
+
+    def test_real_time_bars(self):
+        def script(connection):
+            fields = [connection.read_field() for index in range(16)]
+            self.assertEqual(int(fields[0]), config.REQ_REAL_TIME_BARS)
+            connection.send(*[real_time_bar_message(sequence, 1700000000)
+                              for sequence in range(0, 30, 10)])
+            connection.send([config.CURRENT_TIME, 1, 0])
+            fields = [connection.read_field() for index in range(3)]
+            self.assertEqual(int(fields[0]), config.CANCEL_REAL_TIME_BARS)
+            connection.send([config.CURRENT_TIME, 1, 0])
+        result_queue = Queue()
+        class MockClientSocket(ClientSocket):
+            def current_time(self, seconds):
+                result_queue.put(None)
+            def real_time_bar(self, req_id, time, *args):
+                result_queue.put((req_id, time,
+                                  len(self.bar_buffers[req_id])))
+        server = MockTWS(script)
+        port = server.start()
+        client = MockClientSocket()
+        client.connect('127.0.0.1', port, 1)
+        contract = Contract('STK', 'AAPL', 'USD', 'SMART')
+        client.req_real_time_bars(1, contract, 5, 'TRADES', 1)
+        results = list(iter(lambda: result_queue.get(timeout=10), None))
+        buffer = client.cancel_real_time_bars(1)
+        self.assertIsNone(result_queue.get(timeout=10))
+        client.disconnect()
+        server.stop()
+        # Each bar is in the buffer by the time its callback is made
+        self.assertEqual(results, [(1, 1700000000, 1), (1, 1700000050, 2),
+                                   (1, 1700000100, 3)])
+        self.assertEqual(buffer.last(2)['milliseconds'].tolist(),
+                         [1700000050000, 1700000100000])
+        self.assertEqual(buffer['close'].tolist(), [1700000000.0] * 3)
+        self.assertNotIn(1, client.bar_buffers)
+
+    def test_futures(self):
+        server = MockTWS(request_script)
+        port = server.start()
+        client = ClientSocket()
+        client.connect('127.0.0.1', port, 1)
+        contract = Contract('STK', 'AAPL', 'USD', 'SMART')
+        try:
+            executions = client.req_executions_future(
+                3, ExecutionFilter()).result(timeout=10)
+            future = client.req_contract_details_future(4, contract)
+            with self.assertRaises(IBAPIPyError):
+                future.result(timeout=10)
+            future = client.req_current_time_future(timeout=0.2)
+            with self.assertRaises(IBAPIPyError):
+                future.result(timeout=10)
+            self.assertEqual(client.__requests__, {})
+            # Open orders responses carry no request ID to tell them apart
+            orders = client.req_open_orders_future()
+            with self.assertRaises(IBAPIPyError):
+                client.req_all_open_orders_future()
+            self.assertFalse(orders.done())
+            seconds = client.req_current_time_future().result(timeout=10)
+        finally:
+            client.disconnect()
+            server.stop()
+        self.assertEqual(len(executions), 1)
+        self.assertEqual(executions[0][1].order_id, 1)
+        self.assertEqual(seconds, 1)
+
+    def test_spawn(self):
+        # The message handlers are built in the message listener process, so
+        # the client also starts when processes are spawned
+        start_method = multiprocessing.get_start_method()
+        multiprocessing.set_start_method('spawn', force=True)
+        try:
+            for transport in (QUEUE_TRANSPORT, SHARED_MEMORY_TRANSPORT):
+                server = MockTWS(request_script)
+                port = server.start()
+                client = ClientSocket(transport=transport,
+                                      skip_unhandled=True)
+                client.connect('127.0.0.1', port, 1)
+                try:
+                    executions = client.req_executions_future(
+                        3, ExecutionFilter()).result(timeout=60)
+                finally:
+                    client.disconnect()
+                    server.stop()
+                self.assertEqual(executions[0][1].order_id, 1)
+        finally:
+            multiprocessing.set_start_method(start_method, force=True)
+
+    def test_awaitables(self):
+        async def run(port):
+            client = AsyncClientSocket()
+            await client.connect('127.0.0.1', port, 1)
+            executions = await client.get_executions(5, ExecutionFilter(),
+                                                     timeout=10)
+            with self.assertRaises(IBAPIPyError):
+                await asyncio.wrap_future(
+                    client.req_current_time_future(timeout=0.2))
+            seconds = await client.get_current_time(timeout=10)
+            await client.disconnect()
+            return executions, seconds
+        server = MockTWS(request_script)
+        port = server.start()
+        try:
+            executions, seconds = asyncio.run(run(port))
+        finally:
+            server.stop()
+        self.assertEqual(executions[0][1].order_id, 1)
+        self.assertEqual(seconds, 1)
+
+    def test_async_options(self):
+        def script(connection):
+            connection.send(tick_size_message(0, 1.5))
+            request_script(connection)
+        class RaisingClient(AsyncClientSocket):
+            def tick_size(self, req_id, tick_type, size):
+                raise ValueError(size)
+        async def run(port):
+            client = RaisingClient(skip_unhandled=True, lazy_objects=True)
+            await client.connect('127.0.0.1', port, 1)
+            # exec_details() is only decoded while the request is pending
+            executions = await client.get_executions(5, ExecutionFilter(),
+                                                     timeout=10)
+            await client.disconnect()
+            return executions
+        server = MockTWS(script)
+        port = server.start()
+        try:
+            with self.assertLogs('ibapipy.core.async_client_socket') as logs:
+                executions = asyncio.run(run(port))
+        finally:
+            server.stop()
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('tick_size', logs.output[0])
+        self.assertEqual(executions[0][1].order_id, 1)
+
+    def test_tick_stream(self):
+        def script(connection):
+            while True:
+                message_id = int(connection.read_field())
+                fields = [connection.read_field()
+                          for index in range(REQUEST_FIELDS[message_id] - 1)]
+                if message_id != config.REQ_MKT_DATA:
+                    continue
+                req_id = int(fields[1])
+                connection.send([config.TICK_PRICE, 6, req_id, config.BID,
+                                 1.5, 100, 1],
+                                [config.ERR_MSG, 2, req_id, 10167,
+                                 'Displaying delayed market data'],
+                                [config.TICK_SIZE, 6, req_id, config.VOLUME,
+                                 500])
+                if fields[15] == '1':
+                    connection.send([config.TICK_SNAPSHOT_END, 1, req_id])
+        async def run(port):
+            client = AsyncClientSocket()
+            await client.connect('127.0.0.1', port, 1)
+            contract = Contract('STK', 'AAPL', 'USD', 'SMART')
+            items = []
+            # Warnings do not end the stream
+            async for method, parms in client.ticks(3, contract):
+                items.append((method, parms[1]))
+                if len(items) == 3:
+                    break
+            # A snapshot ends by itself
+            snapshot = [method async for method, parms
+                        in client.ticks(4, contract, snapshot=True)]
+            await client.disconnect()
+            return items, snapshot
+        server = MockTWS(script)
+        port = server.start()
+        try:
+            items, snapshot = asyncio.run(run(port))
+        finally:
+            server.stop()
+        self.assertEqual(items, [('tick_price', config.BID),
+                                 ('tick_size', config.BID_SIZE),
+                                 ('tick_size', config.VOLUME)])
+        self.assertEqual(snapshot, ['tick_price', 'tick_size', 'tick_size'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Tests for the network_handler module."""
+import socket
+import unittest
+from queue import Queue
+from ibapipy.core.network_handler import (FieldDecoder, SocketOptions,
+                                          decode, encode, encode_message,
+                                          outgoing_listener, read_socket)
+
+
+class NetworkHandlerTests(unittest.TestCase):
+    """Test cases for the network_handler module."""
+
+    def test_field_decoder_matches_decode(self):
+        stream = '1\x006\x00eur.usd\x00\x001.2345\x00'.encode('utf-8')
+        fields, remainder = decode(stream)
+        for chunk_size in range(1, len(stream) + 1):
+            decoder = FieldDecoder()
+            result = []
+            for index in range(0, len(stream), chunk_size):
+                result.extend(decoder.feed(stream[index:index + chunk_size]))
+            self.assertEqual(result, fields)
+            self.assertEqual(len(decoder.buffer), 0)
+
+    def test_field_decoder_split_character(self):
+        stream = 'café\x00x'.encode('utf-8')
+        decoder = FieldDecoder()
+        self.assertEqual(decoder.feed(stream[:4]), [])
+        self.assertEqual(decoder.feed(stream[4:]), ['café'])
+        self.assertEqual(bytes(decoder.buffer), b'x')
+
+    def test_encode_message(self):
+        expected = b''.join([encode(item) for item in (3, 'lmt', 1.5, True,
+                                                       None)])
+        self.assertEqual(encode_message(3, 'lmt', 1.5, True, None), expected)
+        self.assertEqual(encode_message(1, 1.0, True), b'1\x001.0\x001\x00')
+        # Values that compare equal but encode differently do not share
+        # cached encodings
+        self.assertEqual(encode_message(0.0, -0.0, 0, 1, True, '1'),
+                         b'0.0\x00-0.0\x000\x001\x001\x001\x00')
+        self.assertEqual(encode_message(-0.0), b'-0.0\x00')
+
+    def test_outgoing_listener_coalesces(self):
+        out_queue = Queue()
+        out_queue.put(encode_message(1, 2))
+        out_queue.put(encode_message(3))
+        out_queue.put('stop')
+        local, remote = socket.socketpair()
+        try:
+            outgoing_listener(local, out_queue)
+            self.assertEqual(remote.recv(100), b'1\x002\x003\x00')
+        finally:
+            local.close()
+            remote.close()
+
+    def test_read_socket(self):
+        stream = encode_message(*range(2000))
+        for busy_poll in (False, True):
+            in_queue = Queue()
+            options = SocketOptions(read_size=16, max_read_size=1024,
+                                    busy_poll=busy_poll)
+            local, remote = socket.socketpair()
+            try:
+                remote.sendall(stream)
+                remote.close()
+                read_socket(local, in_queue, FieldDecoder(),
+                            socket_options=options)
+            finally:
+                local.close()
+            result = []
+            while not in_queue.empty():
+                result.extend(in_queue.get())
+            self.assertEqual(result, [str(item) for item in range(2000)])
+
+    def test_field_decoder_buffer(self):
+        data = bytearray(8)
+        decoder = FieldDecoder()
+        data[:5] = b'ab\x00cd'
+        self.assertEqual(decoder.feed_buffer(data, 5), ['ab'])
+        data[:4] = b'e\x00fg'
+        self.assertEqual(decoder.feed_buffer(data, 4), ['cde'])
+        self.assertEqual(bytes(decoder.buffer), b'fg')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Tests for the OrderBook class."""
+import threading
+import time
+import unittest
+from queue import Queue
+import ibapipy.config as config
+import ibapipy.core.reader as reader
+from ibapipy.core.client_socket import ClientSocket, listen
+from ibapipy.core.order_book import OrderBook
+
+
+INSERT, UPDATE, DELETE = (config.DEPTH_INSERT, config.DEPTH_UPDATE,
+                          config.DEPTH_DELETE)
+ASK, BID = config.DEPTH_ASK, config.DEPTH_BID
+
+
+class OrderBookTests(unittest.TestCase):
+    """Test cases for the OrderBook class."""
+
+    def test_operations(self):
+        book = OrderBook(capacity=2, depth=3)
+        book.add(5)
+        for position, price in ((0, 1.0), (0, 1.1), (2, 0.9), (1, 1.05)):
+            book.update(5, position, '', INSERT, BID, price, 10)
+        # The fourth level was pushed out of the book
+        self.assertEqual([level[0] for level in book.levels(5, BID)],
+                         [1.1, 1.05, 1.0])
+        self.assertTrue(book.update(5, 1, 'mm', UPDATE, BID, 1.06, 20))
+        self.assertFalse(book.update(5, 1, 'mm', UPDATE, BID, 1.06, 20))
+        book.update(5, 0, '', DELETE, BID, 0.0, 0)
+        self.assertEqual(book.best_bid(5), (1.06, 20))
+        self.assertEqual(book.levels(5, BID), [(1.06, 20, 'mm'),
+                                               (1.0, 10, '')])
+        book.update(5, 0, '', INSERT, ASK, 1.2, 7)
+        self.assertFalse(book.update(5, 3, '', INSERT, ASK, 1.3, 7))
+        snapshot = book.snapshot(5)
+        self.assertEqual(snapshot['bid'].tolist(), [1.06, 1.0, 0.0])
+        self.assertEqual(snapshot['ask_size'].tolist(), [7, 0, 0])
+        self.assertEqual(book.best_ask(5), (1.2, 7))
+
+    def test_decode_and_listen(self):
+        fields = reader.FieldList()
+        fields.extend([str(config.MARKET_DEPTH), '1', '4', '0',
+                       str(INSERT), str(BID), '1.5', '100',
+                       str(config.MARKET_DEPTH_L2), '1', '4', '0', 'NSDQ',
+                       str(UPDATE), str(BID), '1.6', '200'])
+        messages = []
+        reader.read_messages(fields, messages)
+        self.assertEqual(messages[1], ('update_mkt_depth_l2',
+                                       (4, 0, 'nsdq', UPDATE, BID, 1.6,
+                                        200)))
+        books = []
+        class MockClientSocket(ClientSocket):
+            def update_mkt_depth(self, *args):
+                raise AssertionError('update_mkt_depth should not be called')
+            def update_order_book(self, req_id, order_book):
+                books.append((req_id, order_book.best_bid(req_id)))
+        client = MockClientSocket(order_book=OrderBook(interval_ms=50))
+        in_queue = Queue()
+        for message in messages:
+            in_queue.put(message)
+        thread = threading.Thread(target=listen, args=(client, in_queue))
+        thread.start()
+        thread.join(0.5)
+        in_queue.put(('stop', None))
+        thread.join()
+        self.assertEqual(books, [(4, (1.5, 100)), (4, (1.6, 200))])
+
+    def test_listen_under_load(self):
+        books = Queue()
+        class MockClientSocket(ClientSocket):
+            def update_order_book(self, req_id, order_book):
+                books.put((req_id, order_book.best_bid(req_id)))
+        client = MockClientSocket(order_book=OrderBook(interval_ms=50))
+        in_queue = Queue()
+        thread = threading.Thread(target=listen, args=(client, in_queue))
+        thread.start()
+        in_queue.put(('update_mkt_depth', (4, 0, INSERT, BID, 1.5, 100)))
+        in_queue.put(('update_mkt_depth', (4, 0, UPDATE, BID, 1.6, 200)))
+        self.assertEqual(books.get(timeout=5), (4, (1.5, 100)))
+        # Other messages keep arriving faster than the interval, so the
+        # queue never times out
+        try:
+            for index in range(100):
+                in_queue.put(('current_time', (1,)))
+                time.sleep(0.005)
+                if not books.empty():
+                    break
+            self.assertEqual(books.get_nowait(), (4, (1.6, 200)))
+        finally:
+            in_queue.put(('stop', None))
+            thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
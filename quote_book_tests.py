@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Tests for the QuoteBook class."""
+import threading
+import time
+import unittest
+from queue import Queue
+import ibapipy.config as config
+from ibapipy.core.client_socket import ClientSocket, listen
+from ibapipy.core.quote_book import QuoteBook
+from ibapipy.data.contract import Contract
+
+
+class QuoteBookTests(unittest.TestCase):
+    """Test cases for the QuoteBook class."""
+
+    def test_coalescing(self):
+        book = QuoteBook(capacity=2, interval_ms=100)
+        contract = Contract('cash', 'eur', 'usd', 'idealpro')
+        contract.con_id = 12087792
+        contract.local_symbol = 'eur.usd'
+        book.add(7, contract)
+        self.assertTrue(book.tick_price(7, config.BID, 1.25, milliseconds=1))
+        self.assertFalse(book.tick_price(7, config.BID, 1.25,
+                                         milliseconds=2))
+        self.assertFalse(book.tick_price(7, config.LAST, 1.3,
+                                         milliseconds=2))
+        self.assertEqual(book.poll(1000), [7])
+        book.tick_size(7, config.ASK_SIZE, 5, milliseconds=1010)
+        book.tick_price(7, config.ASK, 1.5, milliseconds=1020)
+        self.assertEqual(book.poll(1050), [])
+        self.assertEqual(book.poll(1100), [7])
+        tick = book.tick_for_con_id(12087792)
+        self.assertEqual((tick.local_symbol, tick.milliseconds, tick.bid,
+                          tick.ask, tick.ask_size),
+                         ('eur.usd', 1020, 1.25, 1.5, 5))
+
+    def test_capacity(self):
+        book = QuoteBook(capacity=1)
+        book.add(1)
+        with self.assertRaises(Exception):
+            book.add(2)
+        book.remove(1)
+        book.add(2)
+        self.assertEqual(book.tick(2).bid, 0.0)
+
+    def test_unknown_requests(self):
+        book = QuoteBook(capacity=1)
+        book.add(1)
+        self.assertFalse(book.consumes('tick_price', (2, config.BID, 1.0, 0)))
+        self.assertFalse(book.tick_price(2, config.BID, 1.0))
+        self.assertNotIn(2, book)
+
+    def test_listen(self):
+        quotes = []
+        ticks = []
+        class MockClientSocket(ClientSocket):
+            def tick_price(self, req_id, tick_type, price, can_auto_execute):
+                ticks.append((req_id, tick_type, price))
+            def update_quote(self, req_id, tick):
+                quotes.append((req_id, tick.bid, tick.ask))
+        book = QuoteBook(interval_ms=50)
+        book.add(3)
+        client = MockClientSocket(quote_book=book)
+        in_queue = Queue()
+        for price in (1.0, 1.1, 1.2):
+            in_queue.put(('tick_price', (3, config.BID, price, 0)))
+        in_queue.put(('tick_price', (3, config.ASK, 1.5, 0)))
+        # Tick types the book does not track and unknown requests are
+        # delivered as they are
+        in_queue.put(('tick_price', (3, config.LAST, 1.4, 0)))
+        in_queue.put(('tick_price', (4, config.BID, 2.0, 0)))
+        thread = threading.Thread(target=listen, args=(client, in_queue))
+        thread.start()
+        thread.join(0.5)
+        in_queue.put(('stop', None))
+        thread.join()
+        self.assertEqual(quotes, [(3, 1.0, 0.0), (3, 1.2, 1.5)])
+        self.assertEqual(ticks, [(3, config.LAST, 1.4), (4, config.BID, 2.0)])
+
+    def test_listen_under_load(self):
+        quotes = Queue()
+        class MockClientSocket(ClientSocket):
+            def update_quote(self, req_id, tick):
+                quotes.put((req_id, tick.bid))
+        book = QuoteBook(interval_ms=50)
+        book.add(3)
+        client = MockClientSocket(quote_book=book)
+        in_queue = Queue()
+        thread = threading.Thread(target=listen, args=(client, in_queue))
+        thread.start()
+        in_queue.put(('tick_price', (3, config.BID, 1.0, 0)))
+        in_queue.put(('tick_price', (3, config.BID, 1.1, 0)))
+        self.assertEqual(quotes.get(timeout=5), (3, 1.0))
+        # Other messages keep arriving faster than the interval, so the
+        # queue never times out
+        try:
+            for index in range(100):
+                in_queue.put(('tick_price', (3, config.LAST, 1.4, 0)))
+                time.sleep(0.005)
+                if not quotes.empty():
+                    break
+            self.assertEqual(quotes.get_nowait(), (3, 1.1))
+        finally:
+            in_queue.put(('stop', None))
+            thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
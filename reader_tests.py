@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Tests for the reader module."""
+import pickle
+import unittest
+from multiprocessing.reduction import ForkingPickler
+from queue import Queue
+from ibapipy.benchmarks.mock_tws import (exec_details_message,
+                                         historical_data_message,
+                                         open_order_message,
+                                         tick_price_message)
+from ibapipy.data.contract import LazyContract
+from ibapipy.data.lazy_object import LazyObject
+import ibapipy.config as config
+from ibapipy.core.message_schema import INT, STR, MessageSchema
+import ibapipy.core.reader as reader
+
+
+class ReaderTests(unittest.TestCase):
+    """Test cases for the reader module."""
+
+    def test_field_buffer_spans_chunks(self):
+        socket_in_queue = Queue()
+        socket_in_queue.put(['1', '2'])
+        socket_in_queue.put(['3'])
+        fields = reader.FieldBuffer(socket_in_queue)
+        self.assertEqual(reader.get_int(fields), 1)
+        self.assertEqual(reader.get_int(fields), 2)
+        self.assertEqual(reader.get_int(fields), 3)
+
+    def test_message_listener(self):
+        socket_in_queue = Queue()
+        message_queue = Queue()
+        socket_in_queue.put([str(config.TICK_PRICE), '6', '1', '1', '1.25'])
+        socket_in_queue.put(['100', '1', str(config.NEXT_VALID_ID), '1',
+                             '42', '-1'])
+        reader.message_listener(socket_in_queue, message_queue)
+        self.assertEqual(message_queue.get(),
+                         ('tick_price', (1, 1, 1.25, 1)))
+        self.assertEqual(message_queue.get(), ('tick_size', (1, 0, 100)))
+        self.assertEqual(message_queue.get(), ('next_valid_id', (42,)))
+
+    def test_field_buffer_take(self):
+        socket_in_queue = Queue()
+        socket_in_queue.put(['a', 'b'])
+        socket_in_queue.put(['c'])
+        socket_in_queue.put(['d', 'e', 'f'])
+        fields = reader.FieldBuffer(socket_in_queue)
+        self.assertEqual(fields.get(), 'a')
+        self.assertEqual(fields.take(4), ['b', 'c', 'd', 'e'])
+        self.assertEqual(fields.get(), 'f')
+
+    def test_message_schema(self):
+        schema = MessageSchema('custom', ((None, INT), ('req_id', INT),
+                                          ('contract.symbol', STR)),
+                               ('req_id', 'contract'),
+                               objects=(('contract', reader.Contract),))
+        fields = reader.FieldList()
+        fields.extend(['1', '7', 'ABC'])
+        messages = reader.MessageList()
+        schema.compile()(fields, messages)
+        method, (req_id, contract) = messages[0]
+        self.assertEqual((method, req_id, contract.symbol),
+                         ('custom', 7, 'abc'))
+
+    def test_contract_details_sec_id_list(self):
+        fields = reader.FieldList()
+        fields.extend(['8', '1'] + ['0'] * 28 +
+                      ['2', 'ISIN', 'X1', 'CUSIP', 'X2'])
+        messages = reader.MessageList()
+        reader.MESSAGE_HANDLERS[config.CONTRACT_DATA](fields, messages)
+        contract = messages[0][1][1]
+        self.assertEqual([(tag.tag, tag.value)
+                          for tag in contract.sec_id_list],
+                         [('isin', 'x1'), ('cusip', 'x2')])
+        self.assertEqual(fields.index, len(fields.fields))
+
+    @unittest.skipIf(reader.np is None, 'NumPy is not installed')
+    def test_historical_data_columns(self):
+        socket_in_queue = Queue()
+        message_queue = Queue()
+        bars = [['20141017  09:30:00', '1.5', '1.75', '1.25', '1.5', '100',
+                 '1.6', 'false', '7'],
+                ['20141017  09:31:00', '1.5', '2.0', '1.5', '2.0', '200',
+                 '1.8', 'true', '9']]
+        fields = [str(config.HISTORICAL_DATA), '3', '4', 'a', 'b', '2']
+        for bar in bars:
+            fields.extend(bar)
+        socket_in_queue.put(fields[:10])
+        socket_in_queue.put(fields[10:] + ['-1'])
+        handlers = reader.get_message_handlers(historical_columns=True)
+        reader.message_listener(socket_in_queue, message_queue, handlers)
+        method, (req_id, start_date, end_date, result) = message_queue.get()
+        self.assertEqual((method, req_id, start_date, end_date),
+                         ('historical_data_columns', 4, 'a', 'b'))
+        self.assertEqual(list(result['date']), [bars[0][0], bars[1][0]])
+        self.assertEqual(list(result['milliseconds']),
+                         [1413538200000, 1413538260000])
+        self.assertEqual(list(result['high']), [1.75, 2.0])
+        self.assertEqual(list(result['volume']), [100, 200])
+        self.assertEqual(list(result['bar_count']), [7, 9])
+        self.assertEqual(list(result['has_gaps']), [False, True])
+
+    def test_skip_handlers(self):
+        # Open order with an under comp and algo parameters
+        order = open_order_message(1, 1.5)
+        order = order[:-12] + [1, 5, 0.5, 1.0, 'Vwap', 2, 'a', 'b', 'c',
+                               'd'] + order[-10:]
+        messages = [tick_price_message(0, 1.5), open_order_message(0, 1.5),
+                    order, exec_details_message(0, 1.5),
+                    historical_data_message(0, 1.5, 3),
+                    [config.CONTRACT_DATA, 8, 1] + [0] * 28 +
+                    [2, 'ISIN', 'X1', 'CUSIP', 'X2'],
+                    [config.CURRENT_TIME, 1, 42]]
+        values = [str(value) for message in messages for value in message]
+        for methods, count in ((None, 11), (('current_time',), 1)):
+            fields = reader.FieldList()
+            fields.extend(values)
+            results = []
+            handlers = reader.get_message_handlers(methods=methods)
+            reader.read_messages(fields, results, handlers)
+            self.assertEqual(len(results), count)
+            self.assertEqual(results[-1], ('current_time', (42,)))
+            self.assertEqual(fields.index, len(values))
+        socket_in_queue = Queue()
+        socket_in_queue.put(values[:20])
+        socket_in_queue.put(values[20:] + ['-1'])
+        message_queue = Queue()
+        handlers = reader.get_message_handlers(methods=('current_time',))
+        reader.message_listener(socket_in_queue, message_queue, handlers)
+        self.assertEqual(message_queue.get(), ('current_time', (42,)))
+        self.assertTrue(message_queue.empty())
+
+    def test_lazy_objects(self):
+        portfolio = [config.PORTFOLIO_VALUE, 7, 100, 'SYM', 'STK', '', 0.0,
+                     '', '', 'ISLAND', 'USD', 'SYM', 100, 1.5, 150.0, 1.25,
+                     25.0, 0.0, 'DU000000']
+        messages = [open_order_message(0, 1.5), exec_details_message(0, 1.5),
+                    [config.CONTRACT_DATA, 8, 1, 'SYM'] + [1] * 27 + [0],
+                    portfolio]
+        values = [str(value) for message in messages for value in message]
+        results = []
+        for lazy_objects in (False, True):
+            fields = reader.FieldList()
+            fields.extend(values)
+            results.append([])
+            handlers = reader.get_message_handlers(lazy_objects=lazy_objects)
+            reader.read_messages(fields, results[-1], handlers)
+        for (method, parms), (lazy_method, lazy_parms) in zip(*results):
+            self.assertEqual(method, lazy_method)
+            for value, lazy_value in zip(parms, lazy_parms):
+                if not isinstance(lazy_value, LazyObject):
+                    self.assertEqual(value, lazy_value)
+                    continue
+                self.assertIsInstance(lazy_value, type(value))
+                shared = ForkingPickler.loads(ForkingPickler.dumps(lazy_value))
+                self.assertIsInstance(shared, LazyObject)
+                self.assertEqual(vars(shared.materialize()), vars(value))
+                stored = pickle.loads(pickle.dumps(lazy_value))
+                self.assertIs(type(stored), type(value))
+                self.assertEqual(vars(stored), vars(value))
+
+    def test_unknown_lazy_layout(self):
+        contract = LazyContract('unknown', [])
+        self.assertFalse(hasattr(contract, 'symbol'))
+        self.assertRaises(AttributeError, contract.materialize)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Tests for the RingBuffer, TickBuffer and BarBuffer classes."""
+import unittest
+import ibapipy.config as config
+from ibapipy.data.bar import Bar
+from ibapipy.data.ring_buffer import np
+from ibapipy.data.tick import Tick
+
+
+@unittest.skipIf(np is None, 'NumPy is not installed')
+class RingBufferTests(unittest.TestCase):
+    """Test cases for the RingBuffer, TickBuffer and BarBuffer classes."""
+
+    def test_wrap_around(self):
+        from ibapipy.data.bar_buffer import BarBuffer
+        bars = BarBuffer('eur.usd', capacity=3)
+        for index in range(5):
+            bar = Bar('eur.usd', index * 1000)
+            bar.close = float(index)
+            bars.append(bar)
+        self.assertEqual(len(bars), 3)
+        self.assertEqual(list(bars['close']), [2.0, 3.0, 4.0])
+        self.assertEqual(list(bars.last(2)['milliseconds']), [3000, 4000])
+        self.assertEqual(list(bars.between(3000, 4000)['close']), [3.0])
+        # Views share memory with the buffer rather than copying it
+        self.assertTrue(np.shares_memory(bars.view(), bars.data))
+
+    def test_tick_buffer(self):
+        from ibapipy.data.tick_buffer import TickBuffer
+        ticks = TickBuffer('eur.usd', capacity=10)
+        ticks.tick_price(1, config.BID, 1.0)
+        ticks.tick_price(2, config.ASK, 1.5)
+        ticks.tick_size(3, config.BID_SIZE, 100)
+        ticks.tick_price(4, config.HIGH, 9.0)
+        tick = Tick('eur.usd', 5)
+        tick.bid = 2.0
+        tick.ask = 3.0
+        ticks.append(tick)
+        self.assertEqual(len(ticks), 4)
+        self.assertEqual(list(ticks['bid_size']), [0, 0, 100, 0])
+        self.assertEqual(list(ticks.midpoint()), [0.5, 1.25, 1.25, 2.5])
+        self.assertEqual(list(ticks.spread(2, 5)), [0.5, 0.5])
+
+    def test_slots(self):
+        tick = Tick()
+        with self.assertRaises(AttributeError):
+            tick.unknown = 1
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Tests for the session and replay modules."""
+import os
+import tempfile
+import unittest
+from queue import Queue
+from ibapipy.benchmarks.mock_tws import (MockTWS, Traffic,
+                                         real_time_bar_message)
+from ibapipy.core.client_socket import ClientSocket
+from ibapipy.core.network_handler import encode_message
+from ibapipy.core.order_book import OrderBook
+from ibapipy.data.bar_buffer import BarBuffer
+import ibapipy.config as config
+import ibapipy.core.replay as replay
+import ibapipy.core.session as session
+
+
+class SessionTests(unittest.TestCase):
+    """Test cases for the session and replay modules."""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_read_records(self):
+        writer = session.SessionWriter(self.path)
+        writer.write(b'49\x001\x00', 1000)
+        writer.write(b'123\x00', 2000)
+        writer.close()
+        # A record cut short by a crash is ignored
+        with open(self.path, 'ab') as session_file:
+            session_file.write(session.RECORD_HEADER.pack(3000, 10) + b'9')
+        self.assertEqual(list(session.read_records(self.path)),
+                         [(1000, b'49\x001\x00'), (2000, b'123\x00')])
+        self.assertEqual(list(session.read_chunks(self.path)),
+                         [(2000, b'49\x001\x00123\x00')])
+
+    def test_capture_and_replay(self):
+        result_queue = Queue()
+        class MockClientSocket(ClientSocket):
+            def current_time(self, seconds):
+                result_queue.put(('current_time', (seconds,)))
+            def open_order(self, req_id, contract, order):
+                result_queue.put(('open_order', (req_id, order.lmt_price)))
+            def tick_price(self, req_id, tick_type, price, can_auto_execute):
+                result_queue.put(('tick_price', (req_id, tick_type, price)))
+        rates = {'open_order': 50, 'tick_price': 200}
+        server = MockTWS(Traffic(rates, duration=0.1))
+        port = server.start()
+        client = MockClientSocket(capture_path=self.path)
+        client.connect('127.0.0.1', port, 1)
+        live = []
+        while len(live) == 0 or live[-1][0] != 'current_time':
+            live.append(result_queue.get(timeout=10))
+        client.disconnect()
+        server.stop()
+        self.assertEqual(replay.replay(self.path, MockClientSocket()),
+                         len(live) + 20)
+        replayed = [result_queue.get(timeout=1) for item in live]
+        self.assertEqual(replayed, live)
+        self.assertTrue(result_queue.empty())
+
+    def test_replay_real_time_bars(self):
+        lengths = []
+        class MockClientSocket(ClientSocket):
+            def real_time_bar(self, req_id, *parms):
+                lengths.append(len(self.bar_buffers[req_id]))
+        writer = session.SessionWriter(self.path)
+        for sequence in range(3):
+            fields = real_time_bar_message(sequence * 10, 1413536400.0)
+            writer.write(encode_message(*fields), 1000 * (sequence + 1))
+        writer.close()
+        client = MockClientSocket()
+        client.bar_buffers[1] = BarBuffer('SYM', 10)
+        self.assertEqual(replay.replay(self.path, client), 3)
+        # Each bar is in the buffer by the time its callback is made
+        self.assertEqual(lengths, [1, 2, 3])
+
+    def test_replay_order_book(self):
+        books = []
+        class MockClientSocket(ClientSocket):
+            def update_mkt_depth(self, *args):
+                raise AssertionError('update_mkt_depth should not be called')
+            def update_order_book(self, req_id, order_book):
+                books.append((req_id, order_book.best_bid(req_id)))
+        writer = session.SessionWriter(self.path)
+        for sequence, (price, size) in enumerate(((1.5, 100), (1.6, 200))):
+            fields = [config.MARKET_DEPTH, 1, 4, 0, sequence,
+                      config.DEPTH_BID, price, size]
+            writer.write(encode_message(*fields),
+                         (1413536400000 + sequence) * 1000000)
+        writer.close()
+        client = MockClientSocket(order_book=OrderBook(interval_ms=50))
+        self.assertEqual(replay.replay(self.path, client), 2)
+        # The second change is held back by the interval and published at
+        # the end of the replay
+        self.assertEqual(books, [(4, (1.5, 100)), (4, (1.6, 200))])
+
+
+if __name__ == '__main__':
+    unittest.main()
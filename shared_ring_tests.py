@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Tests for the SharedRing class."""
+import unittest
+from multiprocessing import Process, resource_tracker
+from multiprocessing.queues import Empty
+from queue import Queue
+from unittest import mock
+from ibapipy.benchmarks.mock_tws import MockTWS, tick_price_message
+from ibapipy.core.client_socket import ClientSocket
+from ibapipy.core.network_handler import SHARED_MEMORY_TRANSPORT
+from ibapipy.core.shared_ring import DATA_OFFSET, SharedRing, attach
+import ibapipy.config as config
+
+
+def produce(ring, count):
+    """Put 'count' items alternating between bytes and tuples, followed by
+    one item larger than the ring.
+
+    """
+    for index in range(count):
+        if index % 2 == 0:
+            ring.put(str(index).encode('utf-8'))
+        else:
+            ring.put(('item', (index,)))
+    ring.put(bytes(range(256)) * 64)
+
+
+class SharedRingTests(unittest.TestCase):
+    """Test cases for the SharedRing class."""
+
+    def test_processes(self):
+        ring = SharedRing(capacity=1000, stop_item='stop')
+        process = Process(target=produce, args=(ring, 2000))
+        process.start()
+        try:
+            for index in range(2000):
+                item = ring.get(timeout=10)
+                if index % 2 == 0:
+                    self.assertEqual(item, str(index).encode('utf-8'))
+                else:
+                    self.assertEqual(item, ('item', (index,)))
+            self.assertEqual(ring.get(timeout=10), bytes(range(256)) * 64)
+            process.join()
+            with self.assertRaises(Empty):
+                ring.get(timeout=0.05)
+            ring.finish()
+            self.assertEqual(ring.get_nowait(), 'stop')
+        finally:
+            ring.unlink()
+
+    def test_qsize(self):
+        ring = SharedRing(capacity=1000)
+        try:
+            ring.put(b'raw')
+            ring.put(('item', (1,)))
+            self.assertEqual(ring.qsize(), 2)
+            self.assertEqual(ring.get(), b'raw')
+            self.assertEqual(ring.qsize(), 1)
+            self.assertFalse(ring.empty())
+            ring.get()
+            self.assertEqual(ring.qsize(), 0)
+            self.assertTrue(ring.empty())
+        finally:
+            ring.unlink()
+
+    def test_attach(self):
+        ring = SharedRing(capacity=1000)
+        try:
+            with mock.patch.object(resource_tracker, 'register') as register:
+                memory = attach(ring.memory.name)
+                memory.buf[DATA_OFFSET] = 7
+                memory.close()
+            self.assertFalse(register.called)
+            self.assertEqual(ring.memory.buf[DATA_OFFSET], 7)
+        finally:
+            ring.unlink()
+
+    def test_client(self):
+        def script(connection):
+            connection.read_field()
+            connection.read_field()
+            connection.send(*[tick_price_message(sequence, 1.5)
+                              for sequence in range(100)])
+            connection.send([config.CURRENT_TIME, 1, 0])
+        result_queue = Queue()
+        class MockClientSocket(ClientSocket):
+            def current_time(self, seconds):
+                result_queue.put(None)
+            def tick_price(self, req_id, tick_type, price, can_auto_execute):
+                result_queue.put(price)
+        server = MockTWS(script)
+        port = server.start()
+        client = MockClientSocket(transport=SHARED_MEMORY_TRANSPORT)
+        client.connect('127.0.0.1', port, 1)
+        try:
+            client.req_current_time()
+            prices = list(iter(lambda: result_queue.get(timeout=10), None))
+        finally:
+            client.disconnect()
+            server.stop()
+        self.assertEqual(prices, [1.5] * 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
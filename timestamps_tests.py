@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Tests for the timestamps module."""
+import unittest
+import ibapipy.core.timestamps as timestamps
+
+
+class TimestampsTests(unittest.TestCase):
+    """Test cases for the timestamps module."""
+
+    def test_ib_time_to_ms(self):
+        self.assertEqual(timestamps.ib_time_to_ms('20141017  09:30:00'),
+                         1413538200000)
+        self.assertEqual(timestamps.ib_time_to_ms('20141017'), 1413504000000)
+        self.assertEqual(timestamps.ib_time_to_ms('1413538200'),
+                         1413538200000)
+        self.assertEqual(timestamps.ib_time_to_ms('20141017  09:30:00',
+                                                  'US/Eastern'),
+                         1413552600000)
+        self.assertEqual(timestamps.ib_time_to_ms(
+            '20141017 09:30:00 US/Eastern'), 1413552600000)
+
+    def test_daylight_savings(self):
+        # Clocks go forward at 02:00 on 9 March 2014 in US/Eastern
+        before = timestamps.ib_time_to_ms('20140309  01:59:59', 'US/Eastern')
+        after = timestamps.ib_time_to_ms('20140309  03:00:00', 'US/Eastern')
+        self.assertEqual(after - before, 1000)
+        self.assertEqual(timestamps.str_to_ms('20140309  03:00:00',
+                                              'US/Eastern',
+                                              '%Y%m%d  %H:%M:%S'), after)
+
+    def test_half_hour_transition(self):
+        # Clocks go back from 02:00 to 01:30 on 6 April 2014 in Lord Howe
+        for time_str in ('20140406  01:15:00', '20140406  01:45:00'):
+            self.assertEqual(
+                timestamps.ib_time_to_ms(time_str, 'Australia/Lord_Howe'),
+                timestamps.str_to_ms(time_str, 'Australia/Lord_Howe',
+                                     '%Y%m%d  %H:%M:%S'))
+
+    @unittest.skipIf(timestamps.np is None, 'NumPy is not installed')
+    def test_bar_dates_to_ms(self):
+        for dates, timezone in (
+                (['20140309  01:00:00', '20140309  03:00:00'], 'US/Eastern'),
+                (['20140309 01:00:00', '20140309 03:00:00'], 'US/Eastern'),
+                (['20140309', '20140310'], 'US/Eastern'),
+                (['1394344800', '1394348400'], 'US/Eastern'),
+                (['20140309', '20140309  03:00:00'], 'US/Eastern'),
+                (['20140406  01:15:00', '20140406  01:45:00'],
+                 'Australia/Lord_Howe')):
+            expected = [timestamps.ib_time_to_ms(date, timezone)
+                        for date in dates]
+            self.assertEqual(list(timestamps.bar_dates_to_ms(
+                dates, timezone)), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()